@@ -1,8 +1,22 @@
-from flask import request, jsonify
-from api.session import Session
-from typing import Optional, Union
+from flask import request, Response, stream_with_context, g
+from api.session import current_session
+from typing import Optional, Union, Callable, Iterable, Iterator, Tuple
 from sqlalchemy.exc import IntegrityError
-import json
+from api.codec import dumps, loads
+
+MAX_PAGE_SIZE = 1000  # 分页查询单页最大条数
+STREAM_CHUNK_SIZE = 500  # 流式返回时每次查询的行数
+
+
+class PageInfo:
+    def __init__(self, limit, after, stream):
+        self.limit: Optional[int] = limit
+        self.after: Optional[str] = after
+        self.stream: bool = stream
+
+    @property
+    def paged(self) -> bool:
+        return self.limit is not None
 
 
 class RequestData:
@@ -45,8 +59,19 @@ class ErrCode:
     LOAN_TOO_MUCH = 211
     LOAN_STILL_PAYING = 212
 
+    ACCOUNT_NO_EXIST = 220
+    ACCOUNT_INSUFFICIENT = 221
+    ACCOUNT_VERSION_CONFLICT = 222
+
+
+def json_response(data) -> Response:
+    return Response(dumps(data), mimetype='application/json')
+
 
 def generate_error(code: int, message: str, sql_error: Optional[str] = None):
+    # 返回错误的请求不提交事务，见api/transaction.py；错误码同时计入/metrics
+    g.db_rollback = True
+    g.api_code = code
     data = {
         'success': False,
         'code': code,
@@ -54,18 +79,18 @@ def generate_error(code: int, message: str, sql_error: Optional[str] = None):
     }
     if sql_error:
         data.update({'sql_err': sql_error})
-    return jsonify(data)
+    return json_response(data)
 
 
 def generate_success(data: Optional[Union[dict, list]] = None):
     if data is None:
-        dt = jsonify({
+        dt = json_response({
             'success': True,
             'msg': '',
             'code': 0,
         })
     else:
-        dt = jsonify({
+        dt = json_response({
                 'success': True,
                 'msg': '',
                 'code': 0,
@@ -74,11 +99,99 @@ def generate_success(data: Optional[Union[dict, list]] = None):
     return dt
 
 
-def pre_process() -> RequestData:
+def generate_success_stream(chunks: Iterable[list]):
+    """
+    流式返回列表数据，外层结构与generate_success一致
+    每次写出一个分块，内存占用只与分块大小有关
+    :param chunks: 待序列化的分块迭代器，元素可直接包含Decimal/date
+    :return:
+    """
+    def generate():
+        yield b'{"success":true,"msg":"","code":0,"data":['
+        first = True
+        for chunk in chunks:
+            if not chunk:
+                continue
+            # 整块序列化后去掉外层方括号，拼接为同一个数组
+            body = dumps(chunk)[1:-1]
+            yield body if first else b',' + body
+            first = False
+        yield b']}'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+
+def parse_page_args() -> Tuple[Optional[PageInfo], str]:
+    """
+    解析get_all类接口的分页参数(URL参数)
+    limit: 单页条数，不提供则返回全部数据
+    after: 上一页返回的next游标(主键)，不提供则从头开始
+    stream: 为1时以流式分块返回全部数据
+    :return: 解析成功返回PageInfo，失败返回None及错误信息
+    """
+    limit = request.args.get('limit', None)
+    after = request.args.get('after', None) or None
+    stream = request.args.get('stream', '0') in ('1', 'true')
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            return None, 'limit参数应为整数'
+        if not 0 < limit <= MAX_PAGE_SIZE:
+            return None, f'limit参数应在1~{MAX_PAGE_SIZE}之间'
+    return PageInfo(limit, after, stream), ''
+
+
+def keyset_page(query, key_column, page: PageInfo, key_of: Callable, serializer: Callable) -> dict:
+    """
+    基于主键的游标分页
+    :param query: 未排序的查询
+    :param key_column: 分页所依据的主键列
+    :param page: 分页参数
+    :param key_of: 从结果行中取出主键值
+    :param serializer: 将一页结果行序列化为list
+    :return: {'items': list, 'next': 下一页游标，无更多数据时为None}
+    """
+    if page.after is not None:
+        query = query.filter(key_column > page.after)
+    rows = query.order_by(key_column).limit(page.limit + 1).all()
+    has_more = len(rows) > page.limit
+    rows = rows[:page.limit]
+    return {
+        'items': serializer(rows),
+        'next': key_of(rows[-1]) if has_more else None
+    }
+
+
+def stream_query(query, key_column, key_of: Callable, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[list]:
+    """
+    按主键分页逐块读取查询结果
+    每块是一次独立的LIMIT查询，读完后才返回，调用方可以在同一连接上为该块执行其他查询；
+    不使用服务端游标，pymysql的非缓冲游标在同一连接执行其他查询时会丢弃未读取的结果
+    :param query: 未排序的查询
+    :param key_column: 分页所依据的主键列
+    :param key_of: 从结果行中取出主键值
+    :param chunk_size: 每块行数
+    :return: 结果行分块的迭代器
+    """
+    last = None
+    while True:
+        page = query if last is None else query.filter(key_column > last)
+        chunk = page.order_by(key_column).limit(chunk_size).all()
+        if not chunk:
+            return
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last = key_of(chunk[-1])
+
+
+def pre_process(parse_body: bool = True) -> RequestData:
     """
     预处理请求
     检查登录状态，反序列化数据
     ** 一定要在请求环境中调用，否则出错 **
+    :param parse_body: 为False时不读取请求体，供需要流式读取请求体的接口使用
     :return:
     """
     user_id = request.headers.get('USER_ID', None)
@@ -86,17 +199,28 @@ def pre_process() -> RequestData:
     err_msg = ''
     msg = ''
     data = None
-    try:
-        data = json.loads(request.data)
-    except json.JSONDecodeError as e:
-        print(e)
-        err_msg = '无法解析数据'
+    if parse_body:
+        try:
+            data = loads(request.data)
+        except ValueError as e:
+            print(e)
+            err_msg = '无法解析数据'
     logged = user_id and session
     if logged:
-        logged, msg = Session.verify_session(user_id, session)
+        logged, msg = current_session().verify_session(user_id, session)
     return RequestData(logged, user_id, data, err_msg, msg, session)
 
 
+def attach_renewed_session(response: Response) -> Response:
+    """
+    token模式下将换发的新Token通过SESSION响应头返回，客户端应以其替换旧Token
+    """
+    renewed = g.pop('renewed_session', None)
+    if renewed:
+        response.headers['SESSION'] = renewed
+    return response
+
+
 def parse_sqlerror(err: IntegrityError):
     arg = err.args[0]
     arg = arg[29:]
@@ -1,50 +1,75 @@
 """
 账户管理相关API
 """
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request
 from sqlalchemy.exc import IntegrityError
-from random import randint
-from threading import Lock
+from decimal import Decimal
+from typing import Dict, Set, Tuple
 from data_type import *
 from ext import database
-from api.__util import generate_error, pre_process, parse_sqlerror, generate_success, ErrCode
+import config
+from api.allocator import card_allocator
+from api.__util import generate_error, pre_process, parse_sqlerror, generate_success, ErrCode, SQLErr, \
+    parse_page_args, keyset_page, stream_query, generate_success_stream
 
 ac_bp = Blueprint('AccountManagement', 'AccountManagement', url_prefix='/account')
 
-card_list = []
-t_lock = Lock()
 
+HOLDER_QUERY_CHUNK = 500  # 单条IN查询最多携带的账户ID数量
+
+
+def load_holders(account_ids: List[str]) -> Dict[str, List[str]]:
+    """
+    批量获取账户的持卡人列表
+    按HOLDER_QUERY_CHUNK分块执行IN查询，代替逐账户查询
+    :param account_ids: 账户ID列表
+    :return: 账户ID -> 持卡人ID列表
+    """
+    holders: Dict[str, List[str]] = {account_id: [] for account_id in account_ids}
+    ids = list(holders.keys())
+    for i in range(0, len(ids), HOLDER_QUERY_CHUNK):
+        rels = database.session.query(RelationAccountCustomerBranch.account_id,
+                                      RelationAccountCustomerBranch.customer_id). \
+            filter(RelationAccountCustomerBranch.account_id.in_(ids[i:i + HOLDER_QUERY_CHUNK])). \
+            order_by(RelationAccountCustomerBranch.id).all()
+        for account_id, customer_id in rels:
+            holders[account_id].append(customer_id)
+    return holders
+
+
+def account_row2dict(account: List[Union[Account, CheckingAccount, SavingAccount]], holder: List[str]) -> dict:
+    """
+    序列化一行 (Account, CheckingAccount, SavingAccount) 查询结果
+    :param account: 查询结果行
+    :param holder: 持卡人列表
+    :return:
+    """
+    return {
+        'account_id': account[0].account_id,
+        'refund': account[0].refund,
+        'open_date': account[0].open_date,
+        'sub_branch': account[0].sub_branch,
+        'recent_visit': account[0].recent_visit,
+        'type': account[0].type,
+        'version': account[0].version,
+        'rate': account[2].rate if account[2] is not None else None,
+        'finance': account[2].finance if account[2] is not None else None,
+        'overdraft': account[1].overdraft if account[1] is not None else None,
+        'holder': holder  # 持卡人列表
+    }
 
-def account2dict(accounts: List[Union[Account, CheckingAccount, SavingAccount]]) -> Union[List[dict], dict]:
-    def acc2d(account: List[Union[Account, CheckingAccount, SavingAccount]]):
-        holder = []
-        rels: List[RelationAccountCustomerBranch] = RelationAccountCustomerBranch.query.filter(
-            RelationAccountCustomerBranch.account_id == account[0].account_id).all()
-        for rel in rels:
-            holder.append(rel.customer_id)
-        return {
-            'account_id': account[0].account_id,
-            'refund': float(account[0].refund),
-            'open_date': account[0].open_date.strftime('%Y-%m-%d'),
-            'sub_branch': account[0].sub_branch,
-            'recent_visit': account[0].recent_visit.strftime('%Y-%m-%d'),
-            'type': account[0].type,
-            'rate': float(account[2].rate) if account[2] is not None else None,
-            'finance': account[2].finance if account[2] is not None else None,
-            'overdraft': float(account[1].overdraft) if account[1] is not None else None,
-            'holder': holder  # 持卡人列表
-        }
 
+def account2dict(accounts: List[Union[Account, CheckingAccount, SavingAccount]]) -> Union[List[dict], dict]:
     if not accounts:
         return []
 
     if isinstance(accounts, list):
-        ret = []
-        for account in accounts:
-            ret.append(acc2d(account))
-        return ret
+        # 一次性获取整个结果集的持卡人，避免逐账户查询
+        holders = load_holders([account[0].account_id for account in accounts])
+        return [account_row2dict(account, holders[account[0].account_id]) for account in accounts]
     else:
-        return acc2d(accounts)
+        holders = load_holders([accounts[0].account_id])
+        return account_row2dict(accounts, holders[accounts[0].account_id])
 
 
 @ac_bp.route('/create', methods=['POST'])
@@ -89,30 +114,25 @@ def create_account():
             return generate_error(ErrCode.UNKNOWN_ACC_TYPE, "未知的账户类型 " + str(ac_type))
     except KeyError:
         return generate_error(ErrCode.PARAM_LOST, '创建账户所需数据不完整')
-    card_id = randint(0, 10 ** 18)
+    money = parse_money(rate if ac_type == AccountType.SAVING else overdraft, positive=False)
+    if money is None:
+        return generate_error(ErrCode.PARAM_TYPE_MISMATCH, '利率或透支额度应为至多两位小数的数值')
     # 生成卡号
-    t_lock.acquire(blocking=True)
-    while str(card_id).zfill(19) in card_list:
-        card_id += 1
-    card_id = str(card_id).zfill(19)
-    card_list.append(card_id)
-    t_lock.release()
+    card_id = card_allocator.next_id()
     # 执行插入操作
-    transaction = database.session.begin()
     account = Account(
         card_id, branch_name, ac_type
     )
+    sub_account = SavingAccount(card_id, money, finance) if ac_type == AccountType.SAVING \
+        else CheckingAccount(card_id, money)
     database.session.add(account)
-    if ac_type == AccountType.SAVING:
-        database.session.add(SavingAccount(card_id, rate, finance))
-    else:
-        database.session.add(CheckingAccount(card_id, overdraft))
+    database.session.add(sub_account)
     # 验证支行-用户-账户类型限制
     for user in user_ids:
         database.session.add(RelationAccountCustomerBranch(card_id, user, ac_type, branch_name))
-    # 提交验证及异常检测回滚
+    # 写入验证及异常检测回滚
     try:
-        database.session.commit()
+        database.session.flush()
     except IntegrityError as e:
         code, err_type, msg = parse_sqlerror(e)
         if code == 1062:
@@ -121,10 +141,7 @@ def create_account():
             response = generate_error(1452, 'REFERENCE参照失败。请注意支行名/用户ID是否存在')
         else:
             response = generate_error(code, '未知SQL执行异常\n' + msg)
-        transaction.rollback()
-        t_lock.acquire(blocking=True)
-        card_list.remove(card_id)
-        t_lock.release()
+        database.session.rollback()
         return response
     target = database.session.query(Account, CheckingAccount, SavingAccount).filter(Account.account_id == card_id). \
         outerjoin(CheckingAccount, Account.account_id == CheckingAccount.account_id). \
@@ -132,6 +149,162 @@ def create_account():
     return generate_success(account2dict(target))
 
 
+def _check_account_spec(spec) -> Optional[Tuple[int, str]]:
+    """
+    检查批量创建中单个账户描述是否完整、类型是否正确
+    通过检查时将利率、透支额度替换为与数据库列一致的Decimal
+    :return: 不通过时返回(错误码, 错误信息)
+    """
+    if not isinstance(spec, dict):
+        return ErrCode.PARAM_TYPE_MISMATCH, '账户描述应为对象'
+    holders = spec.get('holder')
+    if not isinstance(holders, list) or not holders:
+        return ErrCode.PARAM_LOST, '无法获取持卡人列表或列表为空'
+    if not all(isinstance(user, str) for user in holders):
+        return ErrCode.PARAM_TYPE_MISMATCH, '持卡人ID应为字符串'
+    if len(set(holders)) != len(holders):
+        return ErrCode.PARAM_LOST, '持卡人列表存在重复'
+    if not spec.get('sub_branch'):
+        return ErrCode.PARAM_LOST, '缺少开卡支行'
+    if not isinstance(spec['sub_branch'], str):
+        return ErrCode.PARAM_TYPE_MISMATCH, '开卡支行应为字符串'
+    ac_type = spec.get('type')
+    if isinstance(ac_type, bool):
+        return ErrCode.PARAM_TYPE_MISMATCH, '未知的账户类型 ' + str(ac_type)
+    if ac_type == AccountType.SAVING:
+        if spec.get('rate') is None or spec.get('finance') is None:
+            return ErrCode.PARAM_LOST, '储蓄账户缺少利率或货币类型'
+        rate = parse_money(spec['rate'], positive=False)
+        if rate is None or not isinstance(spec['finance'], str):
+            return ErrCode.PARAM_TYPE_MISMATCH, '利率应为至多两位小数的数值，货币类型应为字符串'
+        spec['rate'] = rate
+    elif ac_type == AccountType.CHECKING:
+        if spec.get('overdraft') is None:
+            return ErrCode.PARAM_LOST, '支票账户缺少透支额度'
+        overdraft = parse_money(spec['overdraft'], positive=False)
+        if overdraft is None:
+            return ErrCode.PARAM_TYPE_MISMATCH, '透支额度应为至多两位小数的数值'
+        spec['overdraft'] = overdraft
+    else:
+        return ErrCode.PARAM_LOST, '未知的账户类型 ' + str(ac_type)
+    return None
+
+
+def _insert_accounts(items: List[Tuple[str, dict]]):
+    """
+    以批量INSERT写入账户、子类型及持卡人关联，调用方负责事务
+    :param items: (卡号, 账户描述) 列表
+    """
+    today = datetime.date.today()
+    accounts, savings, checkings, rels = [], [], [], []
+    for card_id, spec in items:
+        accounts.append({'account_id': card_id, 'refund': 0, 'open_date': today, 'recent_visit': today,
+                         'sub_branch': spec['sub_branch'], 'type': spec['type']})
+        if spec['type'] == AccountType.SAVING:
+            savings.append({'account_id': card_id, 'rate': spec['rate'], 'finance': spec['finance']})
+        else:
+            checkings.append({'account_id': card_id, 'overdraft': spec['overdraft']})
+        for user in spec['holder']:
+            rels.append({'account_id': card_id, 'customer_id': user, 'type': spec['type'],
+                         'branch': spec['sub_branch']})
+    database.session.execute(Account.__table__.insert(), accounts)
+    if savings:
+        database.session.execute(SavingAccount.__table__.insert(), savings)
+    if checkings:
+        database.session.execute(CheckingAccount.__table__.insert(), checkings)
+    database.session.execute(RelationAccountCustomerBranch.__table__.insert(), rels)
+
+
+@ac_bp.route('/create_batch', methods=['POST'])
+def create_account_batch():
+    """
+    批量创建账户
+    json payload格式
+    {
+        'accounts': [
+            {
+                'holder': [str, ...],
+                'sub_branch': str,
+                'type': int,
+                'rate': float,          // 储蓄账户
+                'finance': str,         // 储蓄账户
+                'overdraft': float      // 支票账户
+            },
+            ...
+        ]
+    }
+    :return:
+    data区按请求顺序返回每一项的结果，失败项不影响其他项
+    [
+        {'success': True, 'account_id': str} 或 {'success': False, 'code': int, 'msg': str},
+        ...
+    ]
+    """
+    data = pre_process()
+    if not data.logged_in:
+        return generate_error(ErrCode.NO_LOGIN, data.login_message)
+    if not data.data:
+        return generate_error(400, data.error_message)
+    specs = data.data.get('accounts', None)
+    if not isinstance(specs, list):
+        return generate_error(ErrCode.PARAM_LOST, '无法获取账户列表')
+    if len(specs) > config.BATCH_MAX_SIZE:
+        return generate_error(ErrCode.PARAM_TYPE_MISMATCH, f'单次最多创建{config.BATCH_MAX_SIZE}个账户')
+    results: List[Optional[dict]] = [None] * len(specs)
+    for i, spec in enumerate(specs):
+        error = _check_account_spec(spec)
+        if error:
+            results[i] = {'success': False, 'code': error[0], 'msg': error[1]}
+    valid = [i for i in range(len(specs)) if results[i] is None]
+    # 一次性检查参照及 用户-账户类型-支行 唯一约束
+    branch_names = {specs[i]['sub_branch'] for i in valid}
+    customer_ids = list({user for i in valid for user in specs[i]['holder']})
+    branches: Set[str] = {it[0] for it in database.session.query(SubBranch.name).
+                          filter(SubBranch.name.in_(branch_names)).all()} if branch_names else set()
+    customers: Set[str] = set()
+    taken: Set[Tuple[str, int, str]] = set()
+    for j in range(0, len(customer_ids), HOLDER_QUERY_CHUNK):
+        chunk = customer_ids[j:j + HOLDER_QUERY_CHUNK]
+        customers.update(it[0] for it in database.session.query(Customer.user_id).
+                         filter(Customer.user_id.in_(chunk)).all())
+        taken.update(database.session.query(RelationAccountCustomerBranch.customer_id,
+                                            RelationAccountCustomerBranch.type,
+                                            RelationAccountCustomerBranch.branch).
+                     filter(RelationAccountCustomerBranch.customer_id.in_(chunk)).all())
+    items: List[Tuple[int, str, dict]] = []
+    for i in valid:
+        spec = specs[i]
+        if spec['sub_branch'] not in branches or any(user not in customers for user in spec['holder']):
+            results[i] = {'success': False, 'code': SQLErr.NO_REFERENCE,
+                          'msg': 'REFERENCE参照失败。请注意支行名/用户ID是否存在'}
+            continue
+        keys = {(user, spec['type'], spec['sub_branch']) for user in spec['holder']}
+        if keys & taken:
+            results[i] = {'success': False, 'code': SQLErr.DUPLICATE_ENTRY,
+                          'msg': 'UNIQUE约束失败。请注意同一用户不能在同一支行下创建了多个储蓄/支付账户'}
+            continue
+        taken.update(keys)
+        items.append((i, card_allocator.next_id(), spec))
+    # 执行批量插入
+    if items:
+        try:
+            with database.session.begin_nested():
+                _insert_accounts([(card_id, spec) for _, card_id, spec in items])
+        except IntegrityError:
+            # 检查后被并发请求抢先写入，退化为逐项插入（各自一个保存点）以定位失败项
+            for i, card_id, spec in items:
+                try:
+                    with database.session.begin_nested():
+                        _insert_accounts([(card_id, spec)])
+                except IntegrityError:
+                    results[i] = {'success': False, 'code': ErrCode.SQL_UNKNOWN_ERROR,
+                                  'msg': 'SQL插入异常，可能出现参照或重复错误'}
+        for i, card_id, _ in items:
+            if results[i] is None:
+                results[i] = {'success': True, 'account_id': card_id}
+    return generate_success(results)
+
+
 @ac_bp.route('/modify', methods=['POST'])
 def modify():
     """
@@ -149,6 +322,7 @@ def modify():
                 'overdraft': float(account[2].overdraft) if account[2] is not None else None,
                 'holder': holder  # 持卡人列表
             }
+    可选字段version为客户端读取时的账户版本号，若账户已被他人修改则拒绝本次更新
     :return:
     """
     data = pre_process()
@@ -160,60 +334,168 @@ def modify():
     if not account_id:
         return generate_error(ErrCode.PARAM_LOST, '请求信息缺少账户ID')
     holders = data.data.get('holder', [])
-    account: Account = Account.query.filter(Account.account_id == account_id).first()
     if not holders:
         return generate_error(ErrCode.PARAM_LOST, '无法获取持卡人列表或列表为空')
-    if not account:
-        return generate_error(400, '待修改的账户不存在')
     refund = data.data.get('refund', None)
     if refund is None:
         return generate_error(400, '请求信息缺少目标值')
-    account.refund = refund
-    s_ac: Optional[SavingAccount] = None
-    c_ac: Optional[CheckingAccount] = None
+    # 一次联表查询获取账户、子类型及所有持卡人
+    rows = database.session.query(Account, CheckingAccount, SavingAccount, RelationAccountCustomerBranch.customer_id). \
+        filter(Account.account_id == account_id). \
+        outerjoin(CheckingAccount, Account.account_id == CheckingAccount.account_id). \
+        outerjoin(SavingAccount, Account.account_id == SavingAccount.account_id). \
+        outerjoin(RelationAccountCustomerBranch, Account.account_id == RelationAccountCustomerBranch.account_id). \
+        order_by(RelationAccountCustomerBranch.id).all()
+    if not rows:
+        return generate_error(400, '待修改的账户不存在')
+    account: Account = rows[0][0]
+    version = data.data.get('version', None)
+    if version is None:
+        version = account.version
+    elif version != account.version:
+        return generate_error(ErrCode.ACCOUNT_VERSION_CONFLICT, '账户已被修改，请刷新后重试')
     if account.type == AccountType.SAVING:
         rate = data.data.get('rate', None)
         finance = data.data.get('finance', None)
         if rate is None or finance is None:
             return generate_error(ErrCode.PARAM_LOST, '请求信息缺少目标值')
-        s_ac = SavingAccount.query.filter(SavingAccount.account_id == account_id).first()
-        s_ac.rate = rate
-        s_ac.finance = finance
     elif account.type == AccountType.CHECKING:
         overdraft = data.data.get('overdraft', None)
         if overdraft is None:
             return generate_error(ErrCode.PARAM_LOST, '请求信息缺少目标值')
-        c_ac = CheckingAccount.query.filter(CheckingAccount.account_id == account_id).first()
-        c_ac.overdraft = overdraft
-    transaction = database.session.begin()
-    database.session.add(account)
-    if s_ac:
-        database.session.add(s_ac)
-    if c_ac:
-        database.session.add(c_ac)
-    # 处理所有用户变更：
-    # 移除被取消关联的账户
-    rels: List[RelationAccountCustomerBranch] = RelationAccountCustomerBranch.query.filter(
-        RelationAccountCustomerBranch.account_id == account_id).all()
-    for rel in rels:
-        if rel.customer_id not in holders:
-            database.session.delete(rel)
-        else:
-            holders.remove(rel.customer_id)
-    # 添加新关联的账户
+    refund = parse_money(refund, positive=False)
+    if account.type == AccountType.SAVING:
+        rate = parse_money(rate, positive=False)
+    elif account.type == AccountType.CHECKING:
+        overdraft = parse_money(overdraft, positive=False)
+    if refund is None or (account.type == AccountType.SAVING and rate is None) or \
+            (account.type == AccountType.CHECKING and overdraft is None):
+        return generate_error(ErrCode.PARAM_TYPE_MISMATCH, '金额、利率或透支额度应为至多两位小数的数值')
+    # 处理所有用户变更
+    current = [row[3] for row in rows if row[3] is not None]
+    current_set, target_set = set(current), set(holders)
+    removed = current_set - target_set
+    added, seen = [], set()
     for hold in holders:
-        database.session.add(
-            RelationAccountCustomerBranch(account_id, hold, account.type, account.sub_branch)
-        )
+        if hold not in current_set and hold not in seen:
+            seen.add(hold)
+            added.append(hold)
     try:
-        database.session.commit()
+        # 以版本号为条件更新，账户已被他人修改时不生效
+        updated = database.session.execute(
+            Account.__table__.update().
+            where(Account.account_id == account_id).where(Account.version == version).
+            values(refund=refund, version=version + 1)).rowcount
+        if not updated:
+            return generate_error(ErrCode.ACCOUNT_VERSION_CONFLICT, '账户已被修改，请刷新后重试')
+        if account.type == AccountType.SAVING:
+            database.session.execute(
+                SavingAccount.__table__.update().where(SavingAccount.account_id == account_id).
+                values(rate=rate, finance=finance))
+        elif account.type == AccountType.CHECKING:
+            database.session.execute(
+                CheckingAccount.__table__.update().where(CheckingAccount.account_id == account_id).
+                values(overdraft=overdraft))
+        # 移除被取消关联的账户
+        if removed:
+            database.session.execute(
+                RelationAccountCustomerBranch.__table__.delete().
+                where(RelationAccountCustomerBranch.account_id == account_id).
+                where(RelationAccountCustomerBranch.customer_id.in_(removed)))
+        # 添加新关联的账户
+        if added:
+            database.session.execute(RelationAccountCustomerBranch.__table__.insert(), [
+                {'account_id': account_id, 'customer_id': hold, 'type': account.type, 'branch': account.sub_branch}
+                for hold in added])
     except IntegrityError as e:
-        transaction.rollback()
+        database.session.rollback()
         return generate_error(500, str(e))
-    target = database.session.query(Account, CheckingAccount, SavingAccount).filter(Account.account_id == account_id). \
-        outerjoin(CheckingAccount, Account.account_id == CheckingAccount.account_id). \
-        outerjoin(SavingAccount, Account.account_id == SavingAccount.account_id).first()
-    return generate_success(account2dict(target))
+    # 以内存中的数据构造返回值
+    result = account_row2dict(rows[0][:3], [hold for hold in current if hold in target_set] + added)
+    result.update({'refund': refund, 'version': version + 1})
+    if account.type == AccountType.SAVING:
+        result.update({'rate': rate, 'finance': finance})
+    elif account.type == AccountType.CHECKING:
+        result['overdraft'] = overdraft
+    return generate_success(result)
+
+
+def apply_delta(account_id: str, delta: Decimal):
+    """
+    以单条条件UPDATE原子地修改账户余额
+    支票账户余额最低可至透支额度的相反数，其他账户余额不能为负
+    :param account_id: 账户ID
+    :param delta: 余额变化量，正数为存入，负数为取出
+    :return: 成功返回(True, 新余额, 新版本号)，失败返回(False, 错误码, 错误信息)
+    """
+    acc = Account.__table__
+    stmt = acc.update().where(acc.c.account_id == account_id).values(
+        refund=acc.c.refund + delta, version=acc.c.version + 1, recent_visit=datetime.date.today())
+    if delta < 0:
+        overdraft = database.select([CheckingAccount.overdraft]). \
+            where(CheckingAccount.account_id == acc.c.account_id).scalar_subquery()
+        limit = database.case([(acc.c.type == AccountType.CHECKING, database.func.coalesce(overdraft, 0))], else_=0)
+        stmt = stmt.where(acc.c.refund + delta >= -limit)
+    if database.session.execute(stmt).rowcount == 0:
+        exist = database.session.query(Account.account_id).filter(Account.account_id == account_id).first()
+        if not exist:
+            return False, ErrCode.ACCOUNT_NO_EXIST, '账户不存在'
+        return False, ErrCode.ACCOUNT_INSUFFICIENT, '余额不足或超出透支额度'
+    refund, version = database.session.query(Account.refund, Account.version). \
+        filter(Account.account_id == account_id).first()
+    return True, refund, version
+
+
+def _balance_change(sign: int):
+    data = pre_process()
+    if not data.logged_in:
+        return generate_error(ErrCode.NO_LOGIN, data.login_message)
+    if not data.data:
+        return generate_error(400, data.error_message)
+    account_id = data.data.get('account_id', None)
+    amount = data.data.get('amount', None)
+    if not account_id or amount is None:
+        return generate_error(ErrCode.PARAM_LOST, '请求信息缺少账户ID或金额')
+    amount = parse_money(amount)
+    if amount is None:
+        return generate_error(ErrCode.PARAM_TYPE_MISMATCH, '金额应为大于0且至多两位小数的数值')
+    success, code_or_refund, msg_or_version = apply_delta(account_id, sign * amount)
+    if not success:
+        return generate_error(code_or_refund, msg_or_version)
+    return generate_success({
+        'account_id': account_id,
+        'refund': code_or_refund,
+        'version': msg_or_version
+    })
+
+
+@ac_bp.route('/deposit', methods=['POST'])
+def deposit():
+    """
+    存款
+    json payload格式
+    {
+        'account_id': str,
+        'amount': float     // 存入金额，大于0
+    }
+    :return:
+    {
+        'account_id': str,
+        'refund': float,    // 操作后余额
+        'version': int      // 操作后账户版本号
+    }
+    """
+    return _balance_change(1)
+
+
+@ac_bp.route('/withdraw', methods=['POST'])
+def withdraw():
+    """
+    取款，参数及返回值与deposit一致
+    支票账户允许透支至透支额度
+    :return:
+    """
+    return _balance_change(-1)
 
 
 @ac_bp.route('/query', methods=['POST'])
@@ -285,7 +567,6 @@ def delete_account():
     account: Account = Account.query.filter(Account.account_id == account_id).first()
     if not account:
         return generate_error(400, '将要删除的账户不存在')
-    database.session.begin()
     # 删除关联的所有binding信息
     try:
         if account.type == AccountType.SAVING:
@@ -294,15 +575,36 @@ def delete_account():
             CheckingAccount.query.filter(CheckingAccount.account_id == account_id).delete()
         RelationAccountCustomerBranch.query.filter(RelationAccountCustomerBranch.account_id == account_id).delete()
         database.session.delete(account)
-        database.session.commit()
+        database.session.flush()
     except IntegrityError as e:
+        database.session.rollback()
         return generate_error(ErrCode.SQL_UNKNOWN_ERROR, str(e))
     return generate_success()
 
 
 @ac_bp.route('/get_all', methods=['GET'])
 def get_account_list():
+    """
+    获取账户列表
+    URL参数(均可选)：limit 单页条数, after 上一页的next游标, stream 为1时流式返回全部数据
+    :return:
+    提供limit时data区返回
+    {
+        'items': [...],
+        'next': str     // 下一页游标，无更多数据时为None
+    }
+    """
+    page, msg = parse_page_args()
+    if not page:
+        return generate_error(ErrCode.PARAM_TYPE_MISMATCH, msg)
     target = database.session.query(Account, CheckingAccount, SavingAccount). \
         outerjoin(CheckingAccount, Account.account_id == CheckingAccount.account_id). \
-        outerjoin(SavingAccount, Account.account_id == SavingAccount.account_id).all()
-    return generate_success(account2dict(target))
+        outerjoin(SavingAccount, Account.account_id == SavingAccount.account_id)
+    if page.stream:
+        return generate_success_stream(
+            account2dict(chunk) for chunk in stream_query(target, Account.account_id,
+                                                          lambda row: row[0].account_id))
+    if page.paged:
+        return generate_success(keyset_page(target, Account.account_id, page,
+                                            lambda row: row[0].account_id, account2dict))
+    return generate_success(account2dict(target.all()))
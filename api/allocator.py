@@ -0,0 +1,67 @@
+"""
+卡号分配器
+"""
+import os
+import config
+from threading import Lock
+from sqlalchemy.exc import IntegrityError
+from ext import database
+from data_type import Account, CardSequence
+
+
+class CardAllocator:
+    """
+    以数据库为准的卡号分配器
+    每个进程一次性预留一段连续卡号，之后在内存中分配，直到用完再预留下一段
+    进程重启或fork后丢弃未用完的号段，因此卡号可能不连续但不会重复
+    """
+
+    def __init__(self, name: str = 'card', block_size: int = config.CARD_BLOCK_SIZE):
+        self.name = name
+        self.block_size = block_size
+        self._lock = Lock()
+        self._pid = None
+        self._next = 0
+        self._end = 0
+
+    def next_id(self) -> str:
+        """
+        分配一个新卡号
+        :return: 19位卡号
+        """
+        with self._lock:
+            if self._pid != os.getpid() or self._next >= self._end:
+                self._next, self._end = self._reserve()
+                self._pid = os.getpid()
+            card_id = self._next
+            self._next += 1
+        return str(card_id).zfill(19)
+
+    def _reserve(self):
+        """
+        从数据库预留一段卡号
+        :return: 号段的起止值 [start, end)
+        """
+        while True:
+            try:
+                with database.engine.begin() as conn:
+                    updated = conn.execute(
+                        CardSequence.__table__.update().
+                        where(CardSequence.name == self.name).
+                        values(next_value=CardSequence.next_value + self.block_size)).rowcount
+                    if updated:
+                        end = conn.execute(
+                            database.select([CardSequence.next_value]).where(CardSequence.name == self.name)).scalar()
+                        return end - self.block_size, end
+                    # 首次使用，从现有最大卡号之后开始分配
+                    current = conn.execute(database.select([database.func.max(Account.account_id)])).scalar()
+                    start = int(current) + 1 if current else 1
+                    conn.execute(CardSequence.__table__.insert().values(
+                        name=self.name, next_value=start + self.block_size))
+                    return start, start + self.block_size
+            except IntegrityError:
+                # 其他进程同时完成了初始化，重新预留
+                continue
+
+
+card_allocator = CardAllocator()
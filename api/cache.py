@@ -0,0 +1,203 @@
+"""
+/stat接口结果缓存
+缓存项以 接口名 + 月份区间 为键，客户或贷款发生增删时按受影响的月份精确失效
+失效在最外层事务提交后进行，回滚的写操作不会使缓存失效
+缓存项另有过期时间，使失效后从延迟的从库读到并写入缓存的旧结果不会长期保留
+"""
+import importlib
+import time
+import config
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Optional, Tuple
+from sqlalchemy import event
+from ext import database
+from api.codec import dumps, loads
+
+STALE_KEY = 'stat_cache_stale'  # session.info中记录待失效(接口名, 月份)的键
+
+
+def normalize_month(value) -> Optional[str]:
+    """
+    将 2021-05 / 202105 / 2021/5 等格式统一为YYYYMM
+    :return: 无法解析时返回None
+    """
+    if value is None:
+        return None
+    parts = [it for it in ''.join(ch if ch.isdigit() else ' ' for ch in str(value)).split()]
+    if len(parts) == 1 and len(parts[0]) == 6:
+        return parts[0]
+    if len(parts) == 2 and len(parts[0]) == 4 and 1 <= len(parts[1]) <= 2:
+        return parts[0] + parts[1].zfill(2)
+    return None
+
+
+class CacheBackend:
+    """
+    缓存后端接口
+    version()在每次失效时递增，写入缓存时携带计算前读取的version，
+    若计算期间发生过失效则放弃写入，避免缓存过期结果
+    """
+
+    def get(self, endpoint: str, date_from: str, date_to: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    def set(self, endpoint: str, date_from: str, date_to: str, value: Any, version: int):
+        raise NotImplementedError
+
+    def version(self) -> int:
+        raise NotImplementedError
+
+    def invalidate(self, endpoint: str, month: str):
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        raise NotImplementedError
+
+
+class LocalCache(CacheBackend):
+    """
+    进程内LRU缓存
+    """
+
+    def __init__(self, max_entries: int = config.STAT_CACHE_SIZE, ttl: int = config.STAT_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: 'OrderedDict[Tuple[str, str, str], Tuple[Any, float]]' = OrderedDict()  # 键 -> (值, 过期时间)
+        self._lock = Lock()
+        self._version = 0
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, endpoint, date_from, date_to):
+        key = (endpoint, date_from, date_to)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return entry[0]
+                del self._entries[key]
+            self._misses += 1
+            return None
+
+    def set(self, endpoint, date_from, date_to, value, version):
+        key = (endpoint, date_from, date_to)
+        with self._lock:
+            if version != self._version:
+                return
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def version(self):
+        with self._lock:
+            return self._version
+
+    def invalidate(self, endpoint, month):
+        with self._lock:
+            self._version += 1
+            for key in [key for key in self._entries if key[0] == endpoint and key[1] <= month <= key[2]]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {'backend': 'local', 'entries': len(self._entries), 'hits': self._hits, 'misses': self._misses}
+
+
+class RedisCache(CacheBackend):
+    """
+    基于Redis的共享缓存，供多个worker进程共用
+    每个接口使用一个以起始月份为分值的有序集合索引缓存项，失效时只检查起始月份不晚于该月的项
+    需要安装redis包
+    """
+
+    def __init__(self, url: str = config.STAT_CACHE_REDIS_URL, ttl: int = config.STAT_CACHE_TTL,
+                 prefix: str = 'stat_cache:'):
+        import redis
+        self._redis = redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _key(self, endpoint, date_from, date_to):
+        return f'{self.prefix}{endpoint}:{date_from}:{date_to}'
+
+    def get(self, endpoint, date_from, date_to):
+        value = self.client.get(self._key(endpoint, date_from, date_to))
+        self.client.incr(self.prefix + ('hits' if value is not None else 'misses'))
+        return loads(value) if value is not None else None
+
+    def set(self, endpoint, date_from, date_to, value, version):
+        key = self._key(endpoint, date_from, date_to)
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(self.prefix + 'version')
+                if int(pipe.get(self.prefix + 'version') or 0) != version:
+                    return
+                pipe.multi()
+                pipe.set(key, dumps(value), ex=self.ttl)
+                pipe.zadd(self.prefix + 'index:' + endpoint, {key: int(date_from)})
+                pipe.execute()
+            except self._redis.WatchError:
+                return
+
+    def version(self):
+        return int(self.client.get(self.prefix + 'version') or 0)
+
+    def invalidate(self, endpoint, month):
+        self.client.incr(self.prefix + 'version')
+        index = self.prefix + 'index:' + endpoint
+        stale = [key for key in self.client.zrangebyscore(index, '-inf', int(month))
+                 if key.decode().rsplit(':', 1)[1] >= month]
+        if stale:
+            self.client.delete(*stale)
+            self.client.zrem(index, *stale)
+
+    def stats(self):
+        hits, misses = self.client.mget(self.prefix + 'hits', self.prefix + 'misses')
+        return {'backend': 'redis', 'hits': int(hits or 0), 'misses': int(misses or 0)}
+
+
+BACKENDS = {
+    'local': LocalCache,
+    'redis': RedisCache
+}
+
+
+def create_backend(name: str = config.STAT_CACHE_BACKEND) -> CacheBackend:
+    """
+    :param name: local / redis，或 模块路径.类名 形式的自定义后端
+    """
+    if name in BACKENDS:
+        return BACKENDS[name]()
+    module, cls = name.rsplit('.', 1)
+    return getattr(importlib.import_module(module), cls)()
+
+
+stat_cache = create_backend()
+
+
+def mark_stale(endpoint: str, month: str):
+    """
+    记录当前事务提交后需要失效的缓存月份
+    """
+    database.session.info.setdefault(STALE_KEY, set()).add((endpoint, month))
+
+
+@event.listens_for(database.session, 'after_commit')
+def _invalidate_after_commit(session):
+    # 释放保存点也会触发after_commit，此时外层事务尚未提交，不能失效
+    if session.in_nested_transaction():
+        return
+    for endpoint, month in session.info.pop(STALE_KEY, ()):
+        stat_cache.invalidate(endpoint, month)
+
+
+@event.listens_for(database.session, 'after_transaction_end')
+def _discard_after_rollback(session, transaction):
+    # 最外层事务结束时仍未失效的记录属于回滚的事务；回滚到保存点时保留，多失效不影响正确性
+    if transaction.parent is None:
+        session.info.pop(STALE_KEY, None)
@@ -0,0 +1,94 @@
+"""
+JSON编解码
+按config.JSON_BACKEND选择实现：orjson为可选依赖，未安装时使用标准库json
+Decimal按浮点数输出，date按YYYY-MM-DD输出，序列化前无需逐字段转换
+"""
+import datetime
+import importlib
+import json
+import config
+from decimal import Decimal
+from typing import Any
+
+
+def _default(obj):
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, datetime.datetime):
+        return obj.isoformat(sep=' ')
+    if isinstance(obj, datetime.date):
+        return obj.strftime('%Y-%m-%d')
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+class JsonCodec:
+    """
+    编解码接口
+    dumps统一返回UTF-8编码的bytes，可直接作为响应体
+    loads解析失败时抛出ValueError
+    """
+    name = ''
+
+    def dumps(self, obj: Any) -> bytes:
+        raise NotImplementedError
+
+    def loads(self, data) -> Any:
+        raise NotImplementedError
+
+
+class StdlibCodec(JsonCodec):
+    name = 'stdlib'
+
+    def __init__(self):
+        self._encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=_default)
+
+    def dumps(self, obj: Any) -> bytes:
+        return self._encoder.encode(obj).encode('utf-8')
+
+    def loads(self, data) -> Any:
+        return json.loads(data)
+
+
+class OrjsonCodec(JsonCodec):
+    name = 'orjson'
+
+    def __init__(self):
+        # 在实例化时才导入，未选用orjson时无需安装
+        self._orjson = importlib.import_module('orjson')
+        # date/datetime交给_default处理，与标准库实现输出一致
+        self._option = self._orjson.OPT_PASSTHROUGH_DATETIME | self._orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj: Any) -> bytes:
+        return self._orjson.dumps(obj, default=_default, option=self._option)
+
+    def loads(self, data) -> Any:
+        return self._orjson.loads(data)
+
+
+BACKENDS = {
+    'stdlib': StdlibCodec,
+    'orjson': OrjsonCodec
+}
+
+
+def create_codec(name: str = config.JSON_BACKEND) -> JsonCodec:
+    """
+    :param name: stdlib / orjson，auto时优先使用orjson
+    """
+    if name == 'auto':
+        try:
+            return OrjsonCodec()
+        except ImportError:
+            return StdlibCodec()
+    return BACKENDS[name]()
+
+
+codec = create_codec()
+
+
+def dumps(obj: Any) -> bytes:
+    return codec.dumps(obj)
+
+
+def loads(data) -> Any:
+    return codec.loads(data)
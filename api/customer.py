@@ -1,12 +1,21 @@
 from flask import Blueprint, request, jsonify
 import json
 from data_type import *
-from api.__util import generate_error, pre_process, parse_sqlerror, generate_success
+from api.search import index_customers, unindex_customer, search_customers
+from api.account import account2dict
+from api.loan import load_loan_details, loan_record2dict
+from api.rollup import add_customers
+from api.importer import CustomerImporter, iter_records, IMPORT_FORMATS
+from api.__util import generate_error, pre_process, parse_sqlerror, generate_success, ErrCode, \
+    parse_page_args, keyset_page, stream_query, generate_success_stream, MAX_PAGE_SIZE
 from sqlalchemy.exc import IntegrityError
 from typing import List
+import config
 
 cs_bp = Blueprint('CustomerManagement', 'CustomerManagement', url_prefix='/customer')
 
+DEFAULT_SEARCH_LIMIT = 50  # 模糊查询客户默认返回条数上限
+
 """
 统一失败返回数据：
 {
@@ -45,15 +54,13 @@ def add_customer():
     except KeyError:
         return generate_error(400, '客户数据模型不完整')
     # 执行插入
-    transaction = database.session.begin()
     try:
         database.session.add(customer)
-        database.session.commit()
+        database.session.flush()
+        index_customers([customer])
+        add_customers({customer.create_time: 1})
     except IntegrityError as e:
-        try:
-            transaction.rollback()
-        except Exception:
-            return generate_error(-1, '未知错误')
+        database.session.rollback()
         return generate_error(400, '插入失败', str(parse_sqlerror(e)))
     return generate_success(customer.to_dict())
 
@@ -82,9 +89,10 @@ def modify_customer():
     except KeyError:
         return generate_error(400, '客户数据模型不完整')
     # 执行更新操作
-    database.session.begin()
     database.session.add(customer)
-    database.session.commit()
+    database.session.flush()
+    unindex_customer(user_id)
+    index_customers([customer])
     return generate_success(customer.to_dict())
 
 
@@ -110,15 +118,13 @@ def delete_customer():
     customer: Customer = Customer.query.filter_by(user_id=user_id).first()
     if not customer:
         return generate_error(400, '无法获取待删除的客户信息')
-    transaction = database.session.begin()
     try:
+        unindex_customer(user_id)
+        add_customers({customer.create_time: -1})
         database.session.delete(customer)
-        database.session.commit()
+        database.session.flush()
     except IntegrityError as e:
-        try:
-            transaction.rollback()
-        except Exception:
-            return generate_error(-1, '未知错误')
+        database.session.rollback()
         return generate_error(400, '删除失败', str(parse_sqlerror(e)))
     return generate_success()
 
@@ -132,9 +138,13 @@ def query_customer():
     {
         'exact': bool,  // True为精确查询
         'mode': int,    // 0: 身份证号， 1: 姓名， 2: 电话
-        'keyword': str  // 查询关键词
+        'keyword': str, // 查询关键词
+        'limit': int    // 可选，模糊查询的返回条数上限，默认50；精确查询返回全部结果
     }
     :return:
+    模糊查询结果按匹配程度排序
+    模糊查询使用customer_ngram索引，索引随客户的增删改维护；引入索引前已存在的客户需运行一次
+    flask rebuild-customer-index 建立索引后才能被模糊查询找到
     """
 
     class SearchInfo:
@@ -142,21 +152,22 @@ def query_customer():
             self.exact = sd.get('exact')
             self.mode = sd.get('mode')
             self.keyword = sd.get('keyword')
-            if not self.exact:
-                self.keyword = f'%{self.keyword}%'
+            self.limit = sd.get('limit', DEFAULT_SEARCH_LIMIT)
 
     data = pre_process()
     if not data.logged_in:
         return generate_error(403, data.login_message)
     if not data.data:
         return generate_error(400, data.error_message)
-    Customer.query.filter()
     try:
         search_info = SearchInfo(data.data)
     except KeyError:
         return generate_error(400, '无法获取搜索参数')
     if search_info.mode != int(search_info.mode) or not 0 <= search_info.mode <= 2:
         return generate_error(400, '未知的搜索模式')
+    if search_info.keyword is None or search_info.keyword == '':
+        return generate_error(400, '无法获取搜索参数')
+    search_info.keyword = str(search_info.keyword)
     s_data: List[Customer] = []
     if search_info.exact:
         if search_info.mode == 0:
@@ -166,16 +177,109 @@ def query_customer():
         elif search_info.mode == 2:
             s_data = Customer.query.filter(Customer.phone == search_info.keyword).all()
     else:
-        if search_info.mode == 0:
-            s_data = Customer.query.filter(Customer.user_id.like(search_info.keyword)).all()
-        elif search_info.mode == 1:
-            s_data = Customer.query.filter(Customer.name.like(search_info.keyword)).all()
-        elif search_info.mode == 2:
-            s_data = Customer.query.filter(Customer.phone.like(search_info.keyword)).all()
+        if isinstance(search_info.limit, bool) or not isinstance(search_info.limit, int) or \
+                not 0 < search_info.limit <= MAX_PAGE_SIZE:
+            return generate_error(400, f'limit参数应在1~{MAX_PAGE_SIZE}之间')
+        s_data = search_customers(search_info.mode, search_info.keyword, search_info.limit)
     return generate_success([it.to_dict() for it in s_data])
 
 
+@cs_bp.route('/overview', methods=['POST'])
+def customer_overview():
+    """
+    获取客户概览：客户信息、持有的全部账户（含子类型信息及共同持卡人）及全部贷款（含持有人及发放记录）
+    API路径：/customer/overview
+    json payload格式
+    {
+        'identifier_id': 'string'
+    }
+    :return:
+    {
+        'customer': {...},      // 同/customer/query
+        'accounts': [...],      // 同/account/query
+        'loans': [...]          // 同/loan/query
+    }
+    """
+    data = pre_process()
+    if not data.logged_in:
+        return generate_error(403, data.login_message)
+    if not data.data:
+        return generate_error(400, data.error_message)
+    user_id = data.data.get('identifier_id', None)
+    if not user_id:
+        return generate_error(400, '无法获取客户ID')
+    customer: Customer = Customer.query.filter_by(user_id=user_id).first()
+    if not customer:
+        return generate_error(400, '客户不存在')
+    accounts = database.session.query(Account, CheckingAccount, SavingAccount). \
+        join(RelationAccountCustomerBranch, RelationAccountCustomerBranch.account_id == Account.account_id). \
+        filter(RelationAccountCustomerBranch.customer_id == user_id). \
+        outerjoin(CheckingAccount, Account.account_id == CheckingAccount.account_id). \
+        outerjoin(SavingAccount, Account.account_id == SavingAccount.account_id). \
+        order_by(Account.account_id).all()
+    loans: List[LoanRecord] = LoanRecord.query. \
+        join(RelationLoanUsr, RelationLoanUsr.loan_id == LoanRecord.loan_id). \
+        filter(RelationLoanUsr.user_id == user_id). \
+        order_by(LoanRecord.date, LoanRecord.loan_id).all()
+    users, paid = load_loan_details([loan.loan_id for loan in loans])
+    return generate_success({
+        'customer': customer.to_dict(),
+        'accounts': account2dict(accounts),
+        'loans': [loan_record2dict(loan, users[loan.loan_id], paid[loan.loan_id]) for loan in loans]
+    })
+
+
+@cs_bp.route('/import', methods=['POST'])
+def import_customer():
+    """
+    批量导入客户
+    API路径：/customer/import?format=ndjson&batch=1000
+    请求体为NDJSON（每行一个与/customer/create格式相同的对象）或带表头的CSV，流式读取
+    每条记录可额外提供create_time(YYYYMM)
+    URL参数：format ndjson/csv，默认ndjson；batch 每批写入行数，默认IMPORT_BATCH_SIZE
+    :return:
+    {
+        'imported': int,
+        'failed': int,
+        'errors': [{'line': int, 'msg': str}, ...],
+        'errors_truncated': bool
+    }
+    """
+    data = pre_process(parse_body=False)
+    if not data.logged_in:
+        return generate_error(403, data.login_message)
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in IMPORT_FORMATS:
+        return generate_error(ErrCode.PARAM_TYPE_MISMATCH, f'未知的数据格式: {fmt}')
+    try:
+        batch_size = int(request.args.get('batch', config.IMPORT_BATCH_SIZE))
+    except ValueError:
+        return generate_error(ErrCode.PARAM_TYPE_MISMATCH, 'batch参数应为整数')
+    if not 0 < batch_size <= config.BATCH_MAX_SIZE:
+        return generate_error(ErrCode.PARAM_TYPE_MISMATCH, f'batch参数应在1~{config.BATCH_MAX_SIZE}之间')
+    try:
+        report = CustomerImporter(batch_size).run(iter_records(request.stream, fmt))
+    except UnicodeDecodeError:
+        return generate_error(ErrCode.PARAM_TYPE_MISMATCH, '数据应为UTF-8编码')
+    return generate_success(report)
+
+
 @cs_bp.route('/get_all', methods=['GET', 'POST'])
 def get_customer_list():
+    """
+    获取客户列表
+    URL参数(均可选)：limit 单页条数, after 上一页的next游标, stream 为1时流式返回全部数据
+    :return:
+    """
+    page, msg = parse_page_args()
+    if not page:
+        return generate_error(ErrCode.PARAM_TYPE_MISMATCH, msg)
+    if page.stream:
+        return generate_success_stream(
+            [it.to_dict() for it in chunk] for chunk in stream_query(Customer.query, Customer.user_id,
+                                                                     lambda it: it.user_id))
+    if page.paged:
+        return generate_success(keyset_page(Customer.query, Customer.user_id, page,
+                                            lambda it: it.user_id, lambda rows: [it.to_dict() for it in rows]))
     s_data = Customer.query.all()
     return generate_success([it.to_dict() for it in s_data])
@@ -0,0 +1,113 @@
+"""
+余额/透支/贷款分布统计
+按块从服务端游标读取所需的列存入NumPy数组，直方图、分位数及分支行统计均以向量化方式计算
+"""
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+from ext import database
+from data_type import Account, CheckingAccount, LoanRecord, AccountType
+from api.__util import STREAM_CHUNK_SIZE
+
+
+def _metric_query(metric: str, branch: Optional[str]):
+    """
+    :return: 查询 (支行, 数值) 两列的select语句
+    """
+    if metric == 'balance':
+        stmt = database.select([Account.sub_branch, Account.refund])
+        branch_col = Account.sub_branch
+    elif metric == 'overdraft':
+        # 透支使用率：已透支金额 / 透支额度，仅统计额度大于0的支票账户
+        stmt = database.select([Account.sub_branch, Account.refund, CheckingAccount.overdraft]). \
+            select_from(Account).join(CheckingAccount, CheckingAccount.account_id == Account.account_id). \
+            where(Account.type == AccountType.CHECKING).where(CheckingAccount.overdraft > 0)
+        branch_col = Account.sub_branch
+    else:
+        # 贷款余额：已发放的贷款金额，库中没有还款记录，已发放部分即客户尚欠的本金
+        stmt = database.select([LoanRecord.subbranch, LoanRecord.paid_fund])
+        branch_col = LoanRecord.subbranch
+    if branch:
+        stmt = stmt.where(branch_col == branch)
+    return stmt
+
+
+def load_metric(metric: str, branch: Optional[str] = None,
+                chunk_size: int = STREAM_CHUNK_SIZE) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    """
+    按块读取指标数据
+    :param metric: balance 账户余额, overdraft 支票账户透支使用率, loan 贷款余额（已发放金额）
+    :param branch: 只统计该支行
+    :return: (数值数组, 支行编号数组, 支行名列表)
+    """
+    codes: Dict[str, int] = {}
+    value_chunks, code_chunks = [], []
+    result = database.session.execute(_metric_query(metric, branch).execution_options(stream_results=True))
+    for rows in result.partitions(chunk_size):
+        n = len(rows)
+        code_chunks.append(np.fromiter((codes.setdefault(row[0], len(codes)) for row in rows), dtype=np.int64, count=n))
+        first = np.fromiter((row[1] for row in rows), dtype=np.float64, count=n)
+        if metric == 'overdraft':
+            second = np.fromiter((row[2] for row in rows), dtype=np.float64, count=n)
+            value_chunks.append(np.clip(-first, 0, None) / second)
+        else:
+            value_chunks.append(first)
+    values = np.concatenate(value_chunks) if value_chunks else np.empty(0)
+    branch_codes = np.concatenate(code_chunks) if code_chunks else np.empty(0, dtype=np.int64)
+    return values, branch_codes, list(codes)
+
+
+def branch_stats(values: np.ndarray, codes: np.ndarray, names: List[str]) -> Tuple[List[dict], float]:
+    """
+    分支行统计
+    :return: (各支行统计, 以数值总和计算的集中度HHI)
+    """
+    k = len(names)
+    count = np.bincount(codes, minlength=k)
+    total = np.bincount(codes, weights=values, minlength=k)
+    square = np.bincount(codes, weights=values * values, minlength=k)
+    mean = total / np.maximum(count, 1)
+    std = np.sqrt(np.maximum(square / np.maximum(count, 1) - mean * mean, 0))
+    order = np.argsort(codes, kind='stable')
+    starts = np.searchsorted(codes[order], np.arange(k))
+    minimum = np.minimum.reduceat(values[order], starts) if k else np.empty(0)
+    maximum = np.maximum.reduceat(values[order], starts) if k else np.empty(0)
+    grand = total.sum()
+    share = total / grand if grand else np.zeros(k)
+    hhi = float(np.square(share).sum())
+    stats = [{
+        'branch': names[i],
+        'count': int(count[i]),
+        'sum': float(total[i]),
+        'mean': float(mean[i]),
+        'std': float(std[i]),
+        'min': float(minimum[i]),
+        'max': float(maximum[i]),
+        'share': float(share[i])
+    } for i in range(k)]
+    return sorted(stats, key=lambda it: it['branch']), hhi
+
+
+def distribution(metric: str, bins: int, quantiles: List[float], branch: Optional[str] = None) -> dict:
+    """
+    计算分布统计
+    :return:
+    {
+        'count': int,
+        'histogram': {'edges': [float, ...], 'counts': [int, ...]},
+        'quantiles': {str: float},
+        'branches': [{'branch', 'count', 'sum', 'mean', 'std', 'min', 'max', 'share'}, ...],
+        'hhi': float    // 各支行数值总和的赫芬达尔指数
+    }
+    """
+    values, codes, names = load_metric(metric, branch)
+    if not len(values):
+        return {'count': 0, 'histogram': {'edges': [], 'counts': []}, 'quantiles': {}, 'branches': [], 'hhi': 0}
+    counts, edges = np.histogram(values, bins=bins)
+    stats, hhi = branch_stats(values, codes, names)
+    return {
+        'count': int(len(values)),
+        'histogram': {'edges': edges.tolist(), 'counts': counts.tolist()},
+        'quantiles': dict(zip((str(q) for q in quantiles), np.quantile(values, quantiles).tolist())),
+        'branches': stats,
+        'hhi': hhi
+    }
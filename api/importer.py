@@ -0,0 +1,168 @@
+"""
+客户批量导入
+流式读取NDJSON/CSV数据，按批次写入，内存占用只与批次大小有关
+"""
+import csv
+import datetime
+import json
+import re
+import config
+from collections import Counter
+from typing import Iterable, Iterator, List, Optional, Tuple
+from sqlalchemy.exc import IntegrityError
+from ext import database
+from data_type import Customer
+from api.search import index_customers
+from api.rollup import add_customers
+
+MAX_IMPORT_ERRORS = 1000  # 导入报告中最多记录的错误行数
+
+IMPORT_FORMATS = ('ndjson', 'csv')
+
+
+def _decode_lines(stream: Iterable[bytes]) -> Iterator[str]:
+    first = True
+    for line in stream:
+        text = line.decode('utf-8')
+        if first:
+            text = text.lstrip('\ufeff')
+            first = False
+        yield text
+
+
+def iter_records(stream: Iterable[bytes], fmt: str) -> Iterator[Tuple[int, Optional[dict], str]]:
+    """
+    逐条解析导入数据
+    :param stream: 按行迭代的二进制流
+    :param fmt: ndjson 或 csv，csv首行为表头，字段名与/customer/create一致
+    :return: (行号, 记录, 解析错误信息) 的迭代器
+    """
+    lines = _decode_lines(stream)
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for record in reader:
+            yield reader.line_num, record, ''
+    else:
+        for line_no, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                yield line_no, json.loads(line), ''
+            except json.JSONDecodeError:
+                yield line_no, None, '无法解析数据'
+
+
+def customer_row(record) -> Tuple[Optional[dict], str]:
+    """
+    按Customer.FIELD_MAP将一条导入记录转换为customer表的一行并校验
+    :return: 成功返回(行, '')，失败返回(None, 错误信息)
+    """
+    if not isinstance(record, dict):
+        return None, '记录应为对象'
+    row = {}
+    for key, attr in Customer.FIELD_MAP.items():
+        value = record.get(key)
+        if value == '':
+            value = None
+        if value is not None:
+            value = str(value)
+            length = Customer.__table__.c[attr].type.length
+            if len(value) > length:
+                return None, f'{key}超出长度限制{length}'
+        row[attr] = value
+    if not row['user_id']:
+        return None, '缺少identifier_id'
+    create_time = record.get('create_time')
+    if create_time:
+        create_time = str(create_time)
+        if not re.fullmatch(r'\d{4}(0[1-9]|1[0-2])', create_time):
+            return None, 'create_time应为YYYYMM格式'
+    else:
+        t = datetime.datetime.now()
+        create_time = str(t.year).zfill(4) + str(t.month).zfill(2)
+    row['create_time'] = create_time
+    return row, ''
+
+
+class CustomerImporter:
+    """
+    按批次写入客户，每批一个事务
+    单行失败（格式错误、ID重复等）只记录到报告中，不影响其他行
+    """
+
+    def __init__(self, batch_size: int = config.IMPORT_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.batch: List[Tuple[int, dict]] = []
+        self.imported = 0
+        self.failed = 0
+        self.errors: List[dict] = []
+
+    def error(self, line_no: int, msg: str):
+        self.failed += 1
+        if len(self.errors) < MAX_IMPORT_ERRORS:
+            self.errors.append({'line': line_no, 'msg': msg})
+
+    def add(self, line_no: int, record):
+        row, msg = customer_row(record)
+        if not row:
+            self.error(line_no, msg)
+            return
+        self.batch.append((line_no, row))
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
+            return
+        batch, self.batch = self.batch, []
+        ids = [row['user_id'] for _, row in batch]
+        existing = {it[0] for it in database.session.query(Customer.user_id).filter(Customer.user_id.in_(ids)).all()}
+        rows: List[Tuple[int, dict]] = []
+        for line_no, row in batch:
+            if row['user_id'] in existing:
+                self.error(line_no, '客户ID已存在')
+                continue
+            existing.add(row['user_id'])
+            rows.append((line_no, row))
+        if not rows:
+            return
+        if self._insert([row for _, row in rows]):
+            self.imported += len(rows)
+        else:
+            # 批量写入失败时逐行写入以定位失败行
+            for line_no, row in rows:
+                if self._insert([row]):
+                    self.imported += 1
+                else:
+                    self.error(line_no, 'SQL插入异常，可能出现参照或重复错误')
+        # 每批单独提交，导入中途出错时已导入的批次仍然保留
+        database.session.commit()
+
+    def _insert(self, rows: List[dict]) -> bool:
+        try:
+            with database.session.begin_nested():
+                database.session.execute(Customer.__table__.insert(), rows)
+                index_customers(rows)
+                add_customers(Counter(row['create_time'] for row in rows))
+        except IntegrityError:
+            return False
+        return True
+
+    def run(self, records: Iterable[Tuple[int, Optional[dict], str]]) -> dict:
+        """
+        导入全部记录
+        :param records: iter_records的返回值
+        :return: 导入报告
+        """
+        for line_no, record, msg in records:
+            if msg:
+                self.error(line_no, msg)
+            else:
+                self.add(line_no, record)
+        self.flush()
+        return {
+            'imported': self.imported,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors)
+        }
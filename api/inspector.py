@@ -0,0 +1,82 @@
+"""
+SQL检查
+慢查询日志：执行时间超过阈值的语句连同参数及所属路由写入日志
+重复查询检测：同一请求中同一形状的语句执行超过阈值次数时告警，通常意味着N+1查询
+严格模式下重复查询直接抛出RepeatedQueryError，供测试使用，使查询次数的退化在CI中失败
+"""
+import re
+import time
+import logging
+from typing import Optional
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger('bank.sql')
+
+# IN列表中的多个占位符折叠为一个，使不同长度的IN查询视为同一形状
+_PLACEHOLDER_LIST = re.compile(r'\(\s*(?:\?|%s|:\w+)(?:\s*,\s*(?:\?|%s|:\w+))+\s*\)')
+_NUMBER = re.compile(r'\b\d+\b')
+MAX_PARAM_LOG_LENGTH = 500  # 日志中参数的最大长度
+
+
+class RepeatedQueryError(Exception):
+    pass
+
+
+def statement_shape(statement: str) -> str:
+    """
+    去掉语句中随参数变化的部分
+    """
+    return _NUMBER.sub('N', _PLACEHOLDER_LIST.sub('(?)', ' '.join(statement.split())))
+
+
+def current_route() -> str:
+    if not has_request_context():
+        return '-'
+    return request.url_rule.rule if request.url_rule is not None else request.path
+
+
+class SqlInspector:
+    def __init__(self):
+        self.slow_threshold: Optional[float] = None
+        self.repeat_threshold: Optional[int] = None
+        self.strict = False
+
+    def init_app(self, app):
+        self.slow_threshold = app.config['SQL_SLOW_THRESHOLD']
+        self.repeat_threshold = app.config['SQL_REPEAT_THRESHOLD']
+        self.strict = app.config['SQL_INSPECTOR_STRICT']
+        app.before_request(self.reset)
+
+    @staticmethod
+    def reset():
+        g.sql_shapes = {}
+
+    def before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if self.slow_threshold is not None:
+            conn.info.setdefault('inspector_query_start', []).append(time.perf_counter())
+
+    def after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if self.slow_threshold is not None:
+            starts = conn.info.get('inspector_query_start')
+            if starts:
+                elapsed = time.perf_counter() - starts.pop()
+                if elapsed >= self.slow_threshold:
+                    logger.warning('慢查询 %.3fs [%s] %s 参数: %.*s', elapsed, current_route(), statement,
+                                   MAX_PARAM_LOG_LENGTH, repr(parameters))
+        if self.repeat_threshold is not None and has_request_context() and 'sql_shapes' in g:
+            shape = statement_shape(statement)
+            count = g.sql_shapes.get(shape, 0) + 1
+            g.sql_shapes[shape] = count
+            # 每种语句在一个请求中只报告一次
+            if count == self.repeat_threshold + 1:
+                message = f'[{current_route()}] 同一语句在一个请求中执行超过{self.repeat_threshold}次，可能存在N+1查询: {shape}'
+                if self.strict:
+                    raise RepeatedQueryError(message)
+                logger.warning(message)
+
+
+sql_inspector = SqlInspector()
+event.listen(Engine, 'before_cursor_execute', sql_inspector.before_execute)
+event.listen(Engine, 'after_cursor_execute', sql_inspector.after_execute)
@@ -1,46 +1,96 @@
 """
 贷款相关API
 """
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request
 from sqlalchemy.exc import IntegrityError
 from data_type import *
 from ext import database
-from api.__util import generate_error, pre_process, parse_sqlerror, ErrCode, generate_success
+from api.__util import generate_error, pre_process, parse_sqlerror, ErrCode, generate_success, \
+    parse_page_args, keyset_page, stream_query, generate_success_stream
 from math import isclose
+from typing import Dict, Tuple
+from decimal import Decimal
+import config
+from collections import defaultdict
+from api.rollup import add_branch_stats, month_of
 
 la_bp = Blueprint("Loan", "Loan", url_prefix='/loan')
 
 
-def loan2json(loans: Union[List[LoanRecord], LoanRecord]):
-    def l2j(loan: LoanRecord):
-        users = []
-        paid = []
-        usr_list: List[RelationLoanUsr] = RelationLoanUsr.query.filter(RelationLoanUsr.loan_id == loan.loan_id).all()
-        for user in usr_list:
-            users.append(user.user_id)
-        paid_list: List[PaidRecord] = PaidRecord.query.filter(PaidRecord.loan_id == loan.loan_id).all()
-        for h in paid_list:
-            paid.append({
+LOAN_QUERY_CHUNK = 500  # 单条IN查询最多携带的贷款ID数量
+
+
+def load_loan_details(loan_ids: List[str]) -> Tuple[Dict[str, List[str]], Dict[str, List[dict]]]:
+    """
+    批量获取贷款的持有人及发放记录
+    按LOAN_QUERY_CHUNK分块执行IN查询，代替逐笔贷款查询
+    :param loan_ids: 贷款ID列表
+    :return: (贷款ID -> 持有人ID列表, 贷款ID -> 发放记录列表)
+    """
+    users: Dict[str, List[str]] = {loan_id: [] for loan_id in loan_ids}
+    paid: Dict[str, List[dict]] = {loan_id: [] for loan_id in loan_ids}
+    ids = list(users.keys())
+    for i in range(0, len(ids), LOAN_QUERY_CHUNK):
+        chunk = ids[i:i + LOAN_QUERY_CHUNK]
+        for loan_id, user_id in database.session.query(RelationLoanUsr.loan_id, RelationLoanUsr.user_id). \
+                filter(RelationLoanUsr.loan_id.in_(chunk)).all():
+            users[loan_id].append(user_id)
+        for h in PaidRecord.query.filter(PaidRecord.loan_id.in_(chunk)).order_by(PaidRecord.id).all():
+            paid[h.loan_id].append({
                 'id': h.id,
-                'date': h.date.strftime('%Y-%m-%d'),
-                'fund': float(h.fund)
+                'date': h.date,
+                'fund': h.fund
             })
-        return {
-            'loan_id': loan.loan_id,
-            'total': float(loan.total_fund),
-            'branch': loan.subbranch,
-            'create_date': loan.date.strftime('%Y-%m-%d'),
-            'customers': users,
-            'paid_history': paid
-        }
-
-    ret = []
+    return users, paid
+
+
+def loan_record2dict(loan: LoanRecord, users: List[str], paid: List[dict]) -> dict:
+    return {
+        'loan_id': loan.loan_id,
+        'total': loan.total_fund,
+        'paid': loan.paid_fund,
+        'branch': loan.subbranch,
+        'create_date': loan.date,
+        'customers': users,
+        'paid_history': paid
+    }
+
+
+def loan2json(loans: Union[List[LoanRecord], LoanRecord]):
     if isinstance(loans, list):
-        for loan in loans:
-            ret.append(l2j(loan))
-        return ret
+        # 一次性获取整个结果集的持有人及发放记录，避免逐笔贷款查询
+        users, paid = load_loan_details([loan.loan_id for loan in loans])
+        return [loan_record2dict(loan, users[loan.loan_id], paid[loan.loan_id]) for loan in loans]
     else:
-        return l2j(loans)
+        users, paid = load_loan_details([loans.loan_id])
+        return loan_record2dict(loans, users[loans.loan_id], paid[loans.loan_id])
+
+
+def verify_paid_fund(fix: bool = False) -> List[dict]:
+    """
+    以发放记录重新计算各贷款的已发放金额，并与LoanRecord.paid_fund比对
+    :param fix: 为True时将不一致的记录更正为重新计算的值
+    :return: 不一致的贷款列表
+    """
+    paid = database.session.query(PaidRecord.loan_id, database.func.sum(PaidRecord.fund).label('paid')). \
+        group_by(PaidRecord.loan_id).subquery()
+    rows = database.session.query(LoanRecord.loan_id, LoanRecord.paid_fund,
+                                  database.func.coalesce(paid.c.paid, 0)). \
+        outerjoin(paid, paid.c.loan_id == LoanRecord.loan_id). \
+        filter(LoanRecord.paid_fund != database.func.coalesce(paid.c.paid, 0)).all()
+    mismatched = [{'loan_id': loan_id, 'stored': float(stored), 'actual': float(actual)}
+                  for loan_id, stored, actual in rows]
+    if fix and rows:
+        # 在UPDATE中重新求和，避免与比对期间的并发发放冲突
+        actual = database.select([database.func.coalesce(database.func.sum(PaidRecord.fund), 0)]). \
+            where(PaidRecord.loan_id == LoanRecord.loan_id).scalar_subquery()
+        ids = [loan_id for loan_id, _, _ in rows]
+        for i in range(0, len(ids), LOAN_QUERY_CHUNK):
+            database.session.execute(LoanRecord.__table__.update().
+                                     where(LoanRecord.loan_id.in_(ids[i:i + LOAN_QUERY_CHUNK])).
+                                     values(paid_fund=actual))
+        database.session.commit()
+    return mismatched
 
 
 @la_bp.route('/create', methods=['POST'])
@@ -70,16 +120,19 @@ def create_loan():
         return generate_error(ErrCode.PARAM_TYPE_MISMATCH, "参数类型异常")
     if len(user_ids) == 0:
         return generate_error(ErrCode.USER_LIST_EMPTY, "用户列表为空")
+    total_fund = parse_money(total_fund)
+    if total_fund is None:
+        return generate_error(ErrCode.PARAM_TYPE_MISMATCH, "贷款金额应为大于0且至多两位小数的数值")
     # 添加信息
     record = LoanRecord(sub_branch, total_fund)
-    transaction = database.session.begin()
     try:
         database.session.add(record)
         for user in user_ids:
             database.session.add(RelationLoanUsr(user, record.loan_id))
-        database.session.commit()
+        add_branch_stats({(month_of(record.date), sub_branch): {'loan_count': 1, 'loan_fund': total_fund}})
+        database.session.flush()
     except IntegrityError:
-        transaction.rollback()
+        database.session.rollback()
         return generate_error(ErrCode.SQL_REFERENCE_ERROR, "SQL插入异常，可能出现参照或重复错误")
     return generate_success(loan2json(record))
 
@@ -104,29 +157,148 @@ def pay_loan():
     fund = data.data.get('fund', None)
     if loan_id is None or fund is None:
         return generate_error(ErrCode.PARAM_LOST, "缺少必要参数")
-    if not (isinstance(fund, float) or isinstance(fund, int)) or fund < 0:
+    if isinstance(fund, bool) or not isinstance(fund, (float, int)) or fund < 0:
         return generate_error(ErrCode.PARAM_TYPE_MISMATCH, "参数类型异常")
     if fund == 0:
         return generate_error(ErrCode.PARAM_TYPE_MISMATCH, "发放金额应大于0")
-    # 检查是否超出额度
-    loan: LoanRecord = LoanRecord.query.filter(LoanRecord.loan_id == loan_id).first()
-    if not loan:
-        return generate_error(ErrCode.LOAN_NO_EXIST, "贷款记录不存在")
-    paid_loan = database.session.query(database.func.coalesce(database.func.sum(PaidRecord.fund), 0)).filter(PaidRecord.loan_id == loan_id).first()
-    if float(paid_loan[0]) + fund > float(loan.total_fund):
-        return generate_error(ErrCode.LOAN_TOO_MUCH, "贷款付款超出最大值")
-    # 插入支付信息
-    record = PaidRecord(loan_id, fund)
-    transaction = database.session.begin()
+    fund = parse_money(fund)
+    if fund is None:
+        return generate_error(ErrCode.PARAM_TYPE_MISMATCH, "发放金额应为至多两位小数的有限数值")
+    # 以条件UPDATE累加已发放金额，与发放记录在同一事务中写入，超出额度时不生效
     try:
+        updated = database.session.execute(
+            LoanRecord.__table__.update().
+            where(LoanRecord.loan_id == loan_id).
+            where(LoanRecord.paid_fund + fund <= LoanRecord.total_fund).
+            values(paid_fund=LoanRecord.paid_fund + fund)).rowcount
+        if not updated:
+            exist = database.session.query(LoanRecord.loan_id).filter(LoanRecord.loan_id == loan_id).first()
+            if not exist:
+                return generate_error(ErrCode.LOAN_NO_EXIST, "贷款记录不存在")
+            return generate_error(ErrCode.LOAN_TOO_MUCH, "贷款付款超出最大值")
+        record = PaidRecord(loan_id, fund)
         database.session.add(record)
-        database.session.commit()
+        branch = database.session.query(LoanRecord.subbranch).filter(LoanRecord.loan_id == loan_id).scalar()
+        add_branch_stats({(month_of(record.date), branch): {'paid_fund': fund}})
+        database.session.flush()
     except IntegrityError:
-        transaction.rollback()
+        database.session.rollback()
         return generate_error(ErrCode.SQL_UNKNOWN_ERROR, "插入数据失败(未知异常)")
+    loan: LoanRecord = LoanRecord.query.filter(LoanRecord.loan_id == loan_id).first()
     return generate_success(loan2json(loan))
 
 
+def _apply_payments(added: Dict[str, Decimal]) -> List[str]:
+    """
+    在当前事务中以条件UPDATE累加各贷款的已发放金额
+    :param added: 贷款ID -> 本次累加金额
+    :return: 因并发发放导致超出额度而未生效的贷款ID
+    """
+    stmt = LoanRecord.__table__.update(). \
+        where(LoanRecord.loan_id == database.bindparam('b_loan_id')). \
+        where(LoanRecord.paid_fund + database.bindparam('b_fund') <= LoanRecord.total_fund). \
+        values(paid_fund=LoanRecord.paid_fund + database.bindparam('b_fund'))
+    params = [{'b_loan_id': loan_id, 'b_fund': fund} for loan_id, fund in added.items()]
+    savepoint = database.session.begin_nested()
+    if database.session.execute(stmt, params).rowcount == len(params):
+        savepoint.commit()
+        return []
+    # 部分贷款未更新成功，回滚到保存点后逐笔重试以确定失败的贷款
+    savepoint.rollback()
+    return [param['b_loan_id'] for param in params if database.session.execute(stmt, param).rowcount == 0]
+
+
+@la_bp.route('/pay_batch', methods=['POST'])
+def pay_loan_batch():
+    """
+    批量发放贷款
+    json payload
+    {
+        items: [
+            {loan_id: str, fund: float},
+            ...
+        ]
+    }
+    :return:
+    按请求顺序返回每一项的结果，失败项不影响其他项
+    [
+        {success: true} 或 {success: false, code: int, msg: str},
+        ...
+    ]
+    """
+    data = pre_process()
+    if not data.logged_in:
+        return generate_error(403, data.login_message)
+    if not data.data:
+        return generate_error(400, data.error_message)
+    items = data.data.get('items', None)
+    if not isinstance(items, list):
+        return generate_error(ErrCode.PARAM_LOST, "缺少必要参数")
+    if len(items) > config.BATCH_MAX_SIZE:
+        return generate_error(ErrCode.PARAM_TYPE_MISMATCH, f"单次最多发放{config.BATCH_MAX_SIZE}笔")
+    results: List[Optional[dict]] = [None] * len(items)
+    funds: List[Optional[Decimal]] = [None] * len(items)
+    for i, item in enumerate(items):
+        fund = item.get('fund', None) if isinstance(item, dict) else None
+        if fund is None or not item.get('loan_id', None):
+            results[i] = {'success': False, 'code': ErrCode.PARAM_LOST, 'msg': "缺少必要参数"}
+        elif not isinstance(item['loan_id'], str):
+            results[i] = {'success': False, 'code': ErrCode.PARAM_TYPE_MISMATCH, 'msg': "贷款ID应为字符串"}
+        elif isinstance(fund, bool) or not isinstance(fund, (float, int)) or fund <= 0:
+            results[i] = {'success': False, 'code': ErrCode.PARAM_TYPE_MISMATCH, 'msg': "发放金额应大于0"}
+        else:
+            funds[i] = parse_money(fund)
+            if funds[i] is None:
+                results[i] = {'success': False, 'code': ErrCode.PARAM_TYPE_MISMATCH,
+                              'msg': "发放金额应为至多两位小数的有限数值"}
+    # 一次查询获取所有涉及贷款的额度
+    loan_ids = list({items[i]['loan_id'] for i in range(len(items)) if results[i] is None})
+    remain: Dict[str, Decimal] = {}
+    branches: Dict[str, str] = {}
+    for j in range(0, len(loan_ids), LOAN_QUERY_CHUNK):
+        for loan_id, branch, total, paid in database.session.query(
+                LoanRecord.loan_id, LoanRecord.subbranch, LoanRecord.total_fund, LoanRecord.paid_fund). \
+                filter(LoanRecord.loan_id.in_(loan_ids[j:j + LOAN_QUERY_CHUNK])).all():
+            remain[loan_id] = total - paid
+            branches[loan_id] = branch
+    added: Dict[str, Decimal] = {}
+    accepted: List[int] = []
+    for i, item in enumerate(items):
+        if results[i] is not None:
+            continue
+        loan_id, fund = item['loan_id'], funds[i]
+        if loan_id not in remain:
+            results[i] = {'success': False, 'code': ErrCode.LOAN_NO_EXIST, 'msg': "贷款记录不存在"}
+        elif fund > remain[loan_id]:
+            results[i] = {'success': False, 'code': ErrCode.LOAN_TOO_MUCH, 'msg': "贷款付款超出最大值"}
+        else:
+            remain[loan_id] -= fund
+            added[loan_id] = added.get(loan_id, 0) + fund
+            accepted.append(i)
+    if accepted:
+        today = datetime.date.today()
+        try:
+            failed = set(_apply_payments(added))
+            for i in accepted:
+                if items[i]['loan_id'] in failed:
+                    results[i] = {'success': False, 'code': ErrCode.LOAN_TOO_MUCH, 'msg': "贷款付款超出最大值"}
+            records = [{'loan_id': items[i]['loan_id'], 'fund': funds[i], 'date': today}
+                       for i in accepted if results[i] is None]
+            if records:
+                database.session.execute(PaidRecord.__table__.insert(), records)
+                paid_stats = defaultdict(lambda: {'paid_fund': 0})
+                for record in records:
+                    paid_stats[(month_of(today), branches[record['loan_id']])]['paid_fund'] += record['fund']
+                add_branch_stats(paid_stats)
+        except IntegrityError:
+            database.session.rollback()
+            return generate_error(ErrCode.SQL_UNKNOWN_ERROR, "插入数据失败(未知异常)")
+        for i in accepted:
+            if results[i] is None:
+                results[i] = {'success': True}
+    return generate_success(results)
+
+
 @la_bp.route('/delete', methods=['POST'])
 def delete_loan():
     """
@@ -149,18 +321,21 @@ def delete_loan():
     loan: LoanRecord = LoanRecord.query.filter(LoanRecord.loan_id == loan_id).first()
     if not loan:
         return generate_error(ErrCode.LOAN_NO_EXIST, "贷款记录不存在")
-    paid_loan = database.session.query(database.func.coalesce(database.func.sum(PaidRecord.fund), 0)).filter(PaidRecord.loan_id == loan_id).first()
-    if not isclose(float(paid_loan[0]), float(loan.total_fund), rel_tol=1e-03):
+    if not isclose(float(loan.paid_fund), float(loan.total_fund), rel_tol=1e-03):
         return generate_error(ErrCode.LOAN_STILL_PAYING, "不允许删除未发放完成的贷款信息")
     # 删除相关信息
-    transaction = database.session.begin()
     try:
+        stats = defaultdict(lambda: {'loan_count': 0, 'loan_fund': 0, 'paid_fund': 0})
+        stats[(month_of(loan.date), loan.subbranch)].update({'loan_count': -1, 'loan_fund': -loan.total_fund})
+        for date, fund in database.session.query(PaidRecord.date, database.func.sum(PaidRecord.fund)). \
+                filter(PaidRecord.loan_id == loan_id).group_by(PaidRecord.date).all():
+            stats[(month_of(date), loan.subbranch)]['paid_fund'] -= fund
+        add_branch_stats(stats)
         database.session.query(PaidRecord).filter(PaidRecord.loan_id == loan_id).delete()
         database.session.query(RelationLoanUsr).filter(RelationLoanUsr.loan_id == loan_id).delete()
         database.session.query(LoanRecord).filter(LoanRecord.loan_id == loan_id).delete()
-        database.session.commit()
     except IntegrityError:
-        transaction.rollback()
+        database.session.rollback()
         return generate_error(ErrCode.SQL_UNKNOWN_ERROR, "SQL执行异常")
     return generate_success()
 
@@ -195,11 +370,26 @@ def query_loan():
         result = LoanRecord.query.filter(LoanRecord.subbranch == keyword).all()
     elif method == SearchMethod.CUSTOMER_ID:
         result = database.session.query(LoanRecord).filter(LoanRecord.loan_id.in_(
-            database.session.query(RelationLoanUsr.loan_id).filter(RelationLoanUsr.user_id == keyword).all())).all()
+            database.session.query(RelationLoanUsr.loan_id).filter(RelationLoanUsr.user_id == keyword))).all()
     return generate_success(loan2json(result))
 
 
 @la_bp.route('/get_all', methods=['POST', 'GET'])
 def get_all():
+    """
+    获取贷款列表
+    URL参数(均可选)：limit 单页条数, after 上一页的next游标, stream 为1时流式返回全部数据
+    :return:
+    """
+    page, msg = parse_page_args()
+    if not page:
+        return generate_error(ErrCode.PARAM_TYPE_MISMATCH, msg)
+    if page.stream:
+        return generate_success_stream(
+            loan2json(chunk) for chunk in stream_query(LoanRecord.query, LoanRecord.loan_id,
+                                                       lambda it: it.loan_id))
+    if page.paged:
+        return generate_success(keyset_page(LoanRecord.query, LoanRecord.loan_id, page,
+                                            lambda it: it.loan_id, loan2json))
     loan: List[LoanRecord] = LoanRecord.query.all()
-    return generate_success(loan2json(loan))
\ No newline at end of file
+    return generate_success(loan2json(loan))
@@ -0,0 +1,147 @@
+"""
+接口运行指标
+按路由统计延迟、HTTP状态码与业务错误码、每个请求的SQL语句数及数据库耗时，以Prometheus文本格式由/metrics输出
+SQL统计通过引擎事件收集，对所有引擎（含从库）生效
+"""
+import time
+import config
+from bisect import bisect_left
+from collections import defaultdict
+from threading import Lock
+from typing import Dict, Tuple, Sequence
+from flask import g, request, has_request_context, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from api.__util import ErrCode
+
+# 业务错误码 -> ErrCode中的名称
+ERROR_NAMES = {value: name for name, value in vars(ErrCode).items() if name.isupper()}
+
+SQL_COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)  # 每个请求SQL语句数的分桶
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一个为+Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, labels: str) -> list:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class MetricsRegistry:
+    """
+    进程内指标注册表
+    多进程部署时各进程分别统计，由Prometheus按实例聚合
+    """
+
+    def __init__(self, latency_buckets: Sequence[float] = config.METRICS_LATENCY_BUCKETS):
+        self.latency_buckets = latency_buckets
+        self._lock = Lock()
+        self.latency: Dict[str, Histogram] = {}
+        self.db_time: Dict[str, Histogram] = {}
+        self.statements: Dict[str, Histogram] = {}
+        self.responses: Dict[Tuple[str, int, int], int] = defaultdict(int)
+
+    def record(self, route: str, status: int, code: int, elapsed: float, statements: int, db_time: float):
+        with self._lock:
+            if route not in self.latency:
+                self.latency[route] = Histogram(self.latency_buckets)
+                self.db_time[route] = Histogram(self.latency_buckets)
+                self.statements[route] = Histogram(SQL_COUNT_BUCKETS)
+            self.latency[route].observe(elapsed)
+            self.db_time[route].observe(db_time)
+            self.statements[route].observe(statements)
+            self.responses[(route, status, code)] += 1
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, kind, doc, series in (
+                    ('bank_request_duration_seconds', 'histogram', '请求处理耗时', self.latency),
+                    ('bank_request_db_seconds', 'histogram', '每个请求中SQL执行的总耗时', self.db_time),
+                    ('bank_request_sql_statements', 'histogram', '每个请求执行的SQL语句数', self.statements)):
+                lines.append(f'# HELP {name} {doc}')
+                lines.append(f'# TYPE {name} {kind}')
+                for route, histogram in sorted(series.items()):
+                    lines.extend(histogram.render(name, f'route="{_escape(route)}"'))
+            lines.append('# HELP bank_responses_total 按HTTP状态码及业务错误码统计的响应数')
+            lines.append('# TYPE bank_responses_total counter')
+            for (route, status, code), count in sorted(self.responses.items()):
+                lines.append(f'bank_responses_total{{route="{_escape(route)}",status="{status}",code="{code}",'
+                             f'error="{ERROR_NAMES.get(code, "")}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = MetricsRegistry()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'metrics_start' in g:
+        conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('metrics_query_start')
+    if starts and has_request_context() and 'metrics_start' in g:
+        g.metrics_db_time += time.perf_counter() - starts.pop()
+        g.metrics_statements += 1
+
+
+def start_request():
+    g.pop('api_code', None)
+    g.metrics_start = time.perf_counter()
+    g.metrics_statements = 0
+    g.metrics_db_time = 0.0
+
+
+def capture_status(response: Response) -> Response:
+    g.metrics_status = response.status_code
+    return response
+
+
+def finish_request(exc):
+    """
+    在请求上下文结束时记录，流式响应的耗时与SQL也包含在内
+    """
+    start = g.pop('metrics_start', None)
+    if start is None:
+        return
+    status = g.pop('metrics_status', 500)
+    code = g.get('api_code', 0 if status < 400 else status)
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    registry.record(route, status, code, time.perf_counter() - start, g.metrics_statements, g.metrics_db_time)
+
+
+def metrics():
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+def register_metrics(app):
+    if not app.config['METRICS_ENABLED']:
+        return
+    app.before_request(start_request)
+    app.after_request(capture_status)
+    app.teardown_request(finish_request)
+    app.add_url_rule('/metrics', 'metrics', metrics, methods=['GET'])
@@ -0,0 +1,97 @@
+"""
+统计汇总表维护
+各写接口在自身事务中调用，使汇总表与明细表保持一致
+"""
+import datetime
+from collections import defaultdict
+from typing import Dict, Tuple, Union
+from decimal import Decimal
+from sqlalchemy.dialects import mysql, sqlite
+from ext import database
+from data_type import Customer, LoanRecord, PaidRecord, StatCustomerMonth, StatBranchMonth
+from api.cache import mark_stale
+
+
+def month_of(date: Union[datetime.date, datetime.datetime]) -> str:
+    """
+    :return: YYYYMM格式的月份，与Customer.create_time一致
+    """
+    return str(date.year).zfill(4) + str(date.month).zfill(2)
+
+
+def _increment(model, key: dict, deltas: dict):
+    """
+    对汇总表中的一行做原子累加，行不存在时插入
+    """
+    table = model.__table__
+    dialect = database.engine.dialect.name
+    if dialect in ('mysql', 'sqlite'):
+        if dialect == 'mysql':
+            stmt = mysql.insert(table).values(**key, **deltas)
+            stmt = stmt.on_duplicate_key_update({col: table.c[col] + stmt.inserted[col] for col in deltas})
+        else:
+            stmt = sqlite.insert(table).values(**key, **deltas)
+            stmt = stmt.on_conflict_do_update(index_elements=list(key),
+                                              set_={col: table.c[col] + stmt.excluded[col] for col in deltas})
+        database.session.execute(stmt)
+        return
+    cond = [table.c[col] == value for col, value in key.items()]
+    updated = database.session.execute(
+        table.update().where(*cond).values({col: table.c[col] + value for col, value in deltas.items()})).rowcount
+    if not updated:
+        database.session.execute(table.insert().values(**key, **deltas))
+
+
+def add_customers(months: Dict[str, int]):
+    """
+    累加新增客户数
+    :param months: 月份 -> 变化量（删除客户时为负）
+    """
+    for month, count in months.items():
+        if count:
+            _increment(StatCustomerMonth, {'month': month}, {'new_customers': count})
+            mark_stale('query_user', month)
+
+
+def add_branch_stats(stats: Dict[Tuple[str, str], Dict[str, Union[int, Decimal]]]):
+    """
+    累加支行贷款统计
+    :param stats: (月份, 支行) -> {'loan_count': 变化量, 'loan_fund': 变化量, 'paid_fund': 变化量}，可只提供部分字段
+    """
+    for (month, branch), deltas in stats.items():
+        _increment(StatBranchMonth, {'month': month, 'branch': branch}, deltas)
+        if deltas.get('loan_fund'):
+            mark_stale('query_branch', month)
+
+
+def rebuild_rollups():
+    """
+    根据明细表重建全部汇总表，用于首次上线时回填或修复数据
+    :return: (客户汇总行数, 支行汇总行数)
+    """
+    customers = database.session.query(Customer.create_time, database.func.count(Customer.user_id)). \
+        group_by(Customer.create_time).all()
+    branch_stats = defaultdict(lambda: {'loan_count': 0, 'loan_fund': 0, 'paid_fund': 0})
+    for date, branch, count, fund in database.session.query(
+            LoanRecord.date, LoanRecord.subbranch,
+            database.func.count(LoanRecord.loan_id), database.func.sum(LoanRecord.total_fund)). \
+            group_by(LoanRecord.date, LoanRecord.subbranch).all():
+        stat = branch_stats[(month_of(date), branch)]
+        stat['loan_count'] += count
+        stat['loan_fund'] += fund
+    for date, branch, fund in database.session.query(
+            PaidRecord.date, LoanRecord.subbranch, database.func.sum(PaidRecord.fund)). \
+            join(LoanRecord, LoanRecord.loan_id == PaidRecord.loan_id). \
+            group_by(PaidRecord.date, LoanRecord.subbranch).all():
+        branch_stats[(month_of(date), branch)]['paid_fund'] += fund
+    database.session.execute(StatCustomerMonth.__table__.delete())
+    database.session.execute(StatBranchMonth.__table__.delete())
+    if customers:
+        database.session.execute(StatCustomerMonth.__table__.insert(),
+                                 [{'month': month, 'new_customers': count} for month, count in customers])
+    if branch_stats:
+        database.session.execute(StatBranchMonth.__table__.insert(),
+                                 [{'month': month, 'branch': branch, **stat}
+                                  for (month, branch), stat in branch_stats.items()])
+    database.session.commit()
+    return len(customers), len(branch_stats)
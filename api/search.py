@@ -0,0 +1,123 @@
+"""
+客户模糊查询索引
+为客户的身份证号、姓名、电话建立N-gram倒排索引：
+所有文本建立三元组；含中文的文本额外建立二元组及单字索引，以支持姓名中的单字/双字检索
+"""
+from typing import List, Optional, Set, Union
+from ext import database
+from data_type import Customer, CustomerNgram
+
+INDEXED_FIELDS = {
+    0: 'user_id',
+    1: 'name',
+    2: 'phone'
+}
+
+INDEX_REBUILD_CHUNK = 1000  # 重建索引时每批处理的客户数
+
+
+def _is_cjk(ch: str) -> bool:
+    return '\u4e00' <= ch <= '\u9fff' or '\u3400' <= ch <= '\u4dbf'
+
+
+def index_grams(text: Optional[str]) -> Set[str]:
+    """
+    计算写入索引的N-gram集合
+    """
+    text = (text or '').lower()
+    grams = {text[i:i + 3] for i in range(len(text) - 2)}
+    if any(_is_cjk(ch) for ch in text):
+        grams.update(text[i:i + 2] for i in range(len(text) - 1))
+        grams.update(ch for ch in text if _is_cjk(ch))
+    return grams
+
+
+def query_grams(keyword: str) -> Set[str]:
+    """
+    计算查询关键词所需命中的N-gram集合
+    关键词过短无法使用索引时返回空集合
+    """
+    keyword = keyword.lower()
+    if any(_is_cjk(ch) for ch in keyword):
+        if len(keyword) == 1:
+            return {keyword}
+        return {keyword[i:i + 2] for i in range(len(keyword) - 1)}
+    return {keyword[i:i + 3] for i in range(len(keyword) - 2)}
+
+
+def customer_index_rows(customer: Union[Customer, dict]) -> List[dict]:
+    """
+    计算客户的索引行
+    :param customer: Customer对象，或以数据表字段名为键的dict
+    """
+    if not isinstance(customer, dict):
+        customer = {attr: getattr(customer, attr) for attr in INDEXED_FIELDS.values()}
+    rows = []
+    for field, attr in INDEXED_FIELDS.items():
+        for gram in index_grams(customer[attr]):
+            rows.append({'field': field, 'gram': gram, 'customer_id': customer['user_id']})
+    return rows
+
+
+def index_customers(customers: List[Union[Customer, dict]]):
+    """
+    写入客户的索引项，需在客户记录写入后、同一事务中调用
+    """
+    rows = [row for customer in customers for row in customer_index_rows(customer)]
+    if rows:
+        database.session.execute(CustomerNgram.__table__.insert(), rows)
+
+
+def unindex_customer(user_id: str):
+    """
+    删除客户的所有索引项，需在同一事务中调用
+    """
+    database.session.execute(CustomerNgram.__table__.delete().where(CustomerNgram.customer_id == user_id))
+
+
+def search_customers(mode: int, keyword: str, limit: int) -> List[Customer]:
+    """
+    模糊查询客户
+    先以索引筛选出包含全部N-gram的候选客户，再以LIKE校验
+    结果按 完全匹配、前缀匹配、字段长度 排序，最多返回limit条
+    :param mode: 0: 身份证号， 1: 姓名， 2: 电话
+    :param keyword: 关键词
+    :param limit: 返回条数上限
+    :return:
+    """
+    column = getattr(Customer, INDEXED_FIELDS[mode])
+    escaped = keyword.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    query = Customer.query.filter(column.like(f'%{escaped}%', escape='\\'))
+    grams = query_grams(keyword)
+    if grams:
+        candidates = database.session.query(CustomerNgram.customer_id). \
+            filter(CustomerNgram.field == mode). \
+            filter(CustomerNgram.gram.in_(grams)). \
+            group_by(CustomerNgram.customer_id). \
+            having(database.func.count(CustomerNgram.gram) == len(grams)).subquery()
+        query = query.join(candidates, Customer.user_id == candidates.c.customer_id)
+    rank = database.case([(column == keyword, 0), (column.like(f'{escaped}%', escape='\\'), 1)], else_=2)
+    return query.order_by(rank, database.func.length(column), Customer.user_id).limit(limit).all()
+
+
+def rebuild_customer_index():
+    """
+    根据customer表重建全部索引
+    :return: 索引的客户数
+    """
+    count = 0
+    last = None
+    database.session.execute(CustomerNgram.__table__.delete())
+    while True:
+        query = Customer.query
+        if last is not None:
+            query = query.filter(Customer.user_id > last)
+        customers = query.order_by(Customer.user_id).limit(INDEX_REBUILD_CHUNK).all()
+        if not customers:
+            break
+        index_customers(customers)
+        count += len(customers)
+        last = customers[-1].user_id
+        database.session.expunge_all()
+    database.session.commit()
+    return count
@@ -1,11 +1,174 @@
 import config
 import uuid
 import time
-from typing import Tuple
-from data_type import User
+import os
+import hmac
+import hashlib
+import base64
+from collections import OrderedDict
+from threading import Lock
+from typing import Tuple, Optional
+from flask import g
+from sqlalchemy import bindparam, event
+from sqlalchemy.exc import IntegrityError
+from ext import database
+from data_type import User, SessionDenylist
+
+COMMIT_KEY = 'session_after_commit'  # session.info中记录事务提交后才应用到进程内缓存的登录与登出
+
+
+class SessionCache:
+    """
+    进程内Session缓存
+    缓存项在TTL内直接在内存中校验，超过TTL或缓存判定过期时回源数据库
+    last_use_time的更新先记录在内存中，每隔flush_interval秒批量写回数据库
+    本进程内的登录、登出立即使缓存失效；其他进程的登出与重新登录通过登出列表同步，
+    最迟在SESSION_DENYLIST_REFRESH秒后生效
+    """
+
+    def __init__(self, ttl: int = config.SESSION_CACHE_TTL, max_size: int = config.SESSION_CACHE_SIZE,
+                 flush_interval: int = config.SESSION_FLUSH_INTERVAL):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self._lock = Lock()
+        self._pid = None
+        # user_id -> [session_id, last_use_time, 载入时间]
+        self._entries: 'OrderedDict[str, list]' = OrderedDict()
+        # user_id -> 尚未写回数据库的last_use_time
+        self._pending = {}
+        self._last_flush = time.time()
+
+    def _check_pid(self):
+        # fork后的子进程不继承父进程的缓存与待写回数据
+        if self._pid != os.getpid():
+            self._entries.clear()
+            self._pending.clear()
+            self._pid = os.getpid()
+
+    def get(self, user_id: str, now: int) -> Optional[list]:
+        """
+        取出未超过TTL的缓存项
+        :return: [session_id, last_use_time, 载入时间]，不存在或已超过TTL时返回None
+        """
+        with self._lock:
+            self._check_pid()
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if now - entry[2] > self.ttl:
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return entry
+
+    def put(self, user_id: str, session_id: str, last_use_time: int, now: int):
+        with self._lock:
+            self._check_pid()
+            pending = self._pending.get(user_id, 0)
+            self._entries[user_id] = [session_id, max(last_use_time, pending), now]
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def touch(self, user_id: str, now: int):
+        """
+        记录一次使用，延迟写回数据库
+        """
+        with self._lock:
+            self._check_pid()
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                entry[1] = now
+            self._pending[user_id] = now
+
+    def invalidate(self, user_id: str):
+        """
+        使缓存项立即失效，并丢弃尚未写回的使用时间
+        """
+        with self._lock:
+            self._check_pid()
+            self._entries.pop(user_id, None)
+            self._pending.pop(user_id, None)
+
+    def flush(self, force: bool = False):
+        """
+        将积累的last_use_time批量写回数据库
+        只会把时间往后推，不会覆盖其他进程写入的更新的时间
+        使用独立的连接与事务，不受所在请求（可能为只读或被回滚）的影响
+        :param force: 为True时忽略写回间隔
+        """
+        now = time.time()
+        with self._lock:
+            self._check_pid()
+            if not self._pending or (not force and now - self._last_flush < self.flush_interval):
+                return
+            pending, self._pending = self._pending, {}
+            self._last_flush = now
+        table = User.__table__
+        with database.engine.begin() as conn:
+            conn.execute(
+                table.update().
+                where(table.c.user_id == bindparam('uid')).
+                where(table.c.last_use_time < bindparam('ts')).
+                values(last_use_time=bindparam('ts')),
+                [{'uid': uid, 'ts': ts} for uid, ts in pending.items()])
+
+
+session_cache = SessionCache()
+
+
+def revoke_key(session: str) -> str:
+    """
+    数据库模式的Session在登出列表中的键，取摘要以符合登出列表的会话ID长度
+    """
+    return hashlib.sha256(session.encode()).hexdigest()[:16]
+
+
+def after_commit(action: tuple):
+    """
+    记录当前事务提交后再应用到进程内缓存的操作，事务回滚时丢弃
+    """
+    database.session.info.setdefault(COMMIT_KEY, []).append(action)
+
+
+@event.listens_for(database.session, 'after_commit')
+def _apply_after_commit(session):
+    # 释放保存点也会触发after_commit，此时外层事务尚未提交
+    if session.in_nested_transaction():
+        return
+    for action in session.info.pop(COMMIT_KEY, ()):
+        if action[0] == 'put':
+            session_cache.put(*action[1:])
+        else:
+            denylist_cache.add(*action[1:])
+
+
+@event.listens_for(database.session, 'after_transaction_end')
+def _discard_after_rollback(session, transaction):
+    if transaction.parent is None:
+        session.info.pop(COMMIT_KEY, None)
 
 
 class Session:
+    @staticmethod
+    def revoke(session: str, now: int):
+        """
+        将被登出或被新登录顶替的Session加入登出列表，使其他进程缓存中的该Session失效
+        其他进程的缓存项最多保留SESSION_CACHE_TTL秒，登出列表条目保留同样长的时间即可
+        """
+        key = revoke_key(session)
+        expire_at = now + config.SESSION_CACHE_TTL
+        table = SessionDenylist.__table__
+        try:
+            with database.session.begin_nested():
+                database.session.execute(table.delete().where(table.c.expire_at < now))
+                database.session.execute(table.insert().values(session_id=key, expire_at=expire_at))
+        except IntegrityError:
+            # 同一Session重复登出
+            pass
+        after_commit(('revoke', key, expire_at))
+
     @staticmethod
     def login(user_id: str, password: str) -> Tuple[bool, str]:
         """
@@ -21,31 +184,44 @@ class Session:
             return False, '用户名与密码不匹配'
         session = str(uuid.uuid1())
         ts = int(time.time())
+        session_cache.invalidate(user_id)
+        if user.session_id:
+            Session.revoke(user.session_id, ts)
         User.query.filter_by(user_id=user_id).update({'last_use_time': ts, 'session_id': session})
+        # 请求的事务回滚时新Session并未生效，不能提前放入缓存
+        after_commit(('put', user_id, session, ts, ts))
         return True, session
 
     @staticmethod
     def verify_session(user_id: str, session: str) -> Tuple[bool, str]:
         """
         检查Session有效性
-        若有效则更新最后使用时间
+        若有效则更新最后使用时间，更新先记录在缓存中并定期批量写回
         :param user_id:
         :param session:
         :return:
         """
-        user: User = User.query.filter_by(user_id=user_id).first()
-        if not user:
-            return False, 'SESSION用户名不存在'
-        if user.session_id != session or int(time.time()) > user.last_use_time + config.SEC_VALID_TIME:
-            return False, 'SESSION无效或已过期'
-        else:
-            User.query.filter_by(user_id=user_id).update({'last_use_time': int(time.time())})
-            return True, '成功'
+        now = int(time.time())
+        entry = session_cache.get(user_id, now)
+        # 缓存判定无效时可能是其他进程刚刚登录或续期，回源确认；
+        # 在登出列表中说明其他进程已登出或顶替了该Session，缓存项已过时，同样回源确认
+        if entry is None or entry[0] != session or now > entry[1] + config.SEC_VALID_TIME or \
+                denylist_cache.contains(revoke_key(session), now):
+            user: User = User.query.filter_by(user_id=user_id).first()
+            if not user:
+                return False, 'SESSION用户名不存在'
+            session_cache.put(user_id, user.session_id, user.last_use_time or 0, now)
+            if user.session_id != session or now > (user.last_use_time or 0) + config.SEC_VALID_TIME:
+                return False, 'SESSION无效或已过期'
+        session_cache.touch(user_id, now)
+        session_cache.flush()
+        return True, '成功'
 
     @staticmethod
     def logout(user_id: str, session: str) -> Tuple[bool, str]:
         """
         登出
+        本进程立即生效，其他进程最迟在SESSION_DENYLIST_REFRESH秒后同步登出列表时生效
         :param user_id:
         :param session:
         :return:
@@ -56,5 +232,149 @@ class Session:
         if user.session_id != session:
             return False, "SESSION无效"
         else:
+            session_cache.invalidate(user_id)
+            Session.revoke(session, int(time.time()))
             User.query.filter_by(user_id=user_id).update({'session_id': None})
             return True, ''
+
+
+class SessionDenylistCache:
+    """
+    登出列表的进程内副本
+    本进程的登出立即生效，其他进程的登出最迟在refresh_interval秒后同步过来
+    """
+
+    def __init__(self, refresh_interval: int = config.SESSION_DENYLIST_REFRESH):
+        self.refresh_interval = refresh_interval
+        self._lock = Lock()
+        self._pid = None
+        self._entries = {}  # session_id -> expire_at
+        self._last_refresh = 0
+
+    def contains(self, session_id: str, now: int) -> bool:
+        if self._pid != os.getpid() or now - self._last_refresh >= self.refresh_interval:
+            self.refresh(now)
+        return session_id in self._entries
+
+    def refresh(self, now: int):
+        rows = database.session.query(SessionDenylist.session_id, SessionDenylist.expire_at). \
+            filter(SessionDenylist.expire_at >= now).all()
+        with self._lock:
+            self._entries = {sid: expire_at for sid, expire_at in rows}
+            self._last_refresh = now
+            self._pid = os.getpid()
+
+    def add(self, session_id: str, expire_at: int):
+        with self._lock:
+            self._entries[session_id] = expire_at
+
+
+denylist_cache = SessionDenylistCache()
+
+
+class TokenSession:
+    """
+    无状态签名Token
+    格式为 用户名.会话ID.签发时间.签名，签名为HMAC-SHA256
+    会话ID在换发Token时保持不变，登出时将会话ID加入登出列表，使同一会话换发出的所有Token一并失效
+    校验只依赖密钥与进程内的登出列表，除定期同步登出列表外不访问数据库
+    """
+
+    @staticmethod
+    def _sign(payload: str) -> str:
+        digest = hmac.new(config.SESSION_SECRET.encode(), payload.encode(), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest).rstrip(b'=').decode()
+
+    @staticmethod
+    def issue(user_id: str, session_id: str, now: int) -> str:
+        payload = f'{user_id}.{session_id}.{now}'
+        return f'{payload}.{TokenSession._sign(payload)}'
+
+    @staticmethod
+    def parse(token: str) -> Optional[Tuple[str, str, int]]:
+        """
+        校验签名并解析Token
+        :return: (用户名, 会话ID, 签发时间)，签名不符或格式错误时返回None
+        """
+        parts = token.rsplit('.', 3)
+        if len(parts) != 4 or not parts[2].isdigit():
+            return None
+        user_id, session_id, issued_at, sign = parts
+        if not hmac.compare_digest(sign, TokenSession._sign(f'{user_id}.{session_id}.{issued_at}')):
+            return None
+        return user_id, session_id, int(issued_at)
+
+    @staticmethod
+    def login(user_id: str, password: str) -> Tuple[bool, str]:
+        """
+        登录系统
+        与数据库模式不同，新的登录不会使该用户之前签发的Token失效
+        :param user_id: 用户名
+        :param password: 密码
+        :return: 成功则返回Token，失败则返回失败信息
+        """
+        user: User = User.query.filter_by(user_id=user_id).first()
+        if not user:
+            return False, '用户名不存在'
+        if user.password != password:
+            return False, '用户名与密码不匹配'
+        return True, TokenSession.issue(user_id, uuid.uuid4().hex[:16], int(time.time()))
+
+    @staticmethod
+    def verify_session(user_id: str, session: str) -> Tuple[bool, str]:
+        """
+        检查Token有效性
+        签发超过SESSION_TOKEN_RENEW秒的Token换发新Token，新Token记录在g.renewed_session中，由响应头返回
+        :param user_id:
+        :param session:
+        :return:
+        """
+        parsed = TokenSession.parse(session)
+        if not parsed or parsed[0] != user_id:
+            return False, 'SESSION无效或已过期'
+        _, session_id, issued_at = parsed
+        now = int(time.time())
+        if now > issued_at + config.SEC_VALID_TIME or denylist_cache.contains(session_id, now):
+            return False, 'SESSION无效或已过期'
+        if now - issued_at >= config.SESSION_TOKEN_RENEW:
+            g.renewed_session = TokenSession.issue(user_id, session_id, now)
+        return True, '成功'
+
+    @staticmethod
+    def logout(user_id: str, session: str) -> Tuple[bool, str]:
+        """
+        登出
+        将会话ID加入登出列表，保留到该会话中任何已签发Token的最晚过期时间
+        :param user_id:
+        :param session:
+        :return:
+        """
+        parsed = TokenSession.parse(session)
+        if not parsed or parsed[0] != user_id:
+            return False, "SESSION无效"
+        now = int(time.time())
+        expire_at = now + config.SEC_VALID_TIME
+        table = SessionDenylist.__table__
+        try:
+            with database.session.begin_nested():
+                database.session.execute(table.delete().where(table.c.expire_at < now))
+                database.session.execute(table.insert().values(session_id=parsed[1], expire_at=expire_at))
+        except IntegrityError:
+            # 同一会话重复登出
+            pass
+        # 登出列表写入随请求的事务提交后才在本进程生效
+        after_commit(('revoke', parsed[1], expire_at))
+        return True, ''
+
+
+SESSION_MODES = {
+    'database': Session,
+    'token': TokenSession
+}
+
+
+def current_session():
+    """
+    按config.SESSION_MODE选择会话实现
+    """
+    return SESSION_MODES[config.SESSION_MODE]
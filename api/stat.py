@@ -1,9 +1,11 @@
-from flask import Blueprint, request, jsonify
-import json
+from flask import Blueprint, request
 from data_type import *
 from api.__util import generate_error, pre_process, parse_sqlerror, generate_success, ErrCode
 from sqlalchemy.exc import IntegrityError
-from typing import List
+from api.cache import stat_cache, normalize_month
+from api.distribution import distribution
+from api.codec import loads
+from typing import List, Dict, Optional
 
 st_bp = Blueprint("Statistic", "Statistic", url_prefix="/stat")
 
@@ -19,31 +21,33 @@ def query_user():
     :return:
     """
     try:
-        js = json.loads(request.data)
+        js = loads(request.data)
     except Exception:
         return generate_error(ErrCode.PARAM_LOST, "参数解析失败")
     date_from = js.get("date_from", None)
     date_to = js.get("date_to", None)
     if not date_from or not date_to:
         return generate_error(ErrCode.PARAM_LOST, "缺少必要参数")
-    result = database.session.query(Customer.create_time, database.func.count(Customer.user_id)).\
-        filter(Customer.create_time >= date_from).\
-        filter(Customer.create_time <= date_to).\
-        group_by(Customer.create_time).\
-        order_by(Customer.create_time).\
+    date_from, date_to = normalize_month(date_from), normalize_month(date_to)
+    if not date_from or not date_to:
+        return generate_error(ErrCode.PARAM_TYPE_MISMATCH, "日期格式应为YYYYMM")
+    cached = stat_cache.get('query_user', date_from, date_to)
+    if cached is not None:
+        return generate_success(cached)
+    version = stat_cache.version()
+    result = database.session.query(StatCustomerMonth.month, StatCustomerMonth.new_customers).\
+        filter(StatCustomerMonth.month >= date_from).\
+        filter(StatCustomerMonth.month <= date_to).\
+        filter(StatCustomerMonth.new_customers > 0).\
+        order_by(StatCustomerMonth.month).\
         all()
     res = []
     for item in result:
         res.append({'date': item[0], 'count': item[1]})
+    stat_cache.set('query_user', date_from, date_to, res, version)
     return generate_success(res)
 
 
-def last_day_of_month(any_day):
-    #获取每个月的最后一天
-    next_month = any_day.replace(day=28) + datetime.timedelta(days=4)  # this will never fail
-    return next_month - datetime.timedelta(days=next_month.day)
-
-
 @st_bp.route("/query_branch", methods=['POST'])
 def query_branch():
     """
@@ -51,24 +55,208 @@ def query_branch():
     :return:
     """
     try:
-        js = json.loads(request.data)
+        js = loads(request.data)
     except Exception:
         return generate_error(ErrCode.PARAM_LOST, "参数解析失败")
     date_from = js.get("date_from", None)
     date_to = js.get("date_to", None)
-    ts = datetime.date(int(date_from[:4]), int(date_from[4:]), 1)
-    tt = datetime.date(int(date_to[:4]), int(date_to[4:]), last_day_of_month(datetime.date(int(date_to[:4]), int(date_to[4:]), 1)).day)
-    result = database.session.query(LoanRecord.subbranch, database.func.sum(LoanRecord.total_fund)).\
-        filter(LoanRecord.date <= tt).\
-        filter(LoanRecord.date >= ts). \
-        group_by(LoanRecord.subbranch).\
+    if not date_from or not date_to:
+        return generate_error(ErrCode.PARAM_LOST, "缺少必要参数")
+    date_from, date_to = normalize_month(date_from), normalize_month(date_to)
+    if not date_from or not date_to:
+        return generate_error(ErrCode.PARAM_TYPE_MISMATCH, "日期格式应为YYYYMM")
+    cached = stat_cache.get('query_branch', date_from, date_to)
+    if cached is not None:
+        return generate_success(cached)
+    version = stat_cache.version()
+    # 以支行表外连接汇总表，无贷款的支行金额为0
+    result = database.session.query(SubBranch.name, database.func.coalesce(database.func.sum(StatBranchMonth.loan_fund), 0)).\
+        outerjoin(StatBranchMonth, database.and_(StatBranchMonth.branch == SubBranch.name,
+                                                 StatBranchMonth.month >= date_from,
+                                                 StatBranchMonth.month <= date_to)).\
+        group_by(SubBranch.name).\
+        order_by(SubBranch.name).\
         all()
-    branches = database.session.query(SubBranch.name).all()
     res = []
     for item in result:
-        res.append({'branch': item[0], 'fund': float(item[1])})
-        if item[0] in branches:
-            branches.remove(item[0])
-    for item in branches:
-        res.append({'branch': item[0], 'fund': 0})
-    return generate_success(res)
\ No newline at end of file
+        res.append({'branch': item[0], 'fund': item[1]})
+    stat_cache.set('query_branch', date_from, date_to, res, version)
+    return generate_success(res)
+
+
+@st_bp.route("/cache_stats", methods=['GET'])
+def cache_stats():
+    """
+    获取/stat结果缓存的命中统计
+    :return:
+    {
+        "backend": str,
+        "hits": int,
+        "misses": int
+    }
+    """
+    return generate_success(stat_cache.stats())
+
+
+def month_expr(column):
+    """
+    在SQL中将日期列转换为YYYYMM格式的月份
+    """
+    dialect = database.engine.dialect.name
+    if dialect == 'mysql':
+        return database.func.date_format(column, '%Y%m')
+    if dialect == 'postgresql':
+        return database.func.to_char(column, 'YYYYMM')
+    return database.func.strftime('%Y%m', column)
+
+
+class CubeSource:
+    """
+    统计立方体的一个数据源
+    """
+    def __init__(self, model, month, dimensions: dict, measures: dict, joins=()):
+        self.model = model
+        self.month = month              # 月份列（用于date_from/date_to过滤）
+        self.dimensions = dimensions    # 维度名 -> 列
+        self.measures = measures        # 指标名 -> 聚合表达式
+        self.joins = joins              # 按城市分组时需连接的(模型, 连接条件)
+
+    def query(self, dimensions: List[str], measures: List[str], date_from: Optional[str], date_to: Optional[str]):
+        columns = [self.dimensions[it].label(it) for it in dimensions] + \
+                  [self.measures[it].label(it) for it in measures]
+        q = database.session.query(*columns).select_from(self.model)
+        if 'city' in dimensions:
+            for model, condition in self.joins:
+                q = q.join(model, condition)
+        if date_from:
+            q = q.filter(self.month >= date_from)
+        if date_to:
+            q = q.filter(self.month <= date_to)
+        groups = [self.dimensions[it] for it in dimensions]
+        if groups:
+            q = q.group_by(*groups).order_by(*groups)
+        return [dict(zip(dimensions + measures, row)) for row in q.all()]
+
+
+def cube_sources() -> Dict[str, CubeSource]:
+    account_month = month_expr(Account.open_date)
+    return {
+        'loan': CubeSource(
+            StatBranchMonth, StatBranchMonth.month,
+            {'month': StatBranchMonth.month, 'branch': StatBranchMonth.branch, 'city': SubBranch.city},
+            {'loan_count': database.func.sum(StatBranchMonth.loan_count),
+             'loan_fund': database.func.sum(StatBranchMonth.loan_fund),
+             'paid_fund': database.func.sum(StatBranchMonth.paid_fund)},
+            [(SubBranch, SubBranch.name == StatBranchMonth.branch)]),
+        'account': CubeSource(
+            Account, account_month,
+            {'month': account_month, 'branch': Account.sub_branch, 'city': SubBranch.city,
+             'account_type': Account.type},
+            {'account_count': database.func.count(Account.account_id),
+             'account_refund': database.func.sum(Account.refund)},
+            [(SubBranch, SubBranch.name == Account.sub_branch)]),
+        'customer': CubeSource(
+            StatCustomerMonth, StatCustomerMonth.month,
+            {'month': StatCustomerMonth.month},
+            {'customer_count': database.func.sum(StatCustomerMonth.new_customers)}),
+    }
+
+
+@st_bp.route("/cube", methods=['POST'])
+def query_cube():
+    """
+    多维统计，一次请求返回多个图表所需数据
+    {
+        "measures": [str, ...],     // loan_count, loan_fund, paid_fund, account_count, account_refund, customer_count
+        "dimensions": [str, ...],   // month, branch, city, account_type 的任意组合，可为空
+        "date_from": str,           // 可选，YYYYMM
+        "date_to": str              // 可选，YYYYMM
+    }
+    贷款按创建月份、发放金额按发放月份、账户按开户月份、客户按创建月份计入
+    :return:
+    按数据源分组返回，每行包含所请求的维度及该数据源的指标
+    {
+        "loan": [{"month": str, "branch": str, "loan_fund": float, ...}, ...],
+        "account": [...],
+        "customer": [...]
+    }
+    """
+    try:
+        js = loads(request.data)
+    except Exception:
+        return generate_error(ErrCode.PARAM_LOST, "参数解析失败")
+    measures = js.get("measures", None)
+    dimensions = js.get("dimensions", [])
+    date_from = js.get("date_from", None)
+    date_to = js.get("date_to", None)
+    if not isinstance(measures, list) or not measures or not isinstance(dimensions, list):
+        return generate_error(ErrCode.PARAM_LOST, "缺少必要参数")
+    if not all(isinstance(it, str) for it in measures + dimensions):
+        return generate_error(ErrCode.PARAM_TYPE_MISMATCH, "统计指标及维度应为字符串")
+    if date_from is not None:
+        date_from = normalize_month(date_from)
+        if not date_from:
+            return generate_error(ErrCode.PARAM_TYPE_MISMATCH, "日期格式应为YYYYMM")
+    if date_to is not None:
+        date_to = normalize_month(date_to)
+        if not date_to:
+            return generate_error(ErrCode.PARAM_TYPE_MISMATCH, "日期格式应为YYYYMM")
+    if len(set(dimensions)) != len(dimensions):
+        return generate_error(ErrCode.PARAM_TYPE_MISMATCH, "维度重复")
+    sources = cube_sources()
+    requested: Dict[str, List[str]] = {}
+    for measure in measures:
+        name = next((name for name, source in sources.items() if measure in source.measures), None)
+        if name is None:
+            return generate_error(ErrCode.PARAM_TYPE_MISMATCH, f"未知的统计指标: {measure}")
+        unsupported = [it for it in dimensions if it not in sources[name].dimensions]
+        if unsupported:
+            return generate_error(ErrCode.PARAM_TYPE_MISMATCH, f"指标{measure}不支持维度: {', '.join(unsupported)}")
+        if measure not in requested.setdefault(name, []):
+            requested[name].append(measure)
+    res = {}
+    for name, source_measures in requested.items():
+        res[name] = sources[name].query(dimensions, source_measures, date_from, date_to)
+    return generate_success(res)
+
+
+DISTRIBUTION_METRICS = ('balance', 'overdraft', 'loan')
+MAX_HISTOGRAM_BINS = 1000
+
+
+@st_bp.route("/distribution/<metric>", methods=['POST'])
+def query_distribution(metric: str):
+    """
+    分布统计
+    API路径：/stat/distribution/balance    账户余额
+            /stat/distribution/overdraft  支票账户透支使用率（已透支金额/透支额度）
+            /stat/distribution/loan       贷款余额（已发放金额）
+    {
+        "bins": int,                // 可选，直方图分箱数，默认20
+        "quantiles": [float, ...],  // 可选，默认[0.5, 0.9, 0.99]
+        "branch": str               // 可选，只统计该支行
+    }
+    :return:
+    {
+        "count": int,
+        "histogram": {"edges": [float, ...], "counts": [int, ...]},
+        "quantiles": {"0.5": float, ...},
+        "branches": [{"branch": str, "count": int, "sum": float, "mean": float, "std": float,
+                      "min": float, "max": float, "share": float}, ...],
+        "hhi": float                // 各支行占比的赫芬达尔指数，衡量集中度
+    }
+    """
+    if metric not in DISTRIBUTION_METRICS:
+        return generate_error(ErrCode.PARAM_TYPE_MISMATCH, f"未知的统计指标: {metric}")
+    try:
+        js = loads(request.data) if request.data else {}
+    except Exception:
+        return generate_error(ErrCode.PARAM_LOST, "参数解析失败")
+    bins = js.get("bins", 20)
+    quantiles = js.get("quantiles", [0.5, 0.9, 0.99])
+    if not isinstance(bins, int) or not 0 < bins <= MAX_HISTOGRAM_BINS:
+        return generate_error(ErrCode.PARAM_TYPE_MISMATCH, f"bins应在1~{MAX_HISTOGRAM_BINS}之间")
+    if not isinstance(quantiles, list) or \
+            not all(isinstance(q, (int, float)) and 0 <= q <= 1 for q in quantiles):
+        return generate_error(ErrCode.PARAM_TYPE_MISMATCH, "quantiles应为0~1之间的数值列表")
+    return generate_success(distribution(metric, bins, quantiles, js.get("branch", None)))
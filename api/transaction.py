@@ -0,0 +1,54 @@
+"""
+请求级事务
+每个请求在同一个事务中执行，处理函数只需flush，不再自行begin/commit
+请求成功时在返回响应前提交；通过generate_error返回错误、抛出异常或提交失败时整体回滚
+只读接口（见ext.is_read_only_request）不自动flush、不允许写入，结束时直接回滚，MySQL下以只读事务执行
+"""
+from flask import g, Response, has_request_context
+from sqlalchemy import event
+from sqlalchemy.exc import SQLAlchemyError
+from ext import database, is_read_only_request
+from api.__util import generate_error, ErrCode
+
+
+def begin_request():
+    g.db_rollback = False
+    g.db_read_only = is_read_only_request()
+    database.session.autoflush = not g.db_read_only
+
+
+def end_request(response: Response) -> Response:
+    """
+    在返回响应前提交或回滚请求事务，提交失败时改为返回错误
+    """
+    if g.get('db_read_only') or g.get('db_rollback') or response.status_code >= 400:
+        database.session.rollback()
+        return response
+    try:
+        database.session.commit()
+    except SQLAlchemyError as e:
+        database.session.rollback()
+        return generate_error(ErrCode.SQL_UNKNOWN_ERROR, '提交事务失败', str(e))
+    return response
+
+
+def teardown_request(exc):
+    """
+    请求结束时归还连接；未经end_request处理的异常在此回滚
+    """
+    if exc is not None:
+        database.session.rollback()
+    database.session.autoflush = True
+    database.session.remove()
+
+
+@event.listens_for(database.session, 'after_begin')
+def _read_only_transaction(session, transaction, connection):
+    if has_request_context() and g.get('db_read_only') and connection.dialect.name == 'mysql':
+        connection.exec_driver_sql('SET TRANSACTION READ ONLY')
+
+
+def register_unit_of_work(app):
+    app.before_request(begin_request)
+    app.after_request(end_request)
+    app.teardown_request(teardown_request)
@@ -6,11 +6,18 @@ from api.manage import mg_bp
 from api.branch import sb_bp
 from api.loan import la_bp
 from api.stat import st_bp
+from api.__util import attach_renewed_session
+from api.transaction import register_unit_of_work
+from api.metrics import register_metrics
+from api.inspector import sql_inspector
 from flask_migrate import Migrate
+from commands import register_commands
 import config
 
 app = Flask(__name__)
 app.config.from_object(config)
+register_metrics(app)
+sql_inspector.init_app(app)
 database.init_app(app)
 migrate = Migrate(app=app, db=database)
 app.register_blueprint(cs_bp)
@@ -19,6 +26,9 @@ app.register_blueprint(mg_bp)
 app.register_blueprint(sb_bp)
 app.register_blueprint(la_bp)
 app.register_blueprint(st_bp)
+app.after_request(attach_renewed_session)
+register_unit_of_work(app)
+register_commands(app)
 
 
 @app.route('/')
@@ -0,0 +1,82 @@
+"""
+单热点账户余额并发基准测试
+多个客户端同时向同一账户存款，对比 /account/deposit 原子增量更新与
+/account/query + /account/modify 读-改-写方式的吞吐量及丢失更新数
+
+python bench/balance_delta.py --clients 8 --ops 200
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import load_app
+
+
+def setup(app):
+    from ext import database
+    from data_type import User, SubBranch, Customer
+    with app.app_context():
+        database.session.add(User(user_id='bench', password='bench', session_id=None, last_use_time=0))
+        database.session.add(SubBranch(name='bench', city='bench', fund=0))
+        database.session.add(Customer({'identifier_id': 'bench', 'name': 'bench'}))
+        database.session.commit()
+    client = app.test_client()
+    session = client.post('/manage/login', data=json.dumps({'user_id': 'bench', 'passwd': 'bench'})).get_json()
+    headers = {'USER_ID': 'bench', 'SESSION': session['data']['session']}
+    account = client.post('/account/create', headers=headers, data=json.dumps({
+        'holder': ['bench'], 'sub_branch': 'bench', 'type': 1, 'overdraft': 0})).get_json()
+    return headers, account['data']['account_id']
+
+
+def balance(client, headers, account_id):
+    r = client.post('/account/query', headers=headers, data=json.dumps({'method': 0, 'keyword': account_id}))
+    return r.get_json()['data'][0]
+
+
+def run(app, headers, account_id, clients, ops, mode):
+    def deposit_delta(_):
+        client = app.test_client()
+        ok = 0
+        for _ in range(ops):
+            r = client.post('/account/deposit', headers=headers,
+                            data=json.dumps({'account_id': account_id, 'amount': 1})).get_json()
+            ok += r['success']
+        return ok
+
+    def deposit_modify(_):
+        client = app.test_client()
+        ok = 0
+        for _ in range(ops):
+            current = balance(client, headers, account_id)
+            current['refund'] += 1
+            r = client.post('/account/modify', headers=headers, data=json.dumps(current)).get_json()
+            ok += r['success']
+        return ok
+
+    before = balance(app.test_client(), headers, account_id)['refund']
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        succeeded = sum(pool.map(deposit_delta if mode == 'delta' else deposit_modify, range(clients)))
+    elapsed = time.perf_counter() - start
+    gained = balance(app.test_client(), headers, account_id)['refund'] - before
+    print(f'{mode:>6}: ops={clients * ops} succeeded={succeeded} elapsed={elapsed:.3f}s '
+          f'throughput={clients * ops / elapsed:.0f}/s lost_updates={succeeded - round(gained)}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=None, help='SQLAlchemy数据库URL，默认使用临时SQLite文件')
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--ops', type=int, default=200, help='每个客户端的操作次数')
+    args = parser.parse_args()
+    app = load_app(args.db or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db'))
+    headers, account_id = setup(app)
+    run(app, headers, account_id, args.clients, args.ops, 'delta')
+    run(app, headers, account_id, args.clients, args.ops, 'modify')
+
+
+if __name__ == '__main__':
+    main()
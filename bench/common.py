@@ -0,0 +1,25 @@
+"""
+基准测试公共工具
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+
+
+def load_app(database_uri: str):
+    """
+    以指定数据库启动后端应用并建表
+    需在导入app之前调用，以覆盖config中的数据库配置
+    :param database_uri: SQLAlchemy数据库URL
+    :return: Flask app
+    """
+    config.SQLALCHEMY_DATABASE_URI = database_uri
+    config.SQLALCHEMY_TRACK_MODIFICATIONS = False
+    from app import app
+    from ext import database
+    with app.app_context():
+        database.create_all()
+    return app
@@ -0,0 +1,63 @@
+"""
+分布统计基准测试
+向临时SQLite写入指定数量的账户后，统计/stat/distribution/balance的耗时，并折算为每百万行耗时
+
+python bench/distribution.py --rows 1000000
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import tempfile
+import time
+
+from common import load_app
+
+INSERT_CHUNK = 50000
+
+
+def seed(app, rows: int, branches: int):
+    from ext import database
+    from data_type import SubBranch, Account
+    rng = random.Random(0)
+    today = datetime.date.today()
+    with app.app_context():
+        database.session.execute(SubBranch.__table__.insert(),
+                                 [{'name': f'b{i}', 'city': 'bench', 'fund': 0} for i in range(branches)])
+        for start in range(0, rows, INSERT_CHUNK):
+            database.session.execute(Account.__table__.insert(), [{
+                'account_id': str(i).zfill(19),
+                'refund': round(rng.lognormvariate(8, 1.5), 2),
+                'open_date': today,
+                'recent_visit': today,
+                'sub_branch': f'b{int(rng.paretovariate(1.2)) % branches}',
+                'type': 0,
+                'version': 1
+            } for i in range(start, min(start + INSERT_CHUNK, rows))])
+        database.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--branches', type=int, default=17)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    app = load_app('sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db'))
+    start = time.perf_counter()
+    seed(app, args.rows, args.branches)
+    print(f'seeded {args.rows} accounts in {time.perf_counter() - start:.1f}s')
+    client = app.test_client()
+    timings = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        r = client.post('/stat/distribution/balance', data=json.dumps({'bins': 50})).get_json()
+        timings.append(time.perf_counter() - start)
+        assert r['success'] and r['data']['count'] == args.rows
+    best = min(timings)
+    print(f'best={best:.3f}s per_million_rows={best / args.rows * 1e6:.3f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,327 @@
+"""
+接口综合基准测试
+以generate_random_data按指定规模生成测试数据后，在后台线程中以多线程WSGI服务器（werkzeug）提供服务，
+多个并发客户端通过本机HTTP连接按权重混合请求/account、/customer、/loan、/stat及/manage/login接口，
+统计各接口的p50/p95/p99延迟、吞吐量、错误数及每个请求执行的SQL语句数，结果以JSON输出，便于在不同提交间对比
+延迟包含套接字传输、HTTP解析及JSON编解码；服务器为werkzeug开发服务器，与生产环境的WSGI服务器的绝对数值不可直接比较
+
+python bench/endpoints.py --customers 10000 --clients 8 --requests 500 --mix mixed --output result.json
+"""
+import argparse
+import datetime
+import http.client
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+from common import load_app
+
+PASSWORD = 'bench'
+STATEMENTS_HEADER = 'X-Bench-Statements'
+
+# 各场景下的操作权重
+MIXES = {
+    'read': {
+        'account_query': 20, 'account_get_all': 5, 'customer_query': 15, 'customer_search': 10,
+        'customer_overview': 15, 'loan_query': 15, 'stat_user': 5, 'stat_branch': 5, 'stat_distribution': 2,
+        'login': 3
+    },
+    'write': {
+        'deposit': 30, 'withdraw': 20, 'loan_pay': 20, 'loan_create': 10, 'open_account': 10, 'login': 10
+    },
+    'mixed': {
+        'account_query': 15, 'account_get_all': 3, 'customer_query': 10, 'customer_search': 5,
+        'customer_overview': 10, 'loan_query': 10, 'stat_user': 3, 'stat_branch': 3, 'stat_distribution': 1,
+        'deposit': 15, 'withdraw': 8, 'loan_pay': 6, 'loan_create': 3, 'open_account': 3, 'login': 5
+    }
+}
+
+_statements = threading.local()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    _statements.count = getattr(_statements, 'count', 0) + 1
+
+
+class KeepAliveHandler(WSGIRequestHandler):
+    # 以HTTP/1.1保持连接，各客户端复用同一个连接
+    protocol_version = 'HTTP/1.1'
+
+    def log_request(self, code='-', size='-'):
+        pass
+
+
+def serve(app):
+    """
+    在后台线程中以多线程WSGI服务器提供服务，每个请求由一个服务器线程处理
+    服务器线程在响应头X-Bench-Statements中返回该请求执行的SQL语句数
+    :return: 服务器，端口为server.server_port
+    """
+    @app.before_request
+    def _reset_statement_count():
+        _statements.count = 0
+
+    @app.after_request
+    def _report_statement_count(response):
+        response.headers[STATEMENTS_HEADER] = str(getattr(_statements, 'count', 0))
+        return response
+
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=KeepAliveHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def seed(app, customers: int, clients: int, seed_value: int, workers: int) -> dict:
+    """
+    以generate_random_data的生成器写入测试数据
+    :return: 客户ID、账户ID、贷款ID、支行名列表，供客户端随机选取
+    """
+    from ext import database
+    from data_type import Customer, Account, LoanRecord
+    from generate_random_data import populate, branch_table, REFERENCE_DATE
+    # 生成进度输出到标准错误，标准输出留给结果JSON
+    with app.app_context(), redirect_stdout(sys.stderr):
+        populate(database.engine, customers, customers // 100, seed_value, workers,
+                 users=[f'bench{i}' for i in range(clients * 2)], password=PASSWORD)
+        data = {
+            'customers': [it[0] for it in database.session.query(Customer.user_id).order_by(Customer.user_id)],
+            'accounts': [it[0] for it in database.session.query(Account.account_id).order_by(Account.account_id)],
+            'loans': [it[0] for it in database.session.query(LoanRecord.loan_id).order_by(LoanRecord.loan_id)],
+            'branches': [name for name, _ in branch_table],
+            'year': REFERENCE_DATE.year  # 生成数据的截止年份，统计接口查询此前的年份
+        }
+        database.session.remove()
+    return data
+
+
+class Client:
+    """
+    单个并发客户端，持有独立的登录会话
+    """
+
+    def __init__(self, port: int, index: int, clients: int, data: dict, seed_value: int):
+        self.port = port
+        self.connection = http.client.HTTPConnection('127.0.0.1', port)
+        self.index = index
+        self.login_user = f'bench{clients + index}'  # login操作专用的账号，避免使本客户端的会话失效
+        self.data = data
+        self.rng = random.Random(seed_value * 1000 + index)
+        self.samples = defaultdict(list)  # 接口 -> [(耗时, SQL语句数, 是否成功)]
+        self.created = 0
+        self.headers = {}
+        session = self.post('/manage/login', {'user_id': f'bench{index}', 'passwd': PASSWORD}, record=False)
+        self.headers = {'USER_ID': f'bench{index}', 'SESSION': session['data']['session']}
+
+    def request(self, method: str, path: str, payload=None, label: str = None, record: bool = True) -> dict:
+        """
+        发送一个HTTP请求，耗时包含请求的编码、传输、服务器处理及响应的读取与解析
+        """
+        body = json.dumps(payload).encode() if payload is not None else None
+        start = time.perf_counter()
+        try:
+            self.connection.request(method, path, body=body, headers=self.headers)
+            response = self.connection.getresponse()
+            status, headers = response.status, response.headers
+            result = json.loads(response.read() or b'{}')
+        except (OSError, http.client.HTTPException, ValueError):
+            # 连接被关闭或响应无法解析，重新建立连接，本次记为失败
+            self.connection.close()
+            self.connection = http.client.HTTPConnection('127.0.0.1', self.port)
+            status, headers, result = 599, {}, {}
+        elapsed = time.perf_counter() - start
+        if headers.get('SESSION'):
+            self.headers['SESSION'] = headers['SESSION']
+        if record:
+            self.samples[label or path].append((elapsed, int(headers.get(STATEMENTS_HEADER, 0)),
+                                                status < 400 and bool(result.get('success'))))
+        return result
+
+    def post(self, path: str, payload: dict, label: str = None, record: bool = True) -> dict:
+        return self.request('POST', path, payload, label, record)
+
+    def run(self, mix: dict, requests: int, record: bool = True):
+        names, weights = list(mix.keys()), list(mix.values())
+        for name in self.rng.choices(names, weights, k=requests):
+            getattr(self, name)(record)
+
+    def account_query(self, record):
+        self.post('/account/query', {'method': 3, 'keyword': self.rng.choice(self.data['customers'])},
+                  record=record)
+
+    def account_get_all(self, record):
+        self.request('GET', f'/account/get_all?limit=50&after={self.rng.choice(self.data["accounts"])}',
+                     label='/account/get_all', record=record)
+
+    def customer_query(self, record):
+        self.post('/customer/query', {'exact': True, 'mode': 0, 'keyword': self.rng.choice(self.data['customers'])},
+                  record=record)
+
+    def customer_search(self, record):
+        self.post('/customer/query', {'exact': False, 'mode': 1, 'keyword': self.rng.choice('赵钱孙李周吴郑王'),
+                                      'limit': 20}, label='/customer/query?fuzzy', record=record)
+
+    def customer_overview(self, record):
+        self.post('/customer/overview', {'identifier_id': self.rng.choice(self.data['customers'])}, record=record)
+
+    def loan_query(self, record):
+        self.post('/loan/query', {'method': 3, 'keyword': self.rng.choice(self.data['customers'])}, record=record)
+
+    def _month_range(self) -> dict:
+        year = self.data['year'] - self.rng.randrange(3)
+        return {'date_from': f'{year}01', 'date_to': f'{year}12'}
+
+    def stat_user(self, record):
+        self.post('/stat/query_user', self._month_range(), record=record)
+
+    def stat_branch(self, record):
+        self.post('/stat/query_branch', self._month_range(), record=record)
+
+    def stat_distribution(self, record):
+        self.post('/stat/distribution/balance', {'bins': 20}, label='/stat/distribution/balance', record=record)
+
+    def deposit(self, record):
+        self.post('/account/deposit', {'account_id': self.rng.choice(self.data['accounts']),
+                                       'amount': self.rng.randint(1, 500)}, record=record)
+
+    def withdraw(self, record):
+        # 金额较小，除少数余额不足的账户外均应成功
+        self.post('/account/withdraw', {'account_id': self.rng.choice(self.data['accounts']),
+                                        'amount': self.rng.randint(1, 50)}, record=record)
+
+    def loan_pay(self, record):
+        self.post('/loan/pay', {'loan_id': self.rng.choice(self.data['loans']), 'fund': 1}, record=record)
+
+    def loan_create(self, record):
+        self.post('/loan/create', {'user_list': [self.rng.choice(self.data['customers'])],
+                                   'total_fund': self.rng.randint(1000, 100000),
+                                   'sub_branch': self.rng.choice(self.data['branches'])}, record=record)
+
+    def open_account(self, record):
+        """
+        新建客户并为其开户
+        """
+        self.created += 1
+        user_id = f'N{self.index:04d}{self.created:013d}'
+        self.post('/customer/create', {'identifier_id': user_id, 'name': '新客户', 'phone': '13800000000'},
+                  record=record)
+        self.post('/account/create', {'holder': [user_id], 'sub_branch': self.rng.choice(self.data['branches']),
+                                      'type': 1, 'overdraft': 0, 'refund': 0}, record=record)
+
+    def login(self, record):
+        self.post('/manage/login', {'user_id': self.login_user, 'passwd': PASSWORD}, record=record)
+
+
+def percentile(values: list, q: float) -> float:
+    """
+    最近秩法计算百分位数，values需已排序
+    """
+    return values[min(len(values) - 1, max(0, int(round(q / 100 * len(values))) - 1))]
+
+
+def summarize(samples: list, elapsed: float) -> dict:
+    latencies = sorted(sample[0] for sample in samples)
+    statements = [sample[1] for sample in samples]
+    return {
+        'count': len(samples),
+        'errors': sum(not sample[2] for sample in samples),
+        'throughput': round(len(samples) / elapsed, 2),
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies) * 1000, 3),
+            'p50': round(percentile(latencies, 50) * 1000, 3),
+            'p95': round(percentile(latencies, 95) * 1000, 3),
+            'p99': round(percentile(latencies, 99) * 1000, 3),
+            'max': round(latencies[-1] * 1000, 3)
+        },
+        'sql_statements': {
+            'mean': round(sum(statements) / len(statements), 2),
+            'max': max(statements)
+        }
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=None, help='SQLAlchemy数据库URL（需为空库），默认使用临时SQLite文件')
+    parser.add_argument('--customers', type=int, default=2000, help='客户数，账户约为其1.5倍，贷款约为其0.3倍')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='生成数据的进程数')
+    parser.add_argument('--clients', type=int, default=8, help='并发客户端数')
+    parser.add_argument('--requests', type=int, default=300, help='每个客户端的请求数')
+    parser.add_argument('--warmup', type=int, default=20, help='每个客户端预热的请求数，不计入结果')
+    parser.add_argument('--mix', choices=sorted(MIXES), default='mixed', help='请求混合比例')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子，相同种子生成相同的数据及请求序列')
+    parser.add_argument('--output', default=None, help='结果JSON文件路径，默认输出到标准输出')
+    args = parser.parse_args()
+
+    uri = args.db or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    app = load_app(uri)
+    start = time.perf_counter()
+    data = seed(app, args.customers, args.clients, args.seed, args.workers)
+    seed_time = time.perf_counter() - start
+
+    server = serve(app)
+    clients = [Client(server.server_port, i, args.clients, data, args.seed) for i in range(args.clients)]
+    mix = MIXES[args.mix]
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        list(pool.map(lambda c: c.run(mix, args.warmup, record=False), clients))
+        start = time.perf_counter()
+        list(pool.map(lambda c: c.run(mix, args.requests), clients))
+        elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    samples = defaultdict(list)
+    for client in clients:
+        for label, items in client.samples.items():
+            samples[label].extend(items)
+    result = {
+        'meta': {
+            'revision': git_revision(),
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'database': uri.split(':', 1)[0],
+            'customers': args.customers,
+            'accounts': len(data['accounts']),
+            'loans': len(data['loans']),
+            'branches': len(data['branches']),
+            'server': 'werkzeug threaded',
+            'clients': args.clients,
+            'requests_per_client': args.requests,
+            'mix': args.mix,
+            'seed': args.seed,
+            'seed_seconds': round(seed_time, 2),
+            'elapsed_seconds': round(elapsed, 3)
+        },
+        'total': summarize([item for items in samples.values() for item in items], elapsed),
+        'endpoints': {label: summarize(items, elapsed) for label, items in sorted(samples.items())}
+    }
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
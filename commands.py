@@ -0,0 +1,83 @@
+"""
+维护命令
+通过 flask <命令名> 调用，例如：
+FLASK_APP=app.py flask rebuild-customer-index
+"""
+import json
+import click
+from flask.cli import with_appcontext
+
+
+@click.command('rebuild-customer-index')
+@with_appcontext
+def rebuild_customer_index_command():
+    """根据customer表重建客户模糊查询索引，引入索引前已有的客户需运行一次才能被模糊查询找到"""
+    from api.search import rebuild_customer_index
+    count = rebuild_customer_index()
+    click.echo(f'已为{count}个客户重建索引')
+
+
+@click.command('import-customers')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']), default=None,
+              help='数据格式，默认按文件扩展名判断')
+@click.option('--batch-size', type=int, default=None, help='每批写入行数，默认为IMPORT_BATCH_SIZE')
+@with_appcontext
+def import_customers_command(path, fmt, batch_size):
+    """从NDJSON/CSV文件流式批量导入客户"""
+    import config
+    from api.importer import CustomerImporter, iter_records
+    fmt = fmt or ('csv' if path.lower().endswith('.csv') else 'ndjson')
+    with open(path, 'rb') as f:
+        report = CustomerImporter(batch_size or config.IMPORT_BATCH_SIZE).run(iter_records(f, fmt))
+    click.echo(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+@click.command('verify-loan-paid')
+@click.option('--fix', is_flag=True, help='将不一致的已发放金额更正为按发放记录重新计算的值')
+@with_appcontext
+def verify_loan_paid_command(fix):
+    """按发放记录校验（及回填）贷款的已发放金额"""
+    from api.loan import verify_paid_fund
+    mismatched = verify_paid_fund(fix)
+    for item in mismatched:
+        click.echo(f"{item['loan_id']}: 记录值 {item['stored']:.2f}, 实际值 {item['actual']:.2f}")
+    click.echo(f'共{len(mismatched)}笔贷款不一致' + ('，已更正' if fix and mismatched else ''))
+
+
+@click.command('rebuild-stat')
+@with_appcontext
+def rebuild_stat_command():
+    """根据明细表重建/stat接口使用的按月汇总表"""
+    from api.rollup import rebuild_rollups
+    customers, branches = rebuild_rollups()
+    click.echo(f'已重建{customers}条客户汇总、{branches}条支行汇总')
+
+
+@click.command('sync-replicas')
+@click.option('--chunk-size', type=int, default=5000, help='每次复制的行数')
+@with_appcontext
+def sync_replicas_command(chunk_size):
+    """将主库的表结构与数据全量复制到DB_REPLICA_URIS中的各个从库，用于本地以SQLite模拟主从"""
+    from ext import database
+    metadata = database.Model.metadata
+    source = database.engine
+    for key in database.replica_binds():
+        target = database.get_engine(bind=key)
+        metadata.create_all(bind=target)
+        with source.connect() as src, target.begin() as dst:
+            for table in reversed(metadata.sorted_tables):
+                dst.execute(table.delete())
+            for table in metadata.sorted_tables:
+                result = src.execution_options(stream_results=True).execute(table.select())
+                for rows in result.partitions(chunk_size):
+                    dst.execute(table.insert(), [dict(row._mapping) for row in rows])
+        click.echo(f'已同步从库{key}')
+
+
+def register_commands(app):
+    app.cli.add_command(rebuild_customer_index_command)
+    app.cli.add_command(import_customers_command)
+    app.cli.add_command(verify_loan_paid_command)
+    app.cli.add_command(rebuild_stat_command)
+    app.cli.add_command(sync_replicas_command)
@@ -12,4 +12,42 @@ DB_NAME = 'Bank'
 
 SQLALCHEMY_DATABASE_URI = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}?charset=utf8"
 
+DB_POOL_SIZE = 10  # 每个进程保持的数据库连接数
+DB_MAX_OVERFLOW = 20  # 连接池满时允许额外创建的连接数
+DB_POOL_TIMEOUT = 10  # 等待空闲连接的最长时间（秒）
+DB_POOL_RECYCLE = 3600  # 连接的最长使用时间（秒），应小于数据库的wait_timeout
+DB_POOL_PRE_PING = True  # 取出连接时先检测连接是否可用
+
+DB_REPLICA_URIS = []  # 从库地址列表，为空时所有查询都发往主库
+DB_READ_ONLY_SUFFIXES = ('/query', '/get_all')  # 路径以此结尾的接口为只读接口，查询发往从库
+DB_READ_ONLY_PREFIXES = ('/stat/',)  # 路径以此开头的接口为只读接口
+DB_PRIMARY_ONLY_TABLES = ('user', 'session_denylist', 'card_sequence')  # 始终从主库读取的表
+
+SESSION_MODE = 'database'  # 会话模式：database为数据库保存Session，token为无状态签名Token
+SESSION_SECRET = "YOUR_SESSION_SECRET"  # token模式下的签名密钥，多进程/多机部署需保持一致
+SESSION_TOKEN_RENEW = 300  # token模式下，签发超过该时间（秒）的Token在使用时换发新Token
+SESSION_DENYLIST_REFRESH = 10  # 各进程从数据库同步登出列表的间隔（秒），也是其他进程的登出最晚生效的时间
 SEC_VALID_TIME = 3600
+SESSION_CACHE_TTL = 60  # 进程内Session缓存项的有效时间（秒），超过后回源数据库校验；数据库模式的登出列表条目保留同样长的时间
+SESSION_CACHE_SIZE = 10000  # 进程内Session缓存的最大条目数
+SESSION_FLUSH_INTERVAL = 30  # 最后使用时间批量写回数据库的间隔（秒），应远小于SEC_VALID_TIME
+
+METRICS_ENABLED = True  # 是否统计接口指标并开放/metrics
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # 延迟直方图的分桶（秒）
+
+SQL_SLOW_THRESHOLD = 0.5  # 执行时间超过该值（秒）的语句记入慢查询日志，None为关闭
+SQL_REPEAT_THRESHOLD = 10  # 同一形状的语句在一个请求中执行超过该次数时告警，None为关闭
+SQL_INSPECTOR_STRICT = False  # 为True时重复查询直接抛出异常，用于测试
+
+JSON_BACKEND = 'auto'  # 接口JSON编解码实现：orjson / stdlib，auto时若已安装orjson则使用orjson
+
+CARD_BLOCK_SIZE = 1000  # 每个进程一次从数据库预留的卡号数量
+
+BATCH_MAX_SIZE = 5000  # 批量接口单次请求允许的最大条目数
+
+IMPORT_BATCH_SIZE = 1000  # 批量导入客户时每个事务写入的行数
+
+STAT_CACHE_BACKEND = 'local'  # /stat结果缓存后端：local为进程内缓存，redis为多进程共享缓存，或 模块路径.类名
+STAT_CACHE_SIZE = 1024  # 进程内缓存的最大条目数
+STAT_CACHE_REDIS_URL = 'redis://localhost:6379/0'
+STAT_CACHE_TTL = 300  # 缓存项的过期时间（秒），同时限制从库延迟导致的旧结果在缓存中保留的时间
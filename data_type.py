@@ -1,8 +1,40 @@
 from ext import database
 from typing import Optional, Union, List
+from decimal import Decimal, InvalidOperation
 import uuid
 import datetime
 
+CENT = Decimal('0.01')
+MONEY_LIMIT = Decimal(10) ** 18  # DECIMAL(20, 2)可表示的金额上限（不含）
+
+
+def to_money(value) -> Decimal:
+    """
+    将金额转换为与DECIMAL(20, 2)列一致的Decimal
+    新建对象flush后仍保留构造时的值，需与从数据库读出的类型一致
+    """
+    return Decimal(str(value)).quantize(CENT)
+
+
+def parse_money(value, positive: bool = True) -> Optional[Decimal]:
+    """
+    校验并转换请求中的金额
+    接受数值或数值字符串（布尔值除外），须为有限值、至多两位小数且在DECIMAL(20, 2)的范围内
+    :param positive: 为True时要求金额大于0
+    :return: 与DECIMAL(20, 2)列一致的Decimal，不合法时返回None
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        return None
+    try:
+        amount = Decimal(str(value))
+    except InvalidOperation:
+        return None
+    if not amount.is_finite() or abs(amount) >= MONEY_LIMIT or amount != amount.quantize(CENT):
+        return None
+    if positive and amount <= 0:
+        return None
+    return amount.quantize(CENT)
+
 
 class AccountType:
     SAVING = 0
@@ -26,6 +58,17 @@ class User(database.Model):
     last_use_time = database.Column(database.INTEGER, default=0)
 
 
+class SessionDenylist(database.Model):
+    """
+    已登出的会话，仅由登出（数据库模式下还有顶替旧Session的登录）写入
+    token模式记录会话ID，数据库模式记录Session的摘要，用于使其他进程缓存中的Session失效
+    过期后的条目不再有意义，会在登出时顺带清理
+    """
+    __tablename__ = 'session_denylist'
+    session_id = database.Column(database.CHAR(length=16), primary_key=True)
+    expire_at = database.Column(database.INTEGER, nullable=False, index=True)
+
+
 class SubBranch(database.Model):
     __tablename__ = 'subbranch'
     name = database.Column(database.VARCHAR(length=10), primary_key=True)
@@ -36,7 +79,7 @@ class SubBranch(database.Model):
         return {
             'name': self.name,
             'city': self.city,
-            'fund': float(self.fund)
+            'fund': self.fund
         }
 
 
@@ -71,6 +114,18 @@ class BankManager(database.Model):
 
 
 class Customer(database.Model):
+    # 接口字段名 -> 数据表字段名
+    FIELD_MAP = {
+        'identifier_id': 'user_id',
+        'name': 'name',
+        'phone': 'phone',
+        'address': 'address',
+        's_name': 's_name',
+        's_phone': 's_phone',
+        's_email': 's_email',
+        's_rel': 's_relation'
+    }
+
     def __init__(self, js: Optional[dict] = None):
         t = datetime.datetime.now()
         self.create_time = str(t.year).zfill(4) + str(t.month).zfill(2)
@@ -78,14 +133,8 @@ class Customer(database.Model):
             self.update(js)
 
     def update(self, js: dict):
-        self.user_id = js.get('identifier_id')
-        self.name = js.get('name')
-        self.phone = js.get('phone')
-        self.address = js.get('address')
-        self.s_name = js.get('s_name')
-        self.s_phone = js.get('s_phone')
-        self.s_email = js.get('s_email')
-        self.s_relation = js.get('s_rel')
+        for key, attr in self.FIELD_MAP.items():
+            setattr(self, attr, js.get(key))
 
     def to_dict(self):
         return {
@@ -111,14 +160,33 @@ class Customer(database.Model):
     create_time = database.Column(database.CHAR(length=6), nullable=False)
 
 
+class CustomerNgram(database.Model):
+    """
+    客户模糊查询用的N-gram倒排索引
+    field与/customer/query的mode一致: 0 身份证号, 1 姓名, 2 电话
+    """
+    def __init__(self, field, gram, customer_id):
+        self.field = field
+        self.gram = gram
+        self.customer_id = customer_id
+
+    __tablename__ = 'customer_ngram'
+    field = database.Column(database.SMALLINT, primary_key=True)
+    gram = database.Column(database.VARCHAR(length=3), primary_key=True)
+    customer_id = database.Column(database.CHAR(length=18), database.ForeignKey(Customer.user_id), primary_key=True)
+    __table_args__ = (
+        database.Index('id_ngram_customer', customer_id),
+    )
+
+
 class Account(database.Model):
     def __init__(self, account_id, branch, ac_type):
         self.account_id = account_id
         self.sub_branch = branch
         self.type = ac_type
-        self.refund = 0
-        self.open_date = datetime.datetime.now()
-        self.recent_visit = datetime.datetime.now()
+        self.refund = to_money(0)
+        self.open_date = datetime.date.today()
+        self.recent_visit = datetime.date.today()
 
     __tablename__ = 'account'
     account_id = database.Column(database.CHAR(length=19), primary_key=True)
@@ -127,15 +195,29 @@ class Account(database.Model):
     sub_branch = database.Column(database.VARCHAR(length=10), database.ForeignKey(SubBranch.name), nullable=False)
     recent_visit = database.Column(database.DATE, nullable=False)
     type = database.Column(database.INTEGER, nullable=False)
+    version = database.Column(database.INTEGER, nullable=False, default=1)  # 乐观锁版本号，每次修改余额或信息时递增
     __table_args__ = (
         database.Index('id_acc_acc_tp', account_id, type),
     )
+    __mapper_args__ = {
+        'version_id_col': version
+    }
+
+
+class CardSequence(database.Model):
+    """
+    卡号分配序列
+    各进程从此表中按块预留卡号
+    """
+    __tablename__ = 'card_sequence'
+    name = database.Column(database.VARCHAR(length=16), primary_key=True)
+    next_value = database.Column(database.BIGINT, nullable=False)  # 下一个尚未被预留的卡号
 
 
 class SavingAccount(database.Model):
     def __init__(self, account_id, rate, finance):
         self.account_id = account_id
-        self.rate = rate
+        self.rate = to_money(rate)
         self.finance = finance
 
     __tablename__ = 'saving_account'
@@ -147,7 +229,7 @@ class SavingAccount(database.Model):
 class CheckingAccount(database.Model):
     def __init__(self, account_id, overdraft):
         self.account_id = account_id
-        self.overdraft = overdraft
+        self.overdraft = to_money(overdraft)
 
     __tablename__ = 'checking_account'
     account_id = database.Column(database.CHAR(length=19), database.ForeignKey(Account.account_id), primary_key=True)
@@ -159,13 +241,15 @@ class LoanRecord(database.Model):
     loan_id = database.Column(database.CHAR(18), primary_key=True)
     subbranch = database.Column(database.VARCHAR(length=10), database.ForeignKey(SubBranch.name), nullable=False)
     total_fund = database.Column(database.DECIMAL(20, 2), nullable=False)
+    paid_fund = database.Column(database.DECIMAL(20, 2), nullable=False, default=0)  # 已发放金额，与paid_record同步维护
     date = database.Column(database.DATE, nullable=False)
 
     def __init__(self, subbranch, total_fund):
         self.loan_id = str(uuid.uuid4())[:18]
         self.subbranch = subbranch
-        self.total_fund = total_fund
-        self.date = datetime.datetime.now()
+        self.total_fund = to_money(total_fund)
+        self.paid_fund = to_money(0)
+        self.date = datetime.date.today()
 
 
 class PaidRecord(database.Model):
@@ -177,8 +261,8 @@ class PaidRecord(database.Model):
 
     def __init__(self, loan_id, fund):
         self.loan_id = loan_id
-        self.fund = fund
-        self.date = datetime.datetime.now()
+        self.fund = to_money(fund)
+        self.date = datetime.date.today()
 
 
 class RelationLoanUsr(database.Model):
@@ -208,3 +292,25 @@ class RelationAccountCustomerBranch(database.Model):
         database.UniqueConstraint(customer_id, type, branch),
         database.ForeignKeyConstraint((account_id, type), (Account.account_id, Account.type))
     )
+
+
+class StatCustomerMonth(database.Model):
+    """
+    按月汇总的新增客户数，随客户的增删同步维护
+    """
+    __tablename__ = 'stat_customer_month'
+    month = database.Column(database.CHAR(length=6), primary_key=True)  # YYYYMM
+    new_customers = database.Column(database.INTEGER, nullable=False, default=0)
+
+
+class StatBranchMonth(database.Model):
+    """
+    按月、支行汇总的贷款及发放金额，随贷款的增删及发放同步维护
+    贷款按创建日期计入，发放按发放日期计入
+    """
+    __tablename__ = 'stat_branch_month'
+    month = database.Column(database.CHAR(length=6), primary_key=True)  # YYYYMM
+    branch = database.Column(database.VARCHAR(length=10), primary_key=True)
+    loan_count = database.Column(database.INTEGER, nullable=False, default=0)
+    loan_fund = database.Column(database.DECIMAL(20, 2), nullable=False, default=0)
+    paid_fund = database.Column(database.DECIMAL(20, 2), nullable=False, default=0)
@@ -1,3 +1,122 @@
-from flask_sqlalchemy import SQLAlchemy
+import random
+from flask import g, has_request_context, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import orm, event
+from sqlalchemy.exc import InvalidRequestError
 
-database = SQLAlchemy(session_options={'autocommit': True})
\ No newline at end of file
+REPLICA_BIND_PREFIX = 'replica_'
+SQLITE_WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+def is_read_only_request() -> bool:
+    """
+    当前请求是否为只读接口：路径以DB_READ_ONLY_SUFFIXES结尾或以DB_READ_ONLY_PREFIXES开头
+    """
+    if not has_request_context():
+        return False
+    config = database.get_app().config
+    path = request.path.rstrip('/')
+    return path.endswith(tuple(config['DB_READ_ONLY_SUFFIXES'])) or \
+        path.startswith(tuple(config['DB_READ_ONLY_PREFIXES']))
+
+
+class RoutingSession(SignallingSession):
+    """
+    读写分离的Session
+    只读接口中的SELECT发往请求开始时选定的一个从库，其余语句及请求外的操作发往主库
+    只读接口不允许写入，写接口的查询全部发往主库，因此不会出现读不到本请求写入的情况
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if has_request_context():
+            if self._flushing or getattr(clause, 'is_dml', False):
+                if g.get('db_read_only'):
+                    raise InvalidRequestError('只读接口中不允许写入数据库')
+            elif getattr(clause, 'is_select', False):
+                replica = self._replica_engine(mapper)
+                if replica is not None:
+                    return replica
+        return super().get_bind(mapper, clause)
+
+    def _replica_engine(self, mapper):
+        if mapper is not None and mapper.persist_selectable.name in self.app.config['DB_PRIMARY_ONLY_TABLES']:
+            return None
+        if 'db_replica' not in g:
+            replicas = database.replica_binds(self.app)
+            g.db_replica = random.choice(replicas) if replicas and is_read_only_request() else None
+        if g.db_replica is None:
+            return None
+        return database.get_engine(self.app, bind=g.db_replica)
+
+
+def _delay_sqlite_begin(engine):
+    """
+    pysqlite在SAVEPOINT前不会开启事务，使保存点的RELEASE直接提交
+    改为由此处在首条写语句或SAVEPOINT前显式发出BEGIN，只读语句仍不持有锁，与pysqlite默认行为一致
+    """
+    def begin_if_needed(dbapi_connection):
+        if not dbapi_connection.in_transaction:
+            dbapi_connection.execute('BEGIN')
+
+    @event.listens_for(engine, 'connect')
+    def _disable_pysqlite_transaction(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _begin_before_write(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip()[:7].upper().startswith(SQLITE_WRITE_STATEMENTS):
+            begin_if_needed(conn.connection.connection)
+
+    @event.listens_for(engine, 'savepoint')
+    def _begin_before_savepoint(conn, name):
+        begin_if_needed(conn.connection.connection)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """
+    在Flask-SQLAlchemy基础上增加连接池配置与从库路由
+    从库由DB_REPLICA_URIS配置，注册为名为replica_0、replica_1...的bind
+    """
+
+    def init_app(self, app):
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        for i, uri in enumerate(app.config.get('DB_REPLICA_URIS') or ()):
+            binds[f'{REPLICA_BIND_PREFIX}{i}'] = uri
+        app.config['SQLALCHEMY_BINDS'] = binds
+        super().init_app(app)
+        app.before_request(self._reset_routing)
+
+    @staticmethod
+    def _reset_routing():
+        # g随应用上下文存在，可能跨越多个请求，每个请求开始时重新选择从库
+        g.pop('db_replica', None)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def replica_binds(self, app=None):
+        app = self.get_app(app)
+        return [key for key in app.config['SQLALCHEMY_BINDS'] if key.startswith(REPLICA_BIND_PREFIX)]
+
+    def create_engine(self, sa_url, engine_opts):
+        engine = super().create_engine(sa_url, engine_opts)
+        if engine.dialect.name == 'sqlite':
+            _delay_sqlite_begin(engine)
+        return engine
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        """
+        以config中的连接池配置覆盖Flask-SQLAlchemy的默认值，SQLALCHEMY_ENGINE_OPTIONS仍具有最高优先级
+        """
+        sa_url, options = super().apply_driver_hacks(app, sa_url, options)
+        options['pool_pre_ping'] = app.config['DB_POOL_PRE_PING']
+        options['pool_recycle'] = app.config['DB_POOL_RECYCLE']
+        # SQLite文件库使用NullPool，不接受连接池大小参数
+        if sa_url.drivername != 'sqlite':
+            options['pool_size'] = app.config['DB_POOL_SIZE']
+            options['max_overflow'] = app.config['DB_MAX_OVERFLOW']
+            options['pool_timeout'] = app.config['DB_POOL_TIMEOUT']
+        return sa_url, options
+
+
+database = RoutingSQLAlchemy()
@@ -1,9 +1,38 @@
-from faker import Faker
-import config
-import pymysql
-from random import randint
+"""
+随机测试数据生成
+为全部数据表生成大规模测试数据：登录用户、支行、部门、员工、部门经理、客户及其模糊查询索引、
+账户（含储蓄/支票子表）、持卡人关系（含联名账户）、贷款、贷款持有人及发放记录，并重建/stat使用的汇总表
+数据表中已有数据时拒绝运行，需指定--truncate清空或--drop删除并重建业务数据表；
+登录用户表与登出列表不受影响，只有指定--users时才清空并重新生成登录用户
+
+- 支行热度、账户数、余额、贷款金额及发放次数均为偏斜分布，客户开户时间逐月增长
+- 数据按客户分块，每块使用由种子及块号确定的随机数生成器，结果与进程数无关，相同的种子及块大小总是生成相同的数据
+- 各块在进程池中生成，由主进程以多行INSERT写入任意SQLAlchemy数据库（含SQLite）
 
-NUM_DATA = 50  # 指定数据大小
+python generate_random_data.py --db sqlite:///bank.db --customers 1000000 --drop --users 10
+"""
+import argparse
+import datetime
+import os
+import random
+import sqlite3
+import time
+from bisect import bisect
+from collections import Counter, defaultdict
+from functools import lru_cache
+from itertools import accumulate
+from multiprocessing import Pool
+from typing import Dict, List, Tuple
+
+from sqlalchemy import create_engine, event, bindparam, select, literal_column
+
+import config
+from ext import database
+from data_type import User, SessionDenylist, SubBranch, Department, Employee, BankManager, Customer, CustomerNgram, Account, SavingAccount, \
+    CheckingAccount, RelationAccountCustomerBranch, LoanRecord, RelationLoanUsr, PaidRecord, StatCustomerMonth, \
+    StatBranchMonth, AccountType
+from api.search import customer_index_rows
+from api.rollup import month_of
 
 department_table = (
     (1, '办公室'),
@@ -14,63 +43,349 @@ department_table = (
     (6, '物业管理服务中心')
 )
 
-branch = """INSERT INTO bank.subbranch (name, city, fund) VALUES ('三里庵支行', '合肥', 0.00);
-INSERT INTO bank.subbranch (name, city, fund) VALUES ('亳州路储蓄所', '合肥', 0.00);
-INSERT INTO bank.subbranch (name, city, fund) VALUES ('嘉山路分理处', '合肥', 0.00);
-INSERT INTO bank.subbranch (name, city, fund) VALUES ('广东省分行营业部', '广州', 0.00);
-INSERT INTO bank.subbranch (name, city, fund) VALUES ('广州东山支行营业室', '广州', 0.00);
-INSERT INTO bank.subbranch (name, city, fund) VALUES ('广州天河支行华南农业', '广州', 0.00);
-INSERT INTO bank.subbranch (name, city, fund) VALUES ('广州天河支行暨南大学', '广州', 0.00);
-INSERT INTO bank.subbranch (name, city, fund) VALUES ('广州天河支行濂泉路支', '广州', 0.00);
-INSERT INTO bank.subbranch (name, city, fund) VALUES ('广州天河支行营业室', '广州', 0.00);
-INSERT INTO bank.subbranch (name, city, fund) VALUES ('广州白云支行先烈东路', '广州', 0.00);
-INSERT INTO bank.subbranch (name, city, fund) VALUES ('望江西路分理处', '合肥', 0.00);
-INSERT INTO bank.subbranch (name, city, fund) VALUES ('滨水城分理处', '合肥', 0.00);
-INSERT INTO bank.subbranch (name, city, fund) VALUES ('蒙城北路分理处', '合肥', 0.00);
-INSERT INTO bank.subbranch (name, city, fund) VALUES ('阜阳北路支行', '合肥', 0.00);
-INSERT INTO bank.subbranch (name, city, fund) VALUES ('颐和花园分理处', '合肥', 0.00);
-INSERT INTO bank.subbranch (name, city, fund) VALUES ('高新开发区支行', '合肥', 0.00);
-INSERT INTO bank.subbranch (name, city, fund) VALUES ('龙岗支行', '合肥', 0.00);"""
-
-faker_instance = Faker(locale='zh_CN')
-
-conn = pymysql.connect(user=config.DB_USER, passwd=config.DB_PASSWORD, db=config.DB_NAME, host=config.DB_HOST,
-                       port=config.DB_PORT)
-cursor = conn.cursor()
-# 清空数据表
-cursor.execute('DELETE FROM subbranch;')
-cursor.execute('DELETE FROM employee;')
-cursor.execute('DELETE FROM department;')
-cursor.execute('DELETE FROM customer;')
-conn.commit()
-# 添加支行
-for l in branch.split(';'):
-    if l:
-        cursor.execute(l)
-# conn.commit()
-# 提取所有支行信息
-cursor.execute('SELECT name, city FROM subbranch;')
-branches = cursor.fetchall()
-
-# 添加所有部门
-for branch_name, _ in branches:
-    for dp_id, dp_type in department_table:
-        cursor.execute('INSERT INTO bank.department (department_id, department_type, subbranch) VALUES (%s, %s, %s)',
-                       (dp_id, dp_type, branch_name))
-conn.commit()
-# 随机生成员工数据
-for _ in range(NUM_DATA):
-    target_depart = randint(1, len(department_table))
-    target_branch = branches[randint(0, len(branches) - 1)][0]
-    cursor.execute(
-        'INSERT INTO bank.employee (user_id, type, name, phone, address, department_id, start_date, subbranch) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)',
-        (faker_instance.ssn(min_age=18, max_age=100), 0, faker_instance.name(), faker_instance.phone_number(),
-         faker_instance.address(), target_depart, '2021-05-01', target_branch))
-# 随机生成客户数据
-for _ in range(NUM_DATA):
-    cursor.execute(
-        'INSERT INTO bank.customer (user_id, name, phone, address, s_name, s_phone, s_email, s_relation, create_time) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)',
-        (faker_instance.ssn(min_age=18, max_age=100), faker_instance.name(), faker_instance.phone_number(),
-         faker_instance.address(), faker_instance.name(), faker_instance.phone_number(), faker_instance.email(), '测试关系',
-         str(randint(2018, 2021)).zfill(4) + str(randint(1, 12)).zfill(2)))
-conn.commit()
+branch_table = (
+    ('三里庵支行', '合肥'),
+    ('亳州路储蓄所', '合肥'),
+    ('嘉山路分理处', '合肥'),
+    ('广东省分行营业部', '广州'),
+    ('广州东山支行营业室', '广州'),
+    ('广州天河支行华南农业', '广州'),
+    ('广州天河支行暨南大学', '广州'),
+    ('广州天河支行濂泉路支', '广州'),
+    ('广州天河支行营业室', '广州'),
+    ('广州白云支行先烈东路', '广州'),
+    ('望江西路分理处', '合肥'),
+    ('滨水城分理处', '合肥'),
+    ('蒙城北路分理处', '合肥'),
+    ('阜阳北路支行', '合肥'),
+    ('颐和花园分理处', '合肥'),
+    ('高新开发区支行', '合肥'),
+    ('龙岗支行', '合肥')
+)
+
+SURNAMES = '王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗郑梁谢宋唐许韩冯邓曹彭曾肖田董袁潘于蒋蔡余杜叶程苏魏吕丁任沈姚卢'
+GIVEN_NAMES = '伟芳娜秀英敏静丽强磊军洋勇艳杰娟涛明超兰霞平刚桂华建国志文玉红晓东海燕鹏飞宇浩然子涵欣怡梓轩一诺'
+STREETS = ('长江西路', '黄山路', '金寨路', '望江东路', '马鞍山路', '天河路', '中山大道', '环市东路', '体育西路', '淮河路')
+RELATIONS = ('父母', '配偶', '子女', '兄弟姐妹', '朋友')
+PHONE_PREFIXES = ('130', '131', '132', '135', '136', '137', '138', '139', '150', '151', '158', '159', '177', '186',
+                  '188', '189')
+
+# 每个客户持有的账户数及其权重
+ACCOUNTS_PER_CUSTOMER = ((0, 8), (1, 52), (2, 25), (3, 10), (4, 5))
+JOINT_ACCOUNT_RATE = 0.06  # 账户增加一名共同持卡人的概率
+LOAN_CUSTOMER_RATE = 0.25  # 持有贷款的客户比例
+
+HISTORY_DAYS = 5 * 365  # 数据覆盖的天数
+REFERENCE_DATE = datetime.date(2021, 6, 1)  # 数据的截止日期，使相同种子生成的数据与运行日期无关
+
+# 写入顺序，满足外键依赖
+TABLE_ORDER = (User, SubBranch, Department, Employee, BankManager, Customer, CustomerNgram, Account, SavingAccount, CheckingAccount,
+               RelationAccountCustomerBranch, LoanRecord, RelationLoanUsr, PaidRecord, StatCustomerMonth,
+               StatBranchMonth)
+# 登录相关的表，只在指定--users时清空
+AUTH_TABLES = (User.__table__, SessionDenylist.__table__)
+
+
+def branch_weights(branches: int) -> List[float]:
+    """
+    支行热度服从Zipf分布，少数支行集中了大部分账户与贷款
+    """
+    return list(accumulate(1 / (rank + 1) ** 1.1 for rank in range(branches)))
+
+
+class ChunkGenerator:
+    """
+    生成一个数据块，随机数生成器由种子、数据类别及块号确定
+    """
+
+    def __init__(self, seed: int, kind: str, chunk: int, today: datetime.date):
+        self.rng = random.Random(f'{seed}:{kind}:{chunk}')
+        self.today = today
+        self.cum_weights = branch_weights(len(branch_table))
+
+    def branch(self) -> str:
+        return branch_table[bisect(self.cum_weights, self.rng.random() * self.cum_weights[-1])][0]
+
+    def name(self) -> str:
+        return self.rng.choice(SURNAMES) + ''.join(self.rng.choice(GIVEN_NAMES)
+                                                   for _ in range(self.rng.choice((1, 2, 2, 2))))
+
+    def phone(self) -> str:
+        return self.rng.choice(PHONE_PREFIXES) + str(self.rng.randrange(10 ** 8)).zfill(8)
+
+    def address(self) -> str:
+        return f'{self.rng.choice(branch_table)[1]}市{self.rng.choice(STREETS)}{self.rng.randint(1, 999)}号'
+
+    def recent_date(self, days: int = HISTORY_DAYS) -> datetime.date:
+        """
+        越近的日期概率越大，模拟业务量的逐年增长
+        """
+        return self.today - datetime.timedelta(days=int(days * (1 - self.rng.random() ** 0.5)))
+
+    def date_after(self, start: datetime.date) -> datetime.date:
+        return start + datetime.timedelta(days=self.rng.randint(0, (self.today - start).days))
+
+    def cents(self, mu: float, sigma: float) -> int:
+        return int(self.rng.lognormvariate(mu, sigma) * 100)
+
+
+def generate_customers(args: Tuple[int, int, int, int, datetime.date]) -> Tuple[Dict[str, list], dict]:
+    """
+    生成编号在[start, end)内的客户及其账户、贷款
+    联名账户及共同贷款人只在块内选取，以便在块内保证持卡人关系的唯一约束
+    :return: (表名 -> 行列表, 汇总数据)
+    """
+    seed, chunk, start, end, today = args
+    gen = ChunkGenerator(seed, 'customer', chunk, today)
+    rng = gen.rng
+    rows = defaultdict(list)
+    customer_months = Counter()
+    branch_stats = defaultdict(lambda: [0, 0, 0])  # (月份, 支行) -> [贷款数, 贷款金额(分), 发放金额(分)]
+    held = set()  # 块内已有的(客户, 账户类型, 支行)
+    user_ids = [str(i).zfill(18) for i in range(start, end)]
+    counts, weights = zip(*ACCOUNTS_PER_CUSTOMER)
+
+    for i, user_id in zip(range(start, end), user_ids):
+        created = gen.recent_date()
+        customer = {
+            'user_id': user_id,
+            'name': gen.name(),
+            'phone': gen.phone(),
+            'address': gen.address(),
+            's_name': gen.name(),
+            's_phone': gen.phone(),
+            's_email': f'u{i}@example.com',
+            's_relation': rng.choice(RELATIONS),
+            'create_time': month_of(created)
+        }
+        rows[Customer.__tablename__].append(customer)
+        # 集合的遍历顺序随进程的哈希种子变化，排序以保证写入顺序一致
+        rows[CustomerNgram.__tablename__].extend(sorted(customer_index_rows(customer),
+                                                        key=lambda row: (row['field'], row['gram'])))
+        customer_months[customer['create_time']] += 1
+
+        for k in range(rng.choices(counts, weights)[0]):
+            ac_type = AccountType.CHECKING if rng.random() < 0.35 else AccountType.SAVING
+            branch = gen.branch()
+            if (user_id, ac_type, branch) in held:
+                continue
+            held.add((user_id, ac_type, branch))
+            account_id = str(i * 10 + k).zfill(19)
+            open_date = gen.date_after(created)
+            refund = 0 if rng.random() < 0.05 else gen.cents(8, 1.8)
+            if ac_type == AccountType.CHECKING:
+                overdraft = rng.choice((0, 0, 100000, 500000, 2000000))
+                if overdraft and rng.random() < 0.1:
+                    refund = -rng.randrange(overdraft)
+                rows[CheckingAccount.__tablename__].append({'account_id': account_id, 'overdraft': overdraft / 100})
+            else:
+                rows[SavingAccount.__tablename__].append({
+                    'account_id': account_id, 'rate': rng.choice((0.35, 1.1, 1.3, 1.5, 1.75, 2.25)),
+                    'finance': rng.choice(('CNY', 'CNY', 'CNY', 'USD', 'EUR'))})
+            rows[Account.__tablename__].append({
+                'account_id': account_id, 'refund': refund / 100, 'open_date': open_date,
+                'sub_branch': branch, 'recent_visit': gen.date_after(open_date), 'type': ac_type, 'version': 1})
+            rows[RelationAccountCustomerBranch.__tablename__].append(
+                {'account_id': account_id, 'customer_id': user_id, 'type': ac_type, 'branch': branch})
+            joint = rng.choice(user_ids)
+            if rng.random() < JOINT_ACCOUNT_RATE and (joint, ac_type, branch) not in held:
+                held.add((joint, ac_type, branch))
+                rows[RelationAccountCustomerBranch.__tablename__].append(
+                    {'account_id': account_id, 'customer_id': joint, 'type': ac_type, 'branch': branch})
+
+        if rng.random() >= LOAN_CUSTOMER_RATE:
+            continue
+        for k in range(min(int(rng.expovariate(1.5)) + 1, 999)):
+            loan_id = f'{i:014d}-{k:03d}'
+            branch = gen.branch()
+            date = gen.date_after(created)
+            total = gen.cents(11, 1.2) // 100 * 100
+            paid = 0
+            for _ in range(int(rng.paretovariate(1.5)) - 1 if rng.random() < 0.8 else 0):
+                fund = min(total - paid, max(100, int(total * rng.uniform(0.02, 0.3))))
+                if fund <= 0:
+                    break
+                paid += fund
+                paid_date = gen.date_after(date)
+                rows[PaidRecord.__tablename__].append({'loan_id': loan_id, 'fund': fund / 100, 'date': paid_date})
+                branch_stats[(month_of(paid_date), branch)][2] += fund
+            rows[LoanRecord.__tablename__].append({'loan_id': loan_id, 'subbranch': branch, 'total_fund': total / 100,
+                                                   'paid_fund': paid / 100, 'date': date})
+            stat = branch_stats[(month_of(date), branch)]
+            stat[0] += 1
+            stat[1] += total
+            holders = {user_id}
+            holders.update(rng.choice(user_ids) for _ in range(rng.choices((0, 1, 2), (80, 17, 3))[0]))
+            rows[RelationLoanUsr.__tablename__].extend({'loan_id': loan_id, 'user_id': holder}
+                                                       for holder in sorted(holders))
+    return rows, {'customers': customer_months, 'branches': dict(branch_stats)}
+
+
+def generate_employees(args: Tuple[int, int, int, int, datetime.date]) -> Tuple[Dict[str, list], dict]:
+    """
+    生成编号在[start, end)内的员工
+    :return: (表名 -> 行列表, {'managers': (支行, 部门) -> 块内该部门的第一名员工})
+    """
+    seed, chunk, start, end, today = args
+    gen = ChunkGenerator(seed, 'employee', chunk, today)
+    rows = [{
+        'user_id': 'E' + str(i).zfill(17),
+        'type': 0,
+        'name': gen.name(),
+        'phone': gen.phone(),
+        'address': gen.address(),
+        'department_id': str(gen.rng.choice(department_table)[0]),
+        'subbranch': gen.branch(),
+        'start_date': gen.recent_date(HISTORY_DAYS * 4)
+    } for i in range(start, end)]
+    managers = {}
+    for row in rows:
+        managers.setdefault((row['subbranch'], row['department_id']), row['user_id'])
+    return {Employee.__tablename__: rows}, {'managers': managers}
+
+
+def rows_per_statement(engine, columns: int, batch_size: int) -> int:
+    """
+    单条多行INSERT的行数，SQLite受绑定参数个数上限限制
+    """
+    if engine.dialect.name == 'sqlite':
+        max_params = 32766 if sqlite3.sqlite_version_info >= (3, 32) else 999
+        return max(1, min(batch_size, max_params // columns))
+    return batch_size
+
+
+@lru_cache(maxsize=None)
+def multi_row_insert(engine, table, columns: Tuple[str, ...], rows: int):
+    """
+    编译以命名参数表示的多行INSERT
+    SQLAlchemy不缓存多行INSERT的编译结果，在此按行数缓存，每种行数只编译一次
+    """
+    return table.insert().values([{name: bindparam(f'{name}_{i}', type_=table.c[name].type) for name in columns}
+                                  for i in range(rows)]).compile(dialect=engine.dialect)
+
+
+def bulk_insert(engine, table, rows: list, batch_size: int):
+    if not rows:
+        return
+    columns = tuple(rows[0])
+    step = rows_per_statement(engine, len(columns), batch_size)
+    with engine.begin() as conn:
+        for start in range(0, len(rows), step):
+            batch = rows[start:start + step]
+            conn.execute(multi_row_insert(engine, table, columns, len(batch)),
+                         {f'{name}_{i}': row[name] for i, row in enumerate(batch) for name in columns})
+
+
+def chunks(total: int, size: int, seed: int, today: datetime.date):
+    return [(seed, n, start, min(start + size, total), today) for n, start in enumerate(range(0, total, size))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=config.SQLALCHEMY_DATABASE_URI, help='SQLAlchemy数据库URL，默认为config中的数据库')
+    parser.add_argument('--customers', type=int, default=100000, help='客户数，账户约为其1.5倍，贷款约为其0.3倍')
+    parser.add_argument('--employees', type=int, default=None, help='员工数，默认为客户数的1%%')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='生成数据的进程数')
+    parser.add_argument('--chunk-size', type=int, default=5000, help='每个数据块的客户数')
+    parser.add_argument('--batch-size', type=int, default=1000, help='每条INSERT语句写入的行数')
+    parser.add_argument('--users', type=int, default=None,
+                        help='清空登录用户表及登出列表，重新生成admin及指定数量的登录用户，默认保留已有登录用户')
+    parser.add_argument('--password', default='admin', help='生成的登录用户的密码')
+    clear = parser.add_mutually_exclusive_group()
+    clear.add_argument('--truncate', action='store_true', help='先清空业务数据表中的已有数据')
+    clear.add_argument('--drop', action='store_true', help='先删除并重建业务数据表')
+    args = parser.parse_args()
+    employees = args.customers // 100 if args.employees is None else args.employees
+
+    engine = create_engine(args.db)
+    if engine.dialect.name == 'sqlite':
+        @event.listens_for(engine, 'connect')
+        def _fast_sqlite_load(dbapi_connection, connection_record):
+            # 导入期间不等待落盘，中断后需重新生成
+            dbapi_connection.execute('PRAGMA synchronous = OFF')
+            dbapi_connection.execute('PRAGMA journal_mode = MEMORY')
+
+    metadata = database.Model.metadata
+    data_tables = [table for table in metadata.sorted_tables if table not in AUTH_TABLES]
+    if args.drop:
+        metadata.drop_all(engine, tables=data_tables)
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        if args.truncate:
+            # 按外键依赖的逆序清空，卡号序列一并清空，使其从新数据的最大卡号之后重新分配
+            for table in reversed(data_tables):
+                conn.execute(table.delete())
+        else:
+            filled = [table.name for table in data_tables
+                      if conn.execute(select([literal_column('1')]).select_from(table).limit(1)).first()]
+            if filled:
+                parser.error(f'数据表{", ".join(filled)}中已有数据，请指定--truncate清空或--drop重建后再生成')
+        if args.users is not None:
+            for table in AUTH_TABLES:
+                conn.execute(table.delete())
+
+    counts = populate(engine, args.customers, employees, args.seed, args.workers, args.chunk_size, args.batch_size,
+                      [] if args.users is None else
+                      ['admin'] + [f'operator{i:04d}' for i in range(1, args.users + 1)], args.password)
+    for name, count in counts.items():
+        print(f'{name}: {count}')
+
+
+def populate(engine, customers: int, employees: int, seed: int = 0, workers: int = os.cpu_count(),
+             chunk_size: int = 5000, batch_size: int = 1000, users: List[str] = (), password: str = 'admin') -> Counter:
+    """
+    向已建好的空数据表中写入测试数据
+    :param users: 需生成的登录用户名
+    :return: 表名 -> 写入行数
+    """
+    started = time.perf_counter()
+    counts = Counter()
+    customer_months = Counter()
+    branch_stats = defaultdict(lambda: [0, 0, 0])
+    managers = {}  # (支行, 部门) -> 员工编号
+
+    def load(rows: Dict[str, list]):
+        for table in TABLE_ORDER:
+            table_rows = rows.get(table.__tablename__)
+            if table_rows:
+                bulk_insert(engine, table.__table__, table_rows, batch_size)
+                counts[table.__tablename__] += len(table_rows)
+
+    load({
+        User.__tablename__: [{'user_id': user_id, 'password': password, 'session_id': None, 'last_use_time': 0}
+                             for user_id in users],
+        SubBranch.__tablename__: [{'name': name, 'city': city, 'fund': 0} for name, city in branch_table],
+        Department.__tablename__: [{'department_id': str(dp_id), 'department_type': dp_type, 'subbranch': name}
+                                   for name, _ in branch_table for dp_id, dp_type in department_table]
+    })
+    with Pool(workers) as pool:
+        tasks = [(generate_customers, chunks(customers, chunk_size, seed, REFERENCE_DATE)),
+                 (generate_employees, chunks(employees, chunk_size, seed, REFERENCE_DATE))]
+        for func, task in tasks:
+            # imap按块号顺序返回，使自增主键的分配也与进程数无关
+            for n, (rows, stats) in enumerate(pool.imap(func, task), 1):
+                load(rows)
+                customer_months.update(stats.get('customers', {}))
+                for key, user_id in stats.get('managers', {}).items():
+                    managers.setdefault(key, user_id)
+                for key, values in stats.get('branches', {}).items():
+                    branch_stats[key] = [a + b for a, b in zip(branch_stats[key], values)]
+                print(f'{func.__name__}: {n}/{len(task)} 块, {time.perf_counter() - started:.1f}s', flush=True)
+
+    load({
+        BankManager.__tablename__: [{'subbranch': branch, 'department_id': department_id, 'user_id': user_id}
+                                    for (branch, department_id), user_id in sorted(managers.items())],
+        StatCustomerMonth.__tablename__: [{'month': month, 'new_customers': count}
+                                          for month, count in sorted(customer_months.items())],
+        StatBranchMonth.__tablename__: [{'month': month, 'branch': branch, 'loan_count': loan_count,
+                                         'loan_fund': loan_fund / 100, 'paid_fund': paid_fund / 100}
+                                        for (month, branch), (loan_count, loan_fund, paid_fund)
+                                        in sorted(branch_stats.items())]
+    })
+    print(f'完成，用时{time.perf_counter() - started:.1f}s', flush=True)
+    return counts
+
+
+if __name__ == '__main__':
+    main()
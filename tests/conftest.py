@@ -0,0 +1,98 @@
+"""
+测试公共夹具
+以临时SQLite文件启动后端应用，每个测试前重建数据表并写入基础数据
+"""
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import config
+
+config.SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db')
+config.SQLALCHEMY_TRACK_MODIFICATIONS = False
+config.SQL_INSPECTOR_STRICT = True  # 同一请求中重复执行同一语句时抛出异常，使N+1查询的退化直接导致测试失败
+
+from app import app as flask_app  # noqa: E402
+from ext import database  # noqa: E402
+from data_type import User, SubBranch, Customer  # noqa: E402
+from api.session import denylist_cache  # noqa: E402
+from api.search import index_customers  # noqa: E402
+from api.rollup import add_customers  # noqa: E402
+
+BRANCHES = ('B1', 'B2', 'B3')
+CUSTOMERS = tuple(f'C{i}' for i in range(10))
+
+
+class ApiClient:
+    """
+    已登录的测试客户端，请求返回解析后的JSON
+    """
+
+    def __init__(self, app):
+        self.client = app.test_client()
+        self.headers = {}
+        session = self.post('/manage/login', {'user_id': 'admin', 'passwd': 'admin'})
+        self.headers = {'USER_ID': 'admin', 'SESSION': session['data']['session']}
+
+    def post(self, path: str, payload: dict) -> dict:
+        return self.client.post(path, data=json.dumps(payload), headers=self.headers).get_json()
+
+    def get(self, path: str) -> dict:
+        return self.client.get(path, headers=self.headers).get_json()
+
+
+@pytest.fixture
+def app(monkeypatch):
+    flask_app.testing = True
+    # 登出列表的定期同步会在任意请求中多出一条查询，测试中只在需要时手动同步
+    monkeypatch.setattr(denylist_cache, 'refresh_interval', 3600)
+    with flask_app.app_context():
+        database.drop_all()
+        database.create_all()
+        database.session.add(User(user_id='admin', password='admin', session_id=None, last_use_time=0))
+        for name in BRANCHES:
+            database.session.add(SubBranch(name=name, city='合肥', fund=0))
+        customers = [Customer({'identifier_id': user_id, 'name': f'客户{user_id}', 'phone': '13800000000'})
+                     for user_id in CUSTOMERS]
+        database.session.add_all(customers)
+        database.session.flush()
+        index_customers(customers)
+        add_customers({customers[0].create_time: len(customers)})
+        database.session.commit()
+        denylist_cache.refresh(int(time.time()))
+        database.session.remove()
+    return flask_app
+
+
+@pytest.fixture
+def client(app) -> ApiClient:
+    return ApiClient(app)
+
+
+@pytest.fixture
+def statements():
+    """
+    记录执行的SQL语句，用法：
+    with statements() as executed:
+        ...
+    assert len(executed) == 2
+    """
+    @contextmanager
+    def record():
+        executed = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            executed.append(statement)
+
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield executed
+        finally:
+            event.remove(Engine, 'before_cursor_execute', before_cursor_execute)
+    return record
@@ -0,0 +1,134 @@
+"""
+账户接口测试
+"""
+import re
+
+import pytest
+
+from api.__util import ErrCode
+from tests.conftest import CUSTOMERS
+
+
+def create_accounts(client, count: int, branch: str = 'B1'):
+    for user_id in CUSTOMERS[:count]:
+        r = client.post('/account/create', {'holder': [user_id], 'sub_branch': branch, 'type': 1, 'overdraft': 100})
+        assert r['success'], r
+
+
+@pytest.mark.parametrize('count', [1, 10])
+@pytest.mark.parametrize('method, keyword', [(1, 'B1'), (2, 1), (3, 'C0')])
+def test_query_statement_count(client, statements, count, method, keyword):
+    """
+    查询结果一次查询获得，持卡人一次批量获得，语句数与结果数无关
+    """
+    create_accounts(client, count)
+    with statements() as executed:
+        r = client.post('/account/query', {'method': method, 'keyword': keyword})
+    assert r['success']
+    assert len(r['data']) == (1 if method == 3 else count)
+    assert len(executed) == 2, executed
+
+
+@pytest.mark.parametrize('count', [1, 10])
+def test_get_all_statement_count(client, statements, count):
+    create_accounts(client, count)
+    with statements() as executed:
+        r = client.get('/account/get_all')
+    assert len(r['data']) == count
+    assert len(executed) == 2, executed
+
+
+def test_create_batch_statement_count(client, statements):
+    """
+    批量创建的语句数与账户数无关
+    """
+    create_accounts(client, 1, 'B3')  # 预留卡号段，使之后的请求不包含号段分配的语句
+    counts = []
+    for branch, count in (('B1', 2), ('B2', 8)):
+        with statements() as executed:
+            r = client.post('/account/create_batch', {'accounts': [
+                {'holder': [user_id], 'sub_branch': branch, 'type': 0, 'rate': 1.5, 'finance': 'CNY'}
+                for user_id in CUSTOMERS[:count]]})
+        assert all(item['success'] for item in r['data']), r
+        counts.append(len(executed))
+    assert counts[0] == counts[1]
+
+
+def test_create_batch_rejects_malformed_items_per_item(client):
+    r = client.post('/account/create_batch', {'accounts': [
+        {'holder': ['C0'], 'sub_branch': 'B1', 'type': 0, 'rate': 'abc', 'finance': 'CNY'},
+        {'holder': ['C1'], 'sub_branch': 'B1', 'type': 1, 'overdraft': 'abc'},
+        {'holder': [{'id': 'C2'}], 'sub_branch': 'B1', 'type': 1, 'overdraft': 100},
+        {'holder': [['C3']], 'sub_branch': 'B1', 'type': 1, 'overdraft': 100},
+        {'holder': ['C4'], 'sub_branch': 'B1', 'type': 1, 'overdraft': 100}]})
+    assert r['success'], r
+    assert [item['success'] for item in r['data']] == [False, False, False, False, True]
+    assert all(item['code'] == ErrCode.PARAM_TYPE_MISMATCH for item in r['data'][:4])
+    account = client.post('/account/query', {'method': 3, 'keyword': 'C4'})['data'][0]
+    assert account['overdraft'] == 100.0
+
+
+def test_modify_response(client):
+    create_accounts(client, 1)
+    account_id = client.post('/account/query', {'method': 3, 'keyword': 'C0'})['data'][0]['account_id']
+    r = client.post('/account/modify', {'account_id': account_id, 'holder': ['C0', 'C1', 'C1', 'C2'],
+                                        'refund': '12.5', 'overdraft': 200})
+    assert r['success'], r
+    assert r['data']['holder'] == ['C0', 'C1', 'C2']
+    assert r['data']['refund'] == 12.5
+    assert r['data']['overdraft'] == 200.0
+    for refund in ('abc', 'NaN', '1e30', 0.001, True):
+        r = client.post('/account/modify', {'account_id': account_id, 'holder': ['C0'], 'refund': refund,
+                                            'overdraft': 200})
+        assert not r['success']
+        assert r['code'] == ErrCode.PARAM_TYPE_MISMATCH
+
+
+@pytest.mark.parametrize('payload', [{'type': 0, 'rate': 1.5, 'finance': 'CNY'}, {'type': 1, 'overdraft': 100}])
+def test_create_response_matches_query(client, payload):
+    """
+    新建对象未从数据库重新读取，返回格式仍应与查询结果一致
+    """
+    r = client.post('/account/create', dict(payload, holder=['C0'], sub_branch='B1'))
+    assert r['success'], r
+    created = r['data']
+    assert re.fullmatch(r'\d{4}-\d{2}-\d{2}', created['open_date'])
+    assert re.fullmatch(r'\d{4}-\d{2}-\d{2}', created['recent_visit'])
+    assert isinstance(created['refund'], float)
+    assert isinstance(created['rate' if payload['type'] == 0 else 'overdraft'], float)
+    queried = client.post('/account/query', {'method': 3, 'keyword': 'C0'})['data'][0]
+    assert created == queried
+
+
+@pytest.mark.parametrize('overdraft', ['abc', 'NaN', '1e30', 0.001, True])
+def test_create_rejects_malformed_overdraft(client, overdraft):
+    r = client.post('/account/create', {'holder': ['C0'], 'sub_branch': 'B1', 'type': 1, 'overdraft': overdraft})
+    assert r['code'] == ErrCode.PARAM_TYPE_MISMATCH
+    assert client.post('/account/query', {'method': 3, 'keyword': 'C0'})['data'] == []
+
+
+def test_deposit_and_withdraw(client):
+    create_accounts(client, 1)
+    account_id = client.post('/account/query', {'method': 3, 'keyword': 'C0'})['data'][0]['account_id']
+    r = client.post('/account/deposit', {'account_id': account_id, 'amount': '50.25'})
+    assert r['success'], r
+    assert r['data']['refund'] == 50.25 and r['data']['version'] == 2
+    # 支票账户可透支至透支额度100
+    r = client.post('/account/withdraw', {'account_id': account_id, 'amount': 150.25})
+    assert r['success'], r
+    assert r['data']['refund'] == -100.0
+    r = client.post('/account/withdraw', {'account_id': account_id, 'amount': 0.01})
+    assert r['code'] == ErrCode.ACCOUNT_INSUFFICIENT
+    r = client.post('/account/deposit', {'account_id': 'missing', 'amount': 1})
+    assert r['code'] == ErrCode.ACCOUNT_NO_EXIST
+
+
+@pytest.mark.parametrize('amount', ['NaN', 'Infinity', '-Infinity', 1e30, 0.001, '1.005', 0, -1, True, 'abc', [1]])
+@pytest.mark.parametrize('path', ['/account/deposit', '/account/withdraw'])
+def test_balance_change_rejects_malformed_amount(client, path, amount):
+    create_accounts(client, 1)
+    account_id = client.post('/account/query', {'method': 3, 'keyword': 'C0'})['data'][0]['account_id']
+    r = client.post(path, {'account_id': account_id, 'amount': amount})
+    assert r['code'] == ErrCode.PARAM_TYPE_MISMATCH, r
+    account = client.post('/account/query', {'method': 3, 'keyword': 'C0'})['data'][0]
+    assert account['refund'] == 0.0 and account['version'] == 1
@@ -0,0 +1,96 @@
+"""
+客户接口测试
+"""
+import pytest
+
+from ext import database
+from data_type import Customer, CustomerNgram
+from api.search import search_customers, rebuild_customer_index
+from tests.conftest import CUSTOMERS
+
+
+def fuzzy(client, mode: int, keyword: str, **kwargs) -> list:
+    r = client.post('/customer/query', dict({'exact': False, 'mode': mode, 'keyword': keyword}, **kwargs))
+    assert r['success'], r
+    return [it['identifier_id'] for it in r['data']]
+
+
+@pytest.mark.parametrize('mode, keyword, expected', [
+    (1, '客', list(CUSTOMERS)),         # 单字
+    (1, '户C', list(CUSTOMERS)),        # 二元组
+    (1, '客户C3', ['C3']),
+    (0, 'C7', ['C7']),                  # 过短无法使用索引，仅以LIKE校验
+    (2, '0000', list(CUSTOMERS)),       # 三元组
+    (1, '张', []),
+    (1, '100%', []),                    # 通配符按字面匹配
+])
+def test_search_customers(app, mode, keyword, expected):
+    with app.app_context():
+        assert [it.user_id for it in search_customers(mode, keyword, 50)] == expected
+        database.session.remove()
+
+
+def test_search_ranks_exact_then_prefix(client):
+    for user_id, name in (('P1', '王小明'), ('P2', '小明'), ('P3', '小明明')):
+        assert client.post('/customer/create', {'identifier_id': user_id, 'name': name, 'phone': '1'})['success']
+    assert fuzzy(client, 1, '小明') == ['P2', 'P3', 'P1']
+
+
+def test_fuzzy_limit(client):
+    assert fuzzy(client, 1, '客户', limit=3) == list(CUSTOMERS[:3])
+    r = client.post('/customer/query', {'exact': False, 'mode': 1, 'keyword': '客户', 'limit': 0})
+    assert not r['success']
+
+
+def test_exact_search_not_limited(client):
+    r = client.post('/customer/query', {'exact': True, 'mode': 2, 'keyword': '13800000000', 'limit': 3})
+    assert len(r['data']) == len(CUSTOMERS)
+
+
+def test_index_follows_create_update_delete(client):
+    assert client.post('/customer/create', {'identifier_id': 'N1', 'name': '李四', 'phone': '13912345678'})['success']
+    assert fuzzy(client, 1, '李') == ['N1']
+    assert fuzzy(client, 2, '1234') == ['N1']
+    assert client.post('/customer/update', {'identifier_id': 'N1', 'name': '赵六', 'phone': '13900000000'})['success']
+    assert fuzzy(client, 1, '李') == []
+    assert fuzzy(client, 2, '1234') == []
+    assert fuzzy(client, 1, '赵六') == ['N1']
+    assert client.post('/customer/delete', {'identifier_id': 'N1'})['success']
+    assert fuzzy(client, 1, '赵') == []
+
+
+def test_rebuild_index_covers_existing_customers(app, client):
+    with app.app_context():
+        # 模拟引入索引前已有的客户
+        database.session.add(Customer({'identifier_id': 'OLD', 'name': '钱七', 'phone': '1'}))
+        database.session.commit()
+        assert fuzzy(client, 1, '钱') == []
+        assert rebuild_customer_index() == len(CUSTOMERS) + 1
+        assert CustomerNgram.query.filter_by(customer_id='OLD').count() > 0
+        database.session.remove()
+    assert fuzzy(client, 1, '钱') == ['OLD']
+    assert fuzzy(client, 1, '客户C1') == ['C1']
+
+
+def open_accounts_and_loans(client, user_id: str, count: int):
+    for i in range(count):
+        branch, ac_type = ('B1', 'B2', 'B3')[i % 3], i // 3
+        payload = {'type': 0, 'rate': 1.5, 'finance': 'CNY'} if ac_type == 0 else {'type': 1, 'overdraft': 100}
+        assert client.post('/account/create', dict(payload, holder=[user_id], sub_branch=branch))['success']
+        r = client.post('/loan/create', {'user_list': [user_id, 'C9'], 'total_fund': 100, 'sub_branch': branch})
+        assert client.post('/loan/pay', {'loan_id': r['data']['loan_id'], 'fund': 10})['success']
+
+
+@pytest.mark.parametrize('user_id, count', [('C1', 1), ('C2', 6)])
+def test_overview_statement_count(client, statements, user_id, count):
+    """
+    客户、账户（含持卡人）、贷款、贷款持有人及发放记录各一次查询，语句数与账户、贷款数无关
+    """
+    open_accounts_and_loans(client, user_id, count)
+    with statements() as executed:
+        r = client.post('/customer/overview', {'identifier_id': user_id})
+    assert r['success'], r
+    assert len(r['data']['accounts']) == count and len(r['data']['loans']) == count
+    assert all(loan['customers'] == sorted([user_id, 'C9']) and len(loan['paid_history']) == 1
+               for loan in r['data']['loans'])
+    assert len(executed) == 6, executed
@@ -0,0 +1,27 @@
+"""
+SQL检查测试
+"""
+import pytest
+from sqlalchemy import text
+
+from api.inspector import sql_inspector, RepeatedQueryError
+from ext import database
+
+
+def test_strict_mode_raises_on_repeated_statement(app):
+    assert sql_inspector.strict
+    with app.test_request_context('/customer/query'):
+        sql_inspector.reset()
+        for i in range(sql_inspector.repeat_threshold):
+            database.session.execute(text('SELECT * FROM customer WHERE user_id = :id'), {'id': f'C{i}'})
+        with pytest.raises(RepeatedQueryError):
+            database.session.execute(text('SELECT * FROM customer WHERE user_id = :id'), {'id': 'C0'})
+        database.session.rollback()
+
+
+def test_statements_below_threshold_pass(app):
+    with app.test_request_context('/customer/query'):
+        sql_inspector.reset()
+        for i in range(sql_inspector.repeat_threshold):
+            database.session.execute(text('SELECT * FROM customer WHERE user_id = :id'), {'id': f'C{i}'})
+        database.session.rollback()
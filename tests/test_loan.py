@@ -0,0 +1,109 @@
+"""
+贷款接口测试
+"""
+import re
+
+import pytest
+
+from api.__util import ErrCode
+
+
+def create_loans(client, count: int, branch: str = 'B1') -> list:
+    loan_ids = []
+    for _ in range(count):
+        r = client.post('/loan/create', {'user_list': ['C1', 'C2'], 'total_fund': 100, 'sub_branch': branch})
+        assert r['success'], r
+        loan_ids.append(r['data']['loan_id'])
+    return loan_ids
+
+
+@pytest.mark.parametrize('count', [1, 10])
+@pytest.mark.parametrize('method, keyword', [(0, None), (1, 'B1'), (3, 'C1')])
+def test_query_statement_count(client, statements, count, method, keyword):
+    """
+    贷款一次查询获得，持有人及发放记录各一次批量获得
+    """
+    loan_ids = create_loans(client, count)
+    client.post('/loan/pay_batch', {'items': [{'loan_id': loan_id, 'fund': 10} for loan_id in loan_ids]})
+    with statements() as executed:
+        r = client.post('/loan/query', {'method': method, 'keyword': keyword or loan_ids[0]})
+    assert len(r['data']) == (1 if method == 0 else count)
+    assert all(len(loan['customers']) == 2 and len(loan['paid_history']) == 1 for loan in r['data'])
+    assert len(executed) == 3, executed
+
+
+@pytest.mark.parametrize('count', [1, 10])
+def test_get_all_statement_count(client, statements, count):
+    create_loans(client, count)
+    with statements() as executed:
+        r = client.get('/loan/get_all')
+    assert len(r['data']) == count
+    assert len(executed) == 3, executed
+
+
+def test_pay_batch_statement_count(client, statements):
+    """
+    批量发放的语句数与条目数无关
+    """
+    counts = []
+    for count in (2, 10):
+        loan_ids = create_loans(client, count)
+        with statements() as executed:
+            r = client.post('/loan/pay_batch', {'items': [{'loan_id': loan_id, 'fund': 1} for loan_id in loan_ids]})
+        assert r['data'] == [{'success': True}] * count
+        counts.append(len(executed))
+    assert counts[0] == counts[1]
+
+
+def test_pay_batch_rejects_malformed_loan_id_per_item(client):
+    loan_id = create_loans(client, 1)[0]
+    r = client.post('/loan/pay_batch', {'items': [{'loan_id': ['x'], 'fund': 1}, {'loan_id': {'a': 1}, 'fund': 1},
+                                                  {'loan_id': loan_id, 'fund': 1}]})
+    assert r['success']
+    assert [item['success'] for item in r['data']] == [False, False, True]
+    assert r['data'][0]['code'] == r['data'][1]['code'] == ErrCode.PARAM_TYPE_MISMATCH
+
+
+def test_pay_batch_rejects_malformed_fund_per_item(client):
+    loan_id = create_loans(client, 1)[0]
+    r = client.post('/loan/pay_batch', {'items': [{'loan_id': loan_id, 'fund': True}, {'loan_id': loan_id, 'fund': 0.001},
+                                                  {'loan_id': loan_id, 'fund': 1e30}, {'loan_id': loan_id, 'fund': 2.5}]})
+    assert r['success']
+    assert [item['success'] for item in r['data']] == [False, False, False, True]
+    assert all(item['code'] == ErrCode.PARAM_TYPE_MISMATCH for item in r['data'][:3])
+    loan = client.post('/loan/query', {'method': 0, 'keyword': loan_id})['data'][0]
+    assert loan['paid'] == 2.5 and [it['fund'] for it in loan['paid_history']] == [2.5]
+
+
+@pytest.mark.parametrize('total_fund', ['abc', [100], True, 'NaN', '1e30', 0.001, 0])
+def test_create_rejects_malformed_total(client, total_fund):
+    r = client.post('/loan/create', {'user_list': ['C1'], 'total_fund': total_fund, 'sub_branch': 'B1'})
+    assert not r['success'] and r['code'] == ErrCode.PARAM_TYPE_MISMATCH
+
+
+def test_create_and_pay_response_matches_query(client):
+    """
+    新建对象未从数据库重新读取，返回格式仍应与查询结果一致
+    """
+    r = client.post('/loan/create', {'user_list': ['C1'], 'total_fund': 100, 'sub_branch': 'B1'})
+    assert r['success'], r
+    created = r['data']
+    assert re.fullmatch(r'\d{4}-\d{2}-\d{2}', created['create_date'])
+    assert isinstance(created['total'], float) and isinstance(created['paid'], float)
+    assert created == client.post('/loan/query', {'method': 0, 'keyword': created['loan_id']})['data'][0]
+    r = client.post('/loan/pay', {'loan_id': created['loan_id'], 'fund': 30})
+    assert r['success'], r
+    paid = r['data']
+    assert paid['paid'] == 30.0
+    assert re.fullmatch(r'\d{4}-\d{2}-\d{2}', paid['paid_history'][0]['date'])
+    assert isinstance(paid['paid_history'][0]['fund'], float)
+    assert paid == client.post('/loan/query', {'method': 0, 'keyword': created['loan_id']})['data'][0]
+
+
+@pytest.mark.parametrize('fund', [True, 0.001, 1.005, 1e30, 0, -1, '10'])
+def test_pay_rejects_malformed_fund(client, fund):
+    loan_id = create_loans(client, 1)[0]
+    r = client.post('/loan/pay', {'loan_id': loan_id, 'fund': fund})
+    assert r['code'] == ErrCode.PARAM_TYPE_MISMATCH, r
+    loan = client.post('/loan/query', {'method': 0, 'keyword': loan_id})['data'][0]
+    assert loan['paid'] == 0.0 and loan['paid_history'] == []
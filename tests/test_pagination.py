@@ -0,0 +1,37 @@
+"""
+get_all分页及流式返回测试
+"""
+import json
+
+from api.__util import stream_query
+from data_type import Customer, LoanRecord
+from tests.conftest import CUSTOMERS
+
+
+def test_stream_query_pages_by_key(app):
+    with app.app_context():
+        chunks = list(stream_query(Customer.query, Customer.user_id, lambda it: it.user_id, chunk_size=3))
+        assert [len(chunk) for chunk in chunks] == [3, 3, 3, 1]
+        assert [it.user_id for chunk in chunks for it in chunk] == sorted(CUSTOMERS)
+
+
+def test_stream_query_allows_queries_between_chunks(app, client):
+    for _ in range(7):
+        assert client.post('/loan/create', {'user_list': ['C1'], 'total_fund': 100, 'sub_branch': 'B1'})['success']
+    with app.app_context():
+        loan_ids = []
+        for chunk in stream_query(LoanRecord.query, LoanRecord.loan_id, lambda it: it.loan_id, chunk_size=2):
+            # 与接口相同，读取下一块之前在同一连接上查询该块的明细
+            assert LoanRecord.query.filter(LoanRecord.loan_id.in_([it.loan_id for it in chunk])).count() == len(chunk)
+            loan_ids.extend(it.loan_id for it in chunk)
+        assert len(loan_ids) == 7 and loan_ids == sorted(loan_ids)
+
+
+def test_stream_endpoints_return_all_rows(client):
+    for user_id in CUSTOMERS[:4]:
+        assert client.post('/account/create', {'holder': [user_id], 'sub_branch': 'B2', 'type': 1,
+                                               'overdraft': 0})['success']
+        assert client.post('/loan/create', {'user_list': [user_id], 'total_fund': 100, 'sub_branch': 'B2'})['success']
+    for path, count in (('/account/get_all', 4), ('/loan/get_all', 4), ('/customer/get_all', len(CUSTOMERS))):
+        body = json.loads(client.client.get(path + '?stream=1').data)
+        assert body['success'] and len(body['data']) == count
@@ -0,0 +1,71 @@
+"""
+读写分离：只读接口的查询发往从库，写接口及只在主库读取的表发往主库
+"""
+import os
+import tempfile
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from ext import database
+
+
+@pytest.fixture
+def replica(app, monkeypatch):
+    """
+    以另一个SQLite文件作为从库，并以sync-replicas复制主库的当前数据
+    """
+    path = os.path.join(tempfile.mkdtemp(), 'replica.db')
+    monkeypatch.setitem(app.config['SQLALCHEMY_BINDS'], 'replica_0', 'sqlite:///' + path)
+    result = app.test_cli_runner().invoke(args=['sync-replicas'])
+    assert result.exit_code == 0, result.output
+    return path
+
+
+@pytest.fixture
+def databases():
+    """
+    记录每条语句执行所在的数据库文件
+    """
+    executed = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        executed.append((os.path.basename(conn.engine.url.database), statement.split()[0].upper()))
+
+    event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+    yield executed
+    event.remove(Engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def test_read_only_endpoints_use_replica(client, replica, databases):
+    assert client.post('/account/create', {'holder': ['C0'], 'sub_branch': 'B1', 'type': 1, 'overdraft': 100})['success']
+    assert {name for name, _ in databases} == {'test.db'}
+    databases.clear()
+    # 从库尚未同步新账户
+    assert client.post('/account/query', {'method': 3, 'keyword': 'C0'})['data'] == []
+    assert client.get('/account/get_all')['data'] == []
+    assert {name for name, _ in databases} == {'replica.db'}
+    databases.clear()
+    client.client.application.test_cli_runner().invoke(args=['sync-replicas'])
+    databases.clear()
+    assert len(client.post('/account/query', {'method': 3, 'keyword': 'C0'})['data']) == 1
+    assert {name for name, _ in databases} == {'replica.db'}
+
+
+def test_write_endpoints_use_primary(client, replica, databases):
+    assert client.post('/customer/create', {'identifier_id': 'C10', 'name': '客户C10', 'phone': '13800000000'})['success']
+    assert client.post('/customer/update', {'identifier_id': 'C10', 'name': '客户C10', 'phone': '13900000000'})['success']
+    assert {name for name, _ in databases} == {'test.db'}
+
+
+def test_primary_only_tables_read_from_primary(app, client, replica, databases):
+    # 从库中的登录用户表已过期，校验Session仍应读取主库
+    with app.app_context():
+        target = database.get_engine(app, bind='replica_0')
+        with target.begin() as conn:
+            conn.exec_driver_sql("UPDATE user SET session_id = NULL")
+    from api.session import session_cache
+    session_cache.invalidate('admin')
+    assert client.post('/account/query', {'method': 3, 'keyword': 'C0'})['success']
+    assert ('test.db', 'SELECT') in databases
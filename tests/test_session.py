@@ -0,0 +1,147 @@
+"""
+Session：数据库模式的缓存与登录、登出的事务边界；token模式的签名、过期、换发及登出
+"""
+import json
+import time
+
+import pytest
+
+import config
+from ext import database
+from data_type import User, SessionDenylist
+from api.__util import ErrCode
+from api.session import Session, TokenSession, session_cache, denylist_cache
+from tests.conftest import ApiClient
+
+QUERY = ('/customer/query', {'exact': True, 'mode': 0, 'keyword': 'C0'})
+
+
+def test_login_rolled_back_leaves_no_cache_entry(app):
+    with app.app_context():
+        session_cache.invalidate('admin')
+        ok, session = Session.login('admin', 'admin')
+        assert ok
+        assert session_cache.get('admin', int(time.time())) is None
+        database.session.rollback()
+        assert session_cache.get('admin', int(time.time())) is None
+        assert Session.verify_session('admin', session) == (False, 'SESSION无效或已过期')
+        database.session.remove()
+
+
+def test_login_committed_populates_cache(app):
+    with app.app_context():
+        ok, session = Session.login('admin', 'admin')
+        database.session.commit()
+        assert session_cache.get('admin', int(time.time()))[0] == session
+        database.session.remove()
+
+
+def test_logout_in_other_process_rejects_cached_session(client, app):
+    session = client.headers['SESSION']
+    assert client.post('/customer/query', {'exact': True, 'mode': 0, 'keyword': 'C0'})['code'] == 0
+    stale = session_cache.get('admin', int(time.time()))
+    assert stale[0] == session
+    assert client.post('/manage/logout', {})['code'] == 0
+    # 模拟另一进程：缓存中仍是登出前的Session，同步登出列表后即回源数据库确认
+    session_cache.put('admin', *stale)
+    with app.app_context():
+        denylist_cache.refresh(int(time.time()))
+        assert Session.verify_session('admin', session) == (False, 'SESSION无效或已过期')
+        database.session.remove()
+
+
+def test_relogin_revokes_previous_session(client, app):
+    old = client.headers['SESSION']
+    with app.app_context():
+        ok, new = Session.login('admin', 'admin')
+        database.session.commit()
+        session_cache.put('admin', old, int(time.time()), int(time.time()))
+        denylist_cache.refresh(int(time.time()))
+        assert Session.verify_session('admin', old)[0] is False
+        assert Session.verify_session('admin', new)[0] is True
+        assert User.query.get('admin').session_id == new
+        database.session.remove()
+
+
+@pytest.fixture
+def token_client(app, monkeypatch) -> ApiClient:
+    monkeypatch.setattr(config, 'SESSION_MODE', 'token')
+    return ApiClient(app)
+
+
+def test_token_login_and_verify(token_client):
+    token = token_client.headers['SESSION']
+    user_id, session_id, issued_at = TokenSession.parse(token)
+    assert user_id == 'admin' and len(session_id) == 16 and abs(issued_at - time.time()) < 5
+    assert token_client.post(*QUERY)['success']
+
+
+@pytest.mark.parametrize('tamper', [
+    lambda token: token[:-1] + ('A' if token[-1] != 'A' else 'B'),          # 篡改签名
+    lambda token: token.replace('admin.', 'root.', 1),                       # 篡改用户名
+    lambda token: '.'.join(token.split('.')[:2] + [str(int(time.time()) + 60)] + token.split('.')[3:]),  # 篡改签发时间
+    lambda token: token.rsplit('.', 1)[0],                                   # 缺少签名
+])
+def test_token_tampered_rejected(token_client, tamper):
+    token_client.headers['SESSION'] = tamper(token_client.headers['SESSION'])
+    assert token_client.post(*QUERY)['code'] == ErrCode.NO_LOGIN
+
+
+def test_token_signed_with_other_secret_rejected(token_client, monkeypatch):
+    monkeypatch.setattr(config, 'SESSION_SECRET', 'another-secret')
+    forged = TokenSession.issue('admin', 'f' * 16, int(time.time()))
+    monkeypatch.undo()
+    monkeypatch.setattr(config, 'SESSION_MODE', 'token')
+    token_client.headers['SESSION'] = forged
+    assert token_client.post(*QUERY)['code'] == ErrCode.NO_LOGIN
+
+
+def test_token_expired_rejected(token_client):
+    issued_at = int(time.time()) - config.SEC_VALID_TIME - 1
+    token_client.headers['SESSION'] = TokenSession.issue('admin', 'e' * 16, issued_at)
+    assert token_client.post(*QUERY)['code'] == ErrCode.NO_LOGIN
+
+
+def test_token_renewed_through_header(token_client):
+    # 未到换发时间的Token不换发
+    response = token_client.client.post(QUERY[0], data=json.dumps(QUERY[1]), headers=token_client.headers)
+    assert 'SESSION' not in response.headers
+    old = TokenSession.issue('admin', 'r' * 16, int(time.time()) - config.SESSION_TOKEN_RENEW)
+    token_client.headers['SESSION'] = old
+    response = token_client.client.post(QUERY[0], data=json.dumps(QUERY[1]), headers=token_client.headers)
+    assert response.get_json()['success']
+    renewed = response.headers['SESSION']
+    assert renewed != old
+    assert TokenSession.parse(renewed)[:2] == ('admin', 'r' * 16)
+    assert TokenSession.parse(renewed)[2] > TokenSession.parse(old)[2]
+    token_client.headers['SESSION'] = renewed
+    assert token_client.post(*QUERY)['success']
+
+
+def test_token_logout_revokes_renewed_tokens(token_client, app):
+    token = token_client.headers['SESSION']
+    _, session_id, issued_at = TokenSession.parse(token)
+    sibling = TokenSession.issue('admin', session_id, issued_at + 1)  # 同一会话换发出的Token
+    assert token_client.post('/manage/logout', {})['success']
+    assert token_client.post(*QUERY)['code'] == ErrCode.NO_LOGIN
+    token_client.headers['SESSION'] = sibling
+    assert token_client.post(*QUERY)['code'] == ErrCode.NO_LOGIN
+    with app.app_context():
+        assert SessionDenylist.query.get(session_id) is not None
+        # 模拟另一进程：从数据库同步登出列表
+        denylist_cache._entries.clear()
+        denylist_cache.refresh(int(time.time()))
+        assert denylist_cache.contains(session_id, int(time.time()))
+        database.session.remove()
+
+
+def test_token_logout_rolled_back_is_not_revoked(token_client, app):
+    token = token_client.headers['SESSION']
+    session_id = TokenSession.parse(token)[1]
+    with app.app_context():
+        assert TokenSession.logout('admin', token) == (True, '')
+        assert not denylist_cache.contains(session_id, int(time.time()))
+        database.session.rollback()
+        assert not denylist_cache.contains(session_id, int(time.time()))
+        database.session.remove()
+    assert token_client.post(*QUERY)['success']
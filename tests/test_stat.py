@@ -0,0 +1,84 @@
+"""
+统计接口测试
+"""
+import pytest
+from sqlalchemy import text
+
+from api.__util import ErrCode
+
+
+def test_cube_normalizes_dates(client):
+    assert client.post('/loan/create', {'user_list': ['C1'], 'total_fund': 100, 'sub_branch': 'B1'})['success']
+    r = client.post('/stat/cube', {'measures': ['loan_count'], 'date_from': '2000-01', 'date_to': '2999/12'})
+    assert r['success'] and r['data']['loan'][0]['loan_count'] == 1
+
+
+@pytest.mark.parametrize('payload', [
+    {'measures': ['loan_count'], 'date_from': '2021-13-45'},
+    {'measures': ['loan_count'], 'date_to': 'abc'},
+    {'measures': [['loan_count']]},
+    {'measures': [{'a': 1}]},
+    {'measures': ['loan_count'], 'dimensions': [['month']]},
+])
+def test_cube_rejects_malformed_parameters(client, payload):
+    r = client.post('/stat/cube', payload)
+    assert not r['success'] and r['code'] == ErrCode.PARAM_TYPE_MISMATCH
+
+
+def test_savepoint_release_does_not_invalidate_before_commit(app):
+    from api.cache import stat_cache, mark_stale
+    from ext import database
+    with app.app_context():
+        version = stat_cache.version()
+        mark_stale('query_user', '202101')
+        database.session.begin_nested().commit()
+        assert stat_cache.version() == version
+        database.session.commit()
+        assert stat_cache.version() == version + 1
+
+
+def test_savepoint_rollback_keeps_outer_marks(app):
+    from api.cache import stat_cache, mark_stale
+    from ext import database
+    with app.app_context():
+        version = stat_cache.version()
+        mark_stale('query_user', '202101')
+        database.session.begin_nested().rollback()
+        database.session.commit()
+        assert stat_cache.version() == version + 1
+
+
+def test_rollback_discards_marks(app):
+    from api.cache import stat_cache, mark_stale
+    from ext import database
+    with app.app_context():
+        version = stat_cache.version()
+        database.session.execute(text('UPDATE subbranch SET fund = 1'))
+        mark_stale('query_user', '202101')
+        database.session.rollback()
+        database.session.commit()
+        assert stat_cache.version() == version
+
+
+def test_local_cache_entries_expire():
+    from api.cache import LocalCache
+    cache = LocalCache(ttl=60)
+    cache.set('query_user', '202101', '202112', [1], cache.version())
+    assert cache.get('query_user', '202101', '202112') == [1]
+    cache.ttl = 0
+    cache.set('query_user', '202101', '202112', [2], cache.version())
+    assert cache.get('query_user', '202101', '202112') is None
+
+
+def test_loan_distribution_measures_outstanding_balance(client):
+    """
+    贷款余额为已发放金额，未发放部分不计入
+    """
+    ids = [client.post('/loan/create', {'user_list': ['C1'], 'total_fund': 100, 'sub_branch': 'B1'})['data']['loan_id']
+           for _ in range(2)]
+    assert client.post('/loan/pay', {'loan_id': ids[0], 'fund': 30})['success']
+    r = client.post('/stat/distribution/loan', {'branch': 'B1', 'quantiles': [0, 1]})
+    assert r['success'], r
+    assert r['data']['count'] == 2
+    assert r['data']['quantiles'] == {'0': 0.0, '1': 30.0}
+    assert r['data']['branches'][0]['sum'] == 30.0